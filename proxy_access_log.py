@@ -0,0 +1,350 @@
+"""
+Connection Access Log
+Fixed-size memory-mapped ring of binary per-connection records written by the relay (one
+struct copy per closed connection, no syscalls) and an offline analyzer that streams it:
+
+    python proxy_access_log.py x_access.log --rules pac_rules.json --top 20
+"""
+import argparse
+import json
+import mmap
+import os
+import socket
+import struct
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional
+
+MAGIC = b'JPAL'
+VERSION = 1
+# magic, version, record size, capacity, records written (head), created
+HEADER = struct.Struct('<4sHHIQd')
+HEADER_SIZE = 64
+HEAD_OFFSET = 12
+# seq, start time, duration ms, setup ms, bytes up, bytes down, dest port, upstream port,
+# upstream index, flags, client address (IPv6 / IPv4-mapped), host length, host (last HOST_MAX bytes)
+RECORD = struct.Struct('<QdffQQHHBB16sB65s')
+HOST_MAX = 65
+FLAG_ESTABLISHED = 1
+NO_UPSTREAM = 0xFF
+DEFAULT_RECORDS = 65536  # 8 MiB
+
+
+# ==================== RECORDS ====================
+@dataclass
+class AccessRecord:
+    """One finished client connection."""
+    seq: int
+    started: float
+    duration_ms: float
+    setup_ms: float
+    bytes_up: int
+    bytes_down: int
+    dest_host: str
+    dest_port: int
+    client: str
+    upstream: Optional[int]
+    upstream_port: int
+    established: bool
+
+
+def pack_client(ip: str) -> bytes:
+    """Client address as 16 bytes (IPv4 is stored IPv4-mapped)."""
+    try:
+        if ':' in ip:
+            return socket.inet_pton(socket.AF_INET6, ip.split('%')[0])
+        return b'\0' * 10 + b'\xff\xff' + socket.inet_aton(ip)
+    except (OSError, ValueError):
+        return b'\0' * 16
+
+
+def unpack_client(raw: bytes) -> str:
+    if raw[:12] == b'\0' * 10 + b'\xff\xff':
+        return socket.inet_ntoa(raw[12:])
+    return socket.inet_ntop(socket.AF_INET6, raw)
+
+
+# ==================== WRITER ====================
+class AccessLog:
+    """
+    Single-writer ring buffer in a memory-mapped file.
+
+    The file is preallocated once; writing a record is a struct copy into the
+    mapping plus a head counter update, and the OS writes pages back on its own,
+    so the relay never waits on disk. A slot's sequence number works as a
+    seqlock: it is cleared before the slot is rewritten and set last, so
+    readers can detect records torn by a concurrent write. The oldest records are overwritten once
+    capacity records have been written. Each relay process needs its own file.
+    """
+
+    def __init__(self, path: str, capacity: int = DEFAULT_RECORDS):
+        self.path = path
+        self.capacity = max(1, capacity)
+        size = HEADER_SIZE + self.capacity * RECORD.size
+        self.head = 0
+        self._file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        try:
+            header = self._file.read(HEADER.size)
+            if len(header) == HEADER.size and self._compatible(HEADER.unpack(header)) \
+                    and os.fstat(self._file.fileno()).st_size == size:
+                self.head = HEADER.unpack(header)[4]
+            else:
+                self._initialize(size)
+            self._map = mmap.mmap(self._file.fileno(), size)
+        except Exception:
+            self._file.close()
+            raise
+
+    def _compatible(self, header: tuple) -> bool:
+        magic, version, record_size, capacity = header[:4]
+        return magic == MAGIC and version == VERSION and record_size == RECORD.size and capacity == self.capacity
+
+    def _initialize(self, size: int) -> None:
+        """Write header and zeroed slots (real blocks, so a full disk fails here and not in the mapping)."""
+        self._file.seek(0)
+        self._file.truncate()
+        header = HEADER.pack(MAGIC, VERSION, RECORD.size, self.capacity, 0, time.time())
+        self._file.write(header.ljust(HEADER_SIZE, b'\0'))
+        zeros = bytes(1024 * RECORD.size)
+        left = size - HEADER_SIZE
+        while left > 0:
+            left -= self._file.write(zeros[:left])
+        self._file.flush()
+
+    def write(self, started: float, duration_ms: float, setup_ms: float, bytes_up: int, bytes_down: int,
+              dest_host: str, dest_port: int, client: str, upstream: Optional[int] = None,
+              upstream_port: int = 0, established: bool = True) -> None:
+        """Append one record (overwrites the oldest when the ring is full)."""
+        seq = self.head
+        # Keep the tail of long names: the registrable domain is what the analyzer groups by
+        host = dest_host.encode('utf-8', 'replace')[-HOST_MAX:]
+        offset = HEADER_SIZE + (seq % self.capacity) * RECORD.size
+        struct.pack_into('<Q', self._map, offset, 0)  # Slot invalid while it is rewritten
+        RECORD.pack_into(self._map, offset,
+                         0, started, duration_ms, setup_ms, bytes_up, bytes_down, dest_port,
+                         upstream_port, NO_UPSTREAM if upstream is None else min(upstream, NO_UPSTREAM - 1),
+                         FLAG_ESTABLISHED if established else 0, pack_client(client), len(host), host)
+        struct.pack_into('<Q', self._map, offset, seq + 1)
+        self.head = seq + 1
+        struct.pack_into('<Q', self._map, HEAD_OFFSET, self.head)
+
+    def close(self) -> None:
+        try:
+            self._map.flush()
+            self._map.close()
+        finally:
+            self._file.close()
+
+
+# ==================== READER ====================
+def read_records(path: str) -> Iterator[AccessRecord]:
+    """
+    Stream records of one ring file, oldest first.
+
+    Safe to run while the relay is writing: a slot is used only if its
+    sequence number is the expected one both before and after unpacking,
+    so slots being rewritten or overwritten during the read are skipped.
+
+    Raises:
+        ValueError: Not an access log file
+    """
+    with open(path, 'rb') as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError(f"{path}: not an access log")
+        magic, version, record_size, capacity, head, _ = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            raise ValueError(f"{path}: not an access log (or unsupported version)")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            for seq in range(max(0, head - capacity), head):
+                offset = HEADER_SIZE + (seq % capacity) * RECORD.size
+                fields = RECORD.unpack_from(view, offset)
+                if fields[0] != seq + 1 or struct.unpack_from('<Q', view, offset)[0] != seq + 1:
+                    continue  # Being rewritten or overwritten by the writer while we were reading
+                (_, started, duration_ms, setup_ms, bytes_up, bytes_down, dest_port, upstream_port,
+                 upstream, flags, client, host_len, host) = fields
+                yield AccessRecord(seq, started, duration_ms, setup_ms, bytes_up, bytes_down,
+                                   host[:host_len].decode('utf-8', 'replace'), dest_port, unpack_client(client),
+                                   None if upstream == NO_UPSTREAM else upstream, upstream_port,
+                                   bool(flags & FLAG_ESTABLISHED))
+
+
+# ==================== ANALYZER ====================
+def load_rule_groups(path: Optional[str]) -> Dict[str, str]:
+    """
+    Domain -> rule group label from pac_rules.json ("proxy", "direct" and "bandwidth_mbps" sections).
+
+    Args:
+        path: Path to pac_rules.json (None or missing gives no groups)
+
+    Returns:
+        Dict for proxy_relay.match_domain lookups
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    groups = {}
+    for section, label in (('direct', 'direct'), ('proxy', 'proxy'), ('bandwidth_mbps', 'limit')):
+        for domain in data.get(section, []):
+            domain = domain.lower().lstrip('*.')
+            groups[domain] = f"{label} {domain}"
+    return groups
+
+
+def percentiles(values: List[float], points: Iterable[float] = (50, 90, 99)) -> Dict[str, float]:
+    """Nearest-rank percentiles plus max ({} for no values)."""
+    if not values:
+        return {}
+    ordered = sorted(values)
+    result = {f"p{p:g}": ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+              for p in points}
+    result['max'] = ordered[-1]
+    return result
+
+
+def analyze(records: Iterable[AccessRecord], rules: Optional[Dict[str, str]] = None,
+            top: int = 10, since: float = 0.0) -> Dict[str, object]:
+    """
+    Summarize access records in one pass.
+
+    Args:
+        records: Records from one or more ring files
+        rules: Rule groups from load_rule_groups (connections matching none go to "(default)")
+        top: Number of destinations to list
+        since: Skip connections started before this Unix time
+
+    Returns:
+        Dict with totals, top destinations by bytes, setup/duration percentiles,
+        bytes per rule group and per tunnel
+    """
+    from proxy_relay import match_domain
+
+    rules = rules or {}
+    totals = {'connections': 0, 'failed': 0, 'bytes_up': 0, 'bytes_down': 0}
+    first, last = None, None
+    setup, duration = [], []
+    destinations: Dict[str, Dict[str, float]] = {}
+    groups: Dict[str, Dict[str, int]] = {}
+    tunnels: Dict[str, Dict[str, int]] = {}
+    group_cache: Dict[str, str] = {}
+    for r in records:
+        if r.started < since:
+            continue
+        totals['connections'] += 1
+        first = r.started if first is None else min(first, r.started)
+        last = r.started if last is None else max(last, r.started)
+        if not r.established:
+            totals['failed'] += 1
+        else:
+            setup.append(r.setup_ms)
+            duration.append(r.duration_ms)
+        moved = r.bytes_up + r.bytes_down
+        totals['bytes_up'] += r.bytes_up
+        totals['bytes_down'] += r.bytes_down
+
+        dest = destinations.setdefault(f"{r.dest_host}:{r.dest_port}",
+                                       {'connections': 0, 'failed': 0, 'bytes': 0, 'setup_ms_sum': 0.0})
+        dest['connections'] += 1
+        dest['bytes'] += moved
+        if r.established:
+            dest['setup_ms_sum'] += r.setup_ms
+        else:
+            dest['failed'] += 1
+
+        group = group_cache.get(r.dest_host)
+        if group is None:
+            group = group_cache[r.dest_host] = match_domain(r.dest_host, rules) or "(default)"
+        entry = groups.setdefault(group, {'connections': 0, 'bytes_up': 0, 'bytes_down': 0})
+        entry['connections'] += 1
+        entry['bytes_up'] += r.bytes_up
+        entry['bytes_down'] += r.bytes_down
+
+        tunnel = '-' if r.upstream is None else f"#{r.upstream} :{r.upstream_port}"
+        entry = tunnels.setdefault(tunnel, {'connections': 0, 'failed': 0, 'bytes': 0})
+        entry['connections'] += 1
+        entry['failed'] += not r.established
+        entry['bytes'] += moved
+
+    ranked = sorted(destinations.items(), key=lambda kv: kv[1]['bytes'], reverse=True)[:top]
+    return {
+        'totals': totals,
+        'first': first,
+        'last': last,
+        'setup_ms': percentiles(setup),
+        'duration_ms': percentiles(duration),
+        'top_destinations': [
+            {'destination': name, 'connections': d['connections'], 'failed': d['failed'], 'bytes': d['bytes'],
+             'avg_setup_ms': d['setup_ms_sum'] / (d['connections'] - d['failed'])
+             if d['connections'] > d['failed'] else None}
+            for name, d in ranked],
+        'rule_groups': dict(sorted(groups.items(), key=lambda kv: kv[1]['bytes_up'] + kv[1]['bytes_down'],
+                                   reverse=True)),
+        'tunnels': tunnels,
+    }
+
+
+def _size(n: float) -> str:
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if n < 1024 or unit == 'GiB':
+            return f"{n:.0f} {unit}" if unit == 'B' else f"{n:.1f} {unit}"
+        n /= 1024
+
+
+def print_report(report: Dict[str, object]) -> None:
+    totals = report['totals']
+    if not totals['connections']:
+        print("No connections recorded")
+        return
+    span = time.strftime('%Y-%m-%d %H:%M', time.localtime(report['first'])) + " .. " + \
+        time.strftime('%Y-%m-%d %H:%M', time.localtime(report['last']))
+    print(f"{totals['connections']} connections ({totals['failed']} failed), {span}")
+    print(f"Up {_size(totals['bytes_up'])}, down {_size(totals['bytes_down'])}")
+    for name in ('setup_ms', 'duration_ms'):
+        if report[name]:
+            print(f"{name:12} " + "  ".join(f"{k} {v:9.1f}" for k, v in report[name].items()))
+    print("\nTop destinations by bytes:")
+    for d in report['top_destinations']:
+        setup = f"{d['avg_setup_ms']:8.1f} ms" if d['avg_setup_ms'] is not None else "       - ms"
+        print(f"  {d['destination']:45} {d['connections']:7} conn {d['failed']:5} fail "
+              f"{_size(d['bytes']):>11} {setup}")
+    print("\nBytes per rule group:")
+    for name, g in report['rule_groups'].items():
+        print(f"  {name:45} {g['connections']:7} conn  up {_size(g['bytes_up']):>11}  "
+              f"down {_size(g['bytes_down']):>11}")
+    print("\nTunnels:")
+    for name, t in report['tunnels'].items():
+        print(f"  {name:20} {t['connections']:7} conn {t['failed']:5} fail {_size(t['bytes']):>11}")
+
+
+# ==================== MAIN ====================
+def main() -> None:
+    """Analyzer entry point."""
+    parser = argparse.ArgumentParser(description="Summarize relay access logs")
+    parser.add_argument('files', nargs='+', help="Access log file(s), e.g. x_access.log or x_access.log.* (workers)")
+    parser.add_argument('--rules', default="pac_rules.json", help="PAC rules for grouping")
+    parser.add_argument('--top', type=int, default=10, help="Destinations to list")
+    parser.add_argument('--since-hours', type=float, default=0, help="Only connections of the last N hours")
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args()
+
+    def records() -> Iterator[AccessRecord]:
+        for path in args.files:
+            yield from read_records(path)
+
+    try:
+        rules = load_rule_groups(args.rules)
+        since = time.time() - args.since_hours * 3600 if args.since_hours > 0 else 0.0
+        report = analyze(records(), rules, args.top, since)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
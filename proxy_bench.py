@@ -0,0 +1,570 @@
+"""
+Benchmarks for the Local Proxy Components
+Stand-alone load generators; each subcommand starts its own local sink and the component under test.
+
+    python proxy_bench.py relay --connections 10000 --bulk 8 --duration 10
+    python proxy_bench.py workers --max-workers 4 --duration 5
+    python proxy_bench.py startup --runs 10
+    python proxy_bench.py pac --hosts 1000000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+from proxy_relay import raise_fd_limit
+from proxy_socks import read_address, socks5_handshake
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Destination ports understood by the sink
+PORT_ECHO = 7
+PORT_IDLE = 9
+PORT_CHARGEN = 19
+
+
+# ==================== HELPERS ====================
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def read_rss_kb(pid: int) -> Optional[int]:
+    """Resident set size of a process in KiB (Linux /proc only)."""
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+async def wait_for_port(port: int, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.05)
+
+
+def spawn(args: List[str]) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable] + args, cwd=HERE, stdin=subprocess.DEVNULL)
+
+
+def free_port() -> int:
+    import socket
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# ==================== SINK ====================
+async def _sink_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """SOCKS5-terminating sink standing in for ssh -D plus the remote servers."""
+    try:
+        _, nmethods = await reader.readexactly(2)
+        await reader.readexactly(nmethods)
+        writer.write(b'\x05\x00')
+        await reader.readexactly(3)
+        _, port = await read_address(reader)
+        writer.write(b'\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00')
+        await writer.drain()
+        if port == PORT_ECHO:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        elif port == PORT_CHARGEN:
+            block = b'x' * 65536
+            while True:
+                writer.write(block)
+                await writer.drain()
+        else:
+            while await reader.read(65536):
+                pass
+    except (asyncio.IncompleteReadError, ConnectionError, OSError):
+        pass
+    finally:
+        writer.close()
+
+
+async def run_sink(port: int) -> None:
+    server = await asyncio.start_server(_sink_client, '127.0.0.1', port, backlog=4096)
+    async with server:
+        await server.serve_forever()
+
+
+# ==================== RELAY BENCHMARK ====================
+async def _open_flow(port: int, dest_port: int) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter, float]:
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    await socks5_handshake(reader, writer, 'sink.invalid', dest_port)
+    return reader, writer, (time.perf_counter() - start) * 1000
+
+
+async def _bulk_reader(reader: asyncio.StreamReader, counter: List[int]) -> None:
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            counter[0] += len(data)
+    except (ConnectionError, OSError):
+        pass
+
+
+async def bench_relay(args: argparse.Namespace) -> None:
+    """Idle connections + bulk downloads + one interactive echo flow through the relay."""
+    soft = raise_fd_limit()
+    if soft and soft < args.connections * 2 + 256:
+        print(f"⚠ RLIMIT_NOFILE={soft} is low for {args.connections} connections; "
+              f"the relay needs about twice that many descriptors")
+
+    sink_port, relay_port = free_port(), free_port()
+    sink = spawn([os.path.basename(__file__), 'sink', '--port', str(sink_port)])
+    relay_args = ['proxy_relay.py', '--port', str(relay_port), '--upstream', f'127.0.0.1:{sink_port}',
+                  '--conn-buffer-kb', str(args.conn_buffer_kb)]
+    if args.memory_cap_mb:
+        relay_args += ['--memory-cap-mb', str(args.memory_cap_mb)]
+    if args.link_down_mbps:
+        relay_args += ['--link-down-mbps', str(args.link_down_mbps), '--fair-key', 'port']
+    relay = spawn(relay_args)
+    flows = []
+    try:
+        await wait_for_port(sink_port)
+        await wait_for_port(relay_port)
+        rss_start = read_rss_kb(relay.pid)
+
+        # 1. Idle connections (burst timings include waiting behind the other handshakes in flight)
+        burst_ms: List[float] = []
+        queue_ms: List[float] = []
+        failures = 0
+        semaphore = asyncio.Semaphore(args.parallel)
+
+        async def open_idle() -> None:
+            nonlocal failures
+            queued = time.perf_counter()
+            async with semaphore:
+                queue_ms.append((time.perf_counter() - queued) * 1000)
+                try:
+                    reader, writer, ms = await _open_flow(relay_port, PORT_IDLE)
+                    flows.append(writer)
+                    burst_ms.append(ms)
+                except (OSError, asyncio.IncompleteReadError):
+                    failures += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(open_idle() for _ in range(args.connections)))
+        open_time = time.perf_counter() - start
+        rss_idle = read_rss_kb(relay.pid)
+
+        # One handshake at a time with all idle connections open: setup latency alone
+        setup_ms: List[float] = []
+        for _ in range(args.setup_samples):
+            try:
+                _, writer, ms = await _open_flow(relay_port, PORT_IDLE)
+                writer.close()
+                setup_ms.append(ms)
+            except (OSError, asyncio.IncompleteReadError):
+                failures += 1
+
+        # 2. Bulk transfers + interactive flow
+        bulk_bytes = [0]
+        bulk_tasks = []
+        for _ in range(args.bulk):
+            reader, writer, _ = await _open_flow(relay_port, PORT_CHARGEN)
+            flows.append(writer)
+            bulk_tasks.append(asyncio.ensure_future(_bulk_reader(reader, bulk_bytes)))
+        reader, writer, _ = await _open_flow(relay_port, PORT_ECHO)
+        flows.append(writer)
+
+        rtts: List[float] = []
+        rss_peak = rss_idle or 0
+        payload = b'p' * 64
+        bulk_start = time.perf_counter()
+        deadline = bulk_start + args.duration
+        while time.perf_counter() < deadline:
+            t0 = time.perf_counter()
+            writer.write(payload)
+            await writer.drain()
+            await reader.readexactly(len(payload))
+            rtts.append((time.perf_counter() - t0) * 1000)
+            rss_peak = max(rss_peak, read_rss_kb(relay.pid) or 0)
+            await asyncio.sleep(args.interval / 1000)
+        elapsed = time.perf_counter() - bulk_start
+        for task in bulk_tasks:
+            task.cancel()
+
+        opened = len(burst_ms)
+        print("=" * 60)
+        print(f"Relay benchmark: {opened}/{args.connections} idle connections "
+              f"({failures} failed) in {open_time:.1f}s, {args.bulk} bulk flows, {args.duration}s")
+        print("=" * 60)
+        print(f" CONNECT setup   p50 {percentile(setup_ms, 50):8.2f} ms   p99 {percentile(setup_ms, 99):8.2f} ms"
+              f"   (one at a time, {len(setup_ms)} samples)")
+        print(f" Burst setup     p50 {percentile(burst_ms, 50):8.2f} ms   p99 {percentile(burst_ms, 99):8.2f} ms"
+              f"   ({args.parallel} in flight)")
+        print(f" Burst queueing  p50 {percentile(queue_ms, 50):8.2f} ms   p99 {percentile(queue_ms, 99):8.2f} ms")
+        print(f" Interactive RTT p50 {percentile(rtts, 50):8.2f} ms   p99 {percentile(rtts, 99):8.2f} ms"
+              f"   max {max(rtts) if rtts else float('nan'):8.2f} ms ({len(rtts)} samples)")
+        print(f" Bulk throughput {bulk_bytes[0] * 8 / elapsed / 1e6:8.1f} Mbit/s")
+        if rss_start is not None:
+            per_conn = (rss_idle - rss_start) / max(1, opened)
+            print(f" Relay RSS       start {rss_start / 1024:.1f} MiB, idle {rss_idle / 1024:.1f} MiB "
+                  f"({per_conn:.1f} KiB/conn), peak {rss_peak / 1024:.1f} MiB")
+        else:
+            print(" Relay RSS       n/a (needs /proc)")
+        if rtts:
+            print(f" Interactive mean {statistics.mean(rtts):.2f} ms")
+    finally:
+        for flow in flows:
+            flow.close()
+        relay.terminate()
+        sink.terminate()
+        relay.wait()
+        sink.wait()
+
+
+# ==================== WORKER SCALING BENCHMARK ====================
+async def run_load(args: argparse.Namespace) -> None:
+    """One load-generator process: CONNECT churn or bulk reads for a fixed time; prints JSON."""
+    deadline = time.perf_counter() + args.duration
+    result = {'connections': 0, 'errors': 0, 'bytes': 0}
+
+    async def churn() -> None:
+        while time.perf_counter() < deadline:
+            try:
+                _, writer, _ = await _open_flow(args.port, PORT_IDLE)
+                writer.close()
+                result['connections'] += 1
+            except (OSError, asyncio.IncompleteReadError):
+                result['errors'] += 1
+
+    async def bulk() -> None:
+        counter = [0]
+        reader, writer, _ = await _open_flow(args.port, PORT_CHARGEN)
+        task = asyncio.ensure_future(_bulk_reader(reader, counter))
+        await asyncio.sleep(max(0.0, deadline - time.perf_counter()))
+        task.cancel()
+        writer.close()
+        result['bytes'] += counter[0]
+
+    job = churn if args.mode == 'cps' else bulk
+    await asyncio.gather(*(job() for _ in range(args.concurrency)), return_exceptions=True)
+    print(json.dumps(result))
+
+
+async def _run_clients(port: int, mode: str, clients: int, concurrency: int, duration: float) -> Dict[str, int]:
+    procs = [await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(HERE, os.path.basename(__file__)), 'load', '--port', str(port),
+        '--mode', mode, '--concurrency', str(concurrency), '--duration', str(duration),
+        stdout=asyncio.subprocess.PIPE, cwd=HERE) for _ in range(clients)]
+    totals = {'connections': 0, 'errors': 0, 'bytes': 0}
+    for proc in procs:
+        out, _ = await proc.communicate()
+        try:
+            for key, value in json.loads(out.decode().strip().splitlines()[-1]).items():
+                totals[key] += value
+        except (ValueError, IndexError):
+            totals['errors'] += 1
+    return totals
+
+
+async def bench_workers(args: argparse.Namespace) -> None:
+    """Connections/s and throughput of proxy_workers.py for 1..N worker processes."""
+    counts = sorted({n for n in (1, 2, 4, 8, 16, 32, args.max_workers) if n <= args.max_workers})
+    clients = args.clients or max(2, os.cpu_count() or 1)
+    sink_port = free_port()
+    sink = spawn([os.path.basename(__file__), 'sink', '--port', str(sink_port)])
+    rows = []
+    try:
+        await wait_for_port(sink_port)
+        for workers in counts:
+            port = free_port()
+            pool = spawn(['proxy_workers.py', '--workers', str(workers), '--port', str(port),
+                          '--upstream', f'127.0.0.1:{sink_port}', '--stats-file', os.devnull])
+            try:
+                await wait_for_port(port)
+                await asyncio.sleep(0.5)  # let every worker bind before measuring
+                cps = await _run_clients(port, 'cps', clients, args.concurrency, args.duration)
+                bulk = await _run_clients(port, 'bulk', clients, args.bulk, args.duration)
+            finally:
+                pool.terminate()
+                pool.wait()
+            rows.append((workers, cps['connections'] / args.duration,
+                         bulk['bytes'] * 8 / args.duration / 1e6, cps['errors'] + bulk['errors']))
+    finally:
+        sink.terminate()
+        sink.wait()
+
+    print("=" * 60)
+    print(f"Worker scaling: {clients} client processes, {args.duration}s per run, "
+          f"{os.cpu_count()} CPU(s)")
+    print("=" * 60)
+    print(f"{'workers':>8} {'conn/s':>10} {'speedup':>8} {'Mbit/s':>10} {'speedup':>8} {'errors':>7}")
+    base_cps, base_tput = rows[0][1] or 1, rows[0][2] or 1
+    for workers, cps, tput, errors in rows:
+        print(f"{workers:>8} {cps:>10.0f} {cps / base_cps:>7.2f}x {tput:>10.1f} {tput / base_tput:>7.2f}x {errors:>7}")
+
+
+# ==================== STARTUP BENCHMARK ====================
+STARTUP_MODULES = ['proxy_start_v25', 'proxy_relay', 'proxy_dns', 'proxy_http', 'proxy_ssh_transport', 'proxy_jump']
+
+# Helpers the launcher starts, with arguments that make them listen without a tunnel
+LISTEN_TARGETS = {
+    'proxy_relay.py': ['--upstream', '127.0.0.1:9'],
+    'proxy_http.py': ['--socks-port', '9'],
+    'proxy_dns.py': ['--socks-port', '9'],
+}
+
+
+def _bytecode_env() -> Dict[str, str]:
+    """Environment that caches bytecode, as a normal install does."""
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    return env
+
+
+def parse_importtime(stderr: str) -> Dict[str, Tuple[int, int]]:
+    """Map module -> (self us, cumulative us) from -X importtime output (top-level entries win)."""
+    result: Dict[str, Tuple[int, int]] = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            result.setdefault(name.strip(), (int(self_us), int(cumulative_us)))
+        except ValueError:
+            continue
+    return result
+
+
+def measure_imports(module: str, runs: int) -> Tuple[float, float, Dict[str, Tuple[int, int]]]:
+    """Median cumulative import time (ms), median wall time of the interpreter (ms), last breakdown."""
+    cumulative, wall = [], []
+    breakdown: Dict[str, Tuple[int, int]] = {}
+    env = _bytecode_env()
+    subprocess.run([sys.executable, '-c', f'import {module}'], cwd=HERE, env=env, capture_output=True)  # warm pyc
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                              cwd=HERE, env=env, capture_output=True, text=True)
+        wall.append((time.perf_counter() - start) * 1000)
+        breakdown = parse_importtime(proc.stderr)
+        if proc.returncode != 0 or module not in breakdown:
+            raise RuntimeError(f"import {module} failed: {proc.stderr.strip().splitlines()[-1:]}")
+        cumulative.append(breakdown[module][1] / 1000)
+    return statistics.median(cumulative), statistics.median(wall), breakdown
+
+
+async def time_to_listening(script: str, extra: List[str], runs: int) -> float:
+    """Median ms from spawning a helper until its port accepts connections."""
+    samples = []
+    for _ in range(runs):
+        port = free_port()
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, script, '--port', str(port)] + extra, cwd=HERE,
+                                env=_bytecode_env(), stdin=subprocess.DEVNULL,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            await wait_for_port(port)
+            samples.append((time.perf_counter() - start) * 1000)
+        finally:
+            proc.terminate()
+            proc.wait()
+    return statistics.median(samples)
+
+
+async def bench_startup(args: argparse.Namespace) -> None:
+    """Import cost (-X importtime) of each entry point and time-to-listening of the helpers."""
+    env = _bytecode_env()
+    bare = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], env=env, capture_output=True)
+        bare.append((time.perf_counter() - start) * 1000)
+
+    print("=" * 60)
+    print(f"Startup: median of {args.runs} runs, bare interpreter {statistics.median(bare):.1f} ms")
+    print("=" * 60)
+    print(f"{'module':24} {'imports ms':>11} {'process ms':>11}")
+    launcher_breakdown: Dict[str, Tuple[int, int]] = {}
+    for module in STARTUP_MODULES:
+        try:
+            imports_ms, wall_ms, breakdown = measure_imports(module, args.runs)
+        except RuntimeError as e:
+            print(f"{module:24} {'n/a':>11} {'':>11} {e}")
+            continue
+        if module == 'proxy_start_v25':
+            launcher_breakdown = breakdown
+        print(f"{module:24} {imports_ms:>11.1f} {wall_ms:>11.1f}")
+
+    print(f"\n{'helper':24} {'to listening ms':>16}")
+    for script, extra in LISTEN_TARGETS.items():
+        print(f"{script:24} {await time_to_listening(script, extra, args.runs):>16.1f}")
+
+    if launcher_breakdown:
+        print(f"\nHeaviest imports of proxy_start_v25 (cumulative ms):")
+        top = sorted(((cum, name) for name, (_, cum) in launcher_breakdown.items() if name != 'proxy_start_v25'),
+                     reverse=True)
+        for cum, name in top[:args.top]:
+            print(f" {name:30} {cum / 1000:8.1f}")
+
+
+# ==================== PAC RESOLVE BENCHMARK ====================
+def synthetic_pac_workload(hosts: int, learned: int, seed: int = 1) -> Tuple[Dict[str, List[str]], List[str]]:
+    """Learned rules plus a host mix: learned subdomains, template rules, unknown names and IPs."""
+    rng = random.Random(seed)
+    tlds = ['com', 'net', 'org', 'io', 'ru', 'de']
+    domains = [f"site{i}.{rng.choice(tlds)}" for i in range(learned)]
+    rules = {'proxy': domains[::2], 'direct': domains[1::2]}
+    words = ['api', 'cdn', 'www', 'static', 'mail', 'img', 'm', 'login']
+    template = ['news.ru', 'printer.local', 'vk.com', 'm.vk.com', 'yandex.ru', 'deepseek.com', 'localhost']
+    names = []
+    for _ in range(hosts):
+        k = rng.random()
+        if k < 0.4:
+            names.append(f"{rng.choice(words)}.{rng.choice(domains)}")
+        elif k < 0.55:
+            names.append(f"{rng.choice(words)}{rng.randint(0, 999)}.{rng.choice(template)}")
+        elif k < 0.9:
+            names.append(f"{rng.choice(words)}.host{rng.randint(0, 10 ** 6)}.{rng.choice(tlds)}")
+        else:
+            names.append(f"{rng.choice([10, 127, 192, 172, 8])}.{rng.randint(0, 255)}.{rng.randint(0, 255)}."
+                         f"{rng.randint(0, 255)}")
+    return rules, names
+
+
+async def bench_pac(args: argparse.Namespace) -> None:
+    """Compiled PAC lookups in process and through proxy_pac_server.py /resolve batches."""
+    from proxy_pac_optimizer import render_pac_rules
+    from proxy_pac_rules import compile_pac_file
+    from proxy_pac_server import PacClient
+
+    rules, hosts = synthetic_pac_workload(args.hosts, args.learned)
+    with open(os.path.join(HERE, 'proxy_pac.back'), 'r', encoding='utf-8') as f:
+        template = f.read()
+    proxy = "SOCKS5 127.0.0.1:1080"
+    with tempfile.TemporaryDirectory() as tmp:
+        pac_path = os.path.join(tmp, 'proxy.pac')
+        with open(pac_path, 'w', encoding='utf-8') as f:
+            f.write(template.replace('    // __LEARNED_RULES__\n', render_pac_rules(rules, proxy)))
+
+        start = time.perf_counter()
+        compiled = compile_pac_file(pac_path)
+        compile_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        local = compiled.resolve_many(hosts)
+        local_s = time.perf_counter() - start
+        sample = random.Random(2).sample(range(len(hosts)), min(args.verify, len(hosts)))
+        mismatches = sum(compiled.resolve_linear(hosts[i]) != local[i] for i in sample)
+
+        port = free_port()
+        server = spawn([os.path.join(HERE, 'proxy_pac_server.py'), '--port', str(port), '--pac', pac_path])
+        try:
+            await wait_for_port(port)
+            client = PacClient(f"http://127.0.0.1:{port}", batch=args.batch)
+            client.resolve('warmup.example')  # Compiles the PAC in the server
+            start = time.perf_counter()
+            remote = client.resolve_many(hosts)
+            remote_s = time.perf_counter() - start
+            client.close()
+        finally:
+            server.terminate()
+            server.wait()
+
+    cache = compiled.resolve.cache_info()
+    print("=" * 60)
+    print(f"PAC resolve: {len(hosts)} hosts, {args.learned} learned domains, "
+          f"{len(compiled.results)} rule blocks (compiled in {compile_ms:.0f} ms)")
+    print("=" * 60)
+    print(f" In process      {len(hosts) / local_s:>12,.0f} hosts/s   LRU hits {cache.hits} / {cache.hits + cache.misses}")
+    print(f" /resolve batch  {len(hosts) / remote_s:>12,.0f} hosts/s   ({len(hosts) / remote_s * 3600 / 1e6:,.0f}M/hour, "
+          f"batch {args.batch})")
+    print(f" Reference check {len(sample) - mismatches}/{len(sample)} equal to sequential PAC evaluation, "
+          f"server {'equal' if remote == local else 'DIFFERENT'}")
+
+
+# ==================== MAIN ====================
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks for the local proxy components")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('sink', help="Run SOCKS5-terminating sink (used by other benchmarks)")
+    p.add_argument('--port', type=int, required=True)
+
+    p = sub.add_parser('relay', help="Stress proxy_relay.py: idle + bulk + interactive flows")
+    p.add_argument('--connections', type=int, default=10000, help="Concurrent idle CONNECTs")
+    p.add_argument('--parallel', type=int, default=500, help="Handshakes in flight while opening")
+    p.add_argument('--setup-samples', type=int, default=200, help="Sequential handshakes timed after opening")
+    p.add_argument('--bulk', type=int, default=8, help="Bulk download flows")
+    p.add_argument('--duration', type=float, default=10.0, help="Seconds of bulk + interactive traffic")
+    p.add_argument('--interval', type=float, default=10.0, help="Interactive ping interval in ms")
+    p.add_argument('--conn-buffer-kb', type=int, default=64)
+    p.add_argument('--memory-cap-mb', type=float, default=0)
+    p.add_argument('--link-down-mbps', type=float, default=0,
+                   help="Enable fair queueing with this downlink rate")
+
+    p = sub.add_parser('workers', help="Scale proxy_workers.py from 1 to N processes")
+    p.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+    p.add_argument('--clients', type=int, default=0, help="Load-generator processes (default: CPUs)")
+    p.add_argument('--concurrency', type=int, default=32, help="Concurrent CONNECT loops per client")
+    p.add_argument('--bulk', type=int, default=4, help="Bulk flows per client")
+    p.add_argument('--duration', type=float, default=5.0)
+
+    p = sub.add_parser('load', help="Load generator process (used by the workers benchmark)")
+    p.add_argument('--port', type=int, required=True)
+    p.add_argument('--mode', choices=('cps', 'bulk'), required=True)
+    p.add_argument('--concurrency', type=int, default=32)
+    p.add_argument('--duration', type=float, default=5.0)
+
+    p = sub.add_parser('startup', help="Import cost and time-to-listening of the entry points")
+    p.add_argument('--runs', type=int, default=10)
+    p.add_argument('--top', type=int, default=10, help="Heaviest launcher imports to list")
+
+    p = sub.add_parser('pac', help="Batch /resolve throughput of proxy_pac_server.py")
+    p.add_argument('--hosts', type=int, default=1000000, help="Host names to resolve")
+    p.add_argument('--learned', type=int, default=20000, help="Learned PAC domains")
+    p.add_argument('--batch', type=int, default=50000, help="Hosts per POST")
+    p.add_argument('--verify', type=int, default=20000, help="Hosts checked against sequential evaluation")
+
+    args = parser.parse_args()
+    raise_fd_limit()
+    try:
+        if args.command == 'sink':
+            asyncio.run(run_sink(args.port))
+        elif args.command == 'relay':
+            asyncio.run(bench_relay(args))
+        elif args.command == 'workers':
+            asyncio.run(bench_workers(args))
+        elif args.command == 'load':
+            asyncio.run(run_load(args))
+        elif args.command == 'startup':
+            asyncio.run(bench_startup(args))
+        elif args.command == 'pac':
+            asyncio.run(bench_pac(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
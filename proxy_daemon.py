@@ -0,0 +1,469 @@
+"""
+Headless Proxy Daemon
+Non-interactive service mode for servers and shared gateways: selects the host from config or by
+measured ranking, supervises the tunnel and helpers without a TTY or system proxy changes,
+drains on SIGTERM, reloads on SIGHUP and reports readiness (sd_notify and a ready file).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from dataclasses import dataclass, fields
+from typing import Dict, List, Optional, Tuple
+
+import proxy_start_v25 as launcher
+from proxy_start_v25 import config, Config
+from proxy_workers import ManagedProcess, PoolSettings
+
+logger = logging.getLogger(__name__)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Config values the daemon uses unless the config file says otherwise:
+# the relay in front of the tunnel is what lets SIGTERM drain client connections.
+DAEMON_DEFAULTS = {'headless': True, 'relay_enabled': True, 'tray_enabled': False}
+
+FRONT_ENDS = ('relay', 'http', 'dns', 'pac')
+
+# Worst case of drain() beyond drain_timeout: SIGKILL grace of the front-ends, then the tunnel's
+# SIGTERM and SIGKILL waits (proxy_stop.py waits this long for the daemon to exit)
+STOP_GRACE = 5 + 5 + 10 + 5
+
+
+# ============ SETTINGS ============
+@dataclass
+class DaemonSettings:
+    """Daemon settings (command line; the config file's "daemon" section fills unset values)."""
+    config_file: Optional[str] = None
+    host: Optional[str] = None
+    rank: bool = False
+    drain_timeout: float = 30.0
+    ready_timeout: float = 30.0
+    health_interval: float = 10.0
+    ready_file: Optional[str] = None
+    pid_file: str = "x_daemon.pid"
+
+
+# ==================== SYSTEMD NOTIFY ====================
+def notify(*states: str) -> bool:
+    """
+    Send sd_notify(3) state lines (READY=1, STATUS=...) to the service manager.
+
+    Returns:
+        True if sent (False outside a Type=notify unit)
+    """
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address or not hasattr(socket, 'AF_UNIX'):
+        return False
+    if address.startswith('@'):
+        address = '\0' + address[1:]  # Abstract namespace socket
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall('\n'.join(states).encode())
+        return True
+    except OSError as e:
+        logger.debug(f"sd_notify failed: {e}")
+        return False
+
+
+def watchdog_interval() -> Optional[float]:
+    """Seconds between WATCHDOG=1 pings requested by systemd (half of WatchdogSec)."""
+    usec = os.environ.get('WATCHDOG_USEC', '')
+    pid = os.environ.get('WATCHDOG_PID', '')
+    if not usec.isdigit() or (pid and pid != str(os.getpid())):
+        return None
+    return int(usec) / 2e6
+
+
+# ==================== CONFIGURATION ====================
+def load_config_file(path: Optional[str]) -> Dict[str, object]:
+    """
+    Reset the shared launcher config to its defaults plus DAEMON_DEFAULTS and apply a JSON file.
+
+    Args:
+        path: JSON file with Config field overrides and an optional "daemon" section
+
+    Returns:
+        The "daemon" section (host, rank, candidates)
+
+    Raises:
+        ValueError: Unreadable file or invalid configuration (config is left unchanged)
+    """
+    data: Dict[str, object] = {}
+    if path:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            raise ValueError(f"Cannot read {path}: {e}")
+        if not isinstance(data, dict):
+            raise ValueError(f"{path} must contain a JSON object")
+    section = data.pop('daemon', {})
+
+    known = {f.name for f in fields(Config)}
+    unknown = sorted(set(data) - known)
+    if unknown:
+        logger.warning(f"Ignoring unknown config keys: {', '.join(unknown)}")
+
+    previous = dict(vars(config))
+    vars(config).update(vars(Config()))
+    vars(config).update(DAEMON_DEFAULTS)
+    vars(config).update({k: v for k, v in data.items() if k in known})
+    if not config.validate():
+        vars(config).update(previous)
+        raise ValueError("Configuration validation failed")
+    return section if isinstance(section, dict) else {}
+
+
+# ==================== HOST SELECTION ====================
+def rank_hosts(hosts: List[Dict[str, str]], names: List[str]) -> Optional[Dict[str, str]]:
+    """
+    Measure handshake time and throughput to each candidate host and pick the best
+    (same probe, cache and policy as bastion path selection).
+
+    Args:
+        hosts: Hosts from parse_ssh_config
+        names: Candidate host names
+
+    Returns:
+        Best host or None when no host could be measured
+    """
+    from proxy_jump import format_measurement, rank_paths
+
+    keys: Dict[str, str] = {}
+    for host in hosts:
+        if host['name'] in names:
+            key_path = launcher.validate_key_file(host.get('IdentityFile', ''))
+            if key_path:
+                keys[host['name']] = key_path
+    if not keys:
+        return None
+    # Probes run with BatchMode, so encrypted keys must be in the agent
+    passphrase = launcher.load_passphrase_from_file()
+    for key_path in set(keys.values()):
+        launcher.ensure_ssh_agent(key_path, passphrase)
+
+    probe_bytes = config.jump_probe_kb * 1024
+    best, _ = rank_paths(
+        [h for h in hosts if h['name'] in keys], hosts,
+        lambda h: launcher.build_probe_command(h, keys[h['name']], probe_bytes),
+        store_path=config.jump_store_file,
+        ttl_hours=config.jump_cache_hours,
+        probe_bytes=probe_bytes,
+        on_result=lambda m, cached: logger.info(format_measurement(m, cached))
+    )
+    return best
+
+
+def select_host(hosts: List[Dict[str, str]], settings: DaemonSettings,
+                section: Dict[str, object]) -> Dict[str, str]:
+    """
+    Pick the exit host: --host / "host", else measured ranking (--rank / "rank"),
+    else the auto-select host of the SSH config.
+
+    Raises:
+        ValueError: The named host does not exist or no host is usable
+    """
+    name = settings.host or section.get('host')
+    if name:
+        host = next((h for h in hosts if h['name'] == name), None)
+        if host is None:
+            raise ValueError(f"Host {name} not found in {config.ssh_config_path}")
+        return host
+    if settings.rank or section.get('rank'):
+        names = section.get('candidates') or [h['name'] for h in hosts]
+        host = rank_hosts(hosts, list(names))
+        if host is not None:
+            return host
+        logger.warning("No candidate host could be measured, falling back to the auto-select host")
+    host = launcher.select_host_menu(hosts)
+    if host is None:
+        raise ValueError("No host selected")
+    return host
+
+
+# ==================== CHILD PROCESSES ====================
+def prepare(settings: DaemonSettings) -> Tuple[Dict[str, str], Dict[str, List[str]]]:
+    """
+    Load configuration, select the host and build the command of every child process.
+    Blocking (agent, path probes); the daemon runs it in a thread.
+
+    Returns:
+        (selected host, {child name: argv})
+
+    Raises:
+        ValueError: Configuration or host selection failed
+    """
+    section = load_config_file(settings.config_file)
+    hosts = launcher.parse_ssh_config(config.ssh_config_path)
+    if not hosts:
+        raise ValueError(f"No hosts found in {config.ssh_config_path}")
+    host = select_host(hosts, settings, section)
+
+    key_path = launcher.validate_key_file(host.get('IdentityFile', ''))
+    if not key_path:
+        raise ValueError(f"No usable IdentityFile for {host['name']}")
+    passphrase = launcher.load_passphrase_from_file()
+    if config.ssh_backend == "ssh" and not launcher.ensure_ssh_agent(key_path, passphrase):
+        logger.warning("Failed to load key into ssh-agent, continuing...")
+    host = launcher.select_jump_path(host, hosts, key_path)
+    if not launcher.save_proxy_state(host, key_path, passphrase is not None):
+        logger.warning("Failed to save proxy state")
+
+    python = sys.executable
+    commands: Dict[str, List[str]] = {}
+    if config.ssh_backend == "paramiko":
+        commands['tunnel'] = ([python, os.path.join(HERE, 'proxy_ssh_transport.py')]
+                              + launcher.transport_arguments(host))
+    else:
+        commands['tunnel'] = launcher.build_ssh_command(host, key_path)
+    if config.relay_enabled:
+        commands['relay'] = ([python, os.path.join(HERE, 'proxy_relay.py')] + launcher.relay_arguments()
+                             + ['--drain-timeout', str(settings.drain_timeout)])
+    if config.http_proxy_enabled:
+        commands['http'] = [python, os.path.join(HERE, 'proxy_http.py')] + launcher.http_proxy_arguments()
+    if config.dns_stub_enabled:
+        commands['dns'] = [python, os.path.join(HERE, 'proxy_dns.py')] + launcher.dns_stub_arguments()
+
+    pac_path = os.path.join(config.work_dir, "proxy.pac")
+    if launcher.generate_pac_files(pac_path):
+        commands['pac'] = [python] + launcher.pac_server_arguments()
+    else:
+        logger.warning("Failed to generate PAC file, PAC server not started")
+    return host, commands
+
+
+def listening_ports(names: List[str]) -> List[Tuple[str, int]]:
+    """TCP addresses the given children must accept on before the daemon reports ready."""
+    front = launcher.local_proxy_host()
+    ports = {'tunnel': ('127.0.0.1', launcher.tunnel_port()), 'relay': (front, config.proxy_port),
+             'http': ('127.0.0.1', config.http_proxy_port), 'pac': (front, config.pac_http_port)}
+    return [ports[n] for n in names if n in ports]
+
+
+async def port_open(port: int, host: str = '127.0.0.1', timeout: float = 1.0) -> bool:
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+
+# ==================== DAEMON ====================
+class Daemon:
+    """Supervises the tunnel and helper processes of one proxy instance."""
+
+    def __init__(self, settings: DaemonSettings):
+        self.settings = settings
+        self.restart_settings = PoolSettings()  # Restart backoff of crashed children
+        self.children: Dict[str, ManagedProcess] = {}
+        self.child_stops: Dict[str, asyncio.Event] = {}
+        self.tasks: Dict[str, asyncio.Future] = {}
+        self.host: Dict[str, str] = {}
+        self.stopping = asyncio.Event()
+        self.reloading = asyncio.Event()
+
+    def start_child(self, name: str, argv: List[str]) -> None:
+        child = ManagedProcess(name, argv, self.restart_settings)
+        self.children[name] = child
+        self.child_stops[name] = asyncio.Event()
+        self.tasks[name] = asyncio.ensure_future(child.run(self.child_stops[name]))
+        logger.info(f"Started {name}: {' '.join(argv)}")
+
+    async def stop_children(self, names: List[str], timeout: float) -> None:
+        """SIGTERM the children together; SIGKILL whatever is left after timeout."""
+        names = [n for n in names if n in self.children]
+        for name in names:
+            self.child_stops[name].set()
+            self.children[name].terminate()
+        if not names:
+            return
+        _, pending = await asyncio.wait([self.tasks[n] for n in names], timeout=timeout)
+        for name in names:
+            child = self.children.pop(name)
+            if self.tasks[name] in pending and child.proc is not None and child.proc.returncode is None:
+                logger.warning(f"{name} did not stop in {timeout:.0f}s, killing it")
+                child.proc.kill()
+        if pending:
+            await asyncio.wait(pending, timeout=5)
+        for name in names:
+            del self.child_stops[name], self.tasks[name]
+
+    async def apply(self, commands: Dict[str, List[str]]) -> None:
+        """Start new children, stop removed ones and restart those whose command changed."""
+        changed = [n for n, c in self.children.items() if commands.get(n) != c.argv]
+        # Front-ends drain before a changed tunnel goes away
+        await self.stop_children([n for n in FRONT_ENDS if n in changed],
+                                 self.settings.drain_timeout + 5)
+        await self.stop_children([n for n in changed if n not in FRONT_ENDS], 10)
+        for name in ['tunnel'] + list(FRONT_ENDS):
+            if name in commands and name not in self.children:
+                self.start_child(name, commands[name])
+
+    async def wait_ready(self) -> bool:
+        """Wait until every child's port accepts connections."""
+        deadline = time.monotonic() + self.settings.ready_timeout
+        for host, port in listening_ports(list(self.children)):
+            while not await port_open(port, host):
+                if time.monotonic() > deadline:
+                    logger.error(f"{host}:{port} did not open in {self.settings.ready_timeout:.0f}s")
+                    return False
+                await asyncio.sleep(0.1)
+        return True
+
+    def status(self) -> str:
+        restarts = sum(max(0, c.starts - 1) for c in self.children.values())
+        return (f"Tunnel to {self.host.get('name', '?')}, SOCKS5 on port {config.proxy_port}, "
+                f"{len(self.children)} process(es), {restarts} restart(s)")
+
+    def write_ready_file(self) -> None:
+        if not self.settings.ready_file:
+            return
+        try:
+            with open(self.settings.ready_file, 'w', encoding='utf-8') as f:
+                json.dump({"pid": os.getpid(), "host": self.host.get('name'),
+                           "port": config.proxy_port, "ready_at": int(time.time())}, f)
+        except OSError as e:
+            logger.warning(f"Failed to write ready file: {e}")
+
+    async def load(self) -> bool:
+        """Run prepare() in a thread and apply the result; keeps the current setup on failure."""
+        try:
+            host, commands = await asyncio.to_thread(prepare, self.settings)
+        except ValueError as e:
+            logger.error(str(e))
+            return False
+        self.host = host
+        await self.apply(commands)
+        if not await self.wait_ready():
+            return False
+        logger.info(self.status())
+        self.write_ready_file()
+        notify("READY=1", f"STATUS={self.status()}")
+        return True
+
+    async def reload(self) -> None:
+        logger.info("Reloading configuration")
+        notify("RELOADING=1", f"MONOTONIC_USEC={int(time.monotonic() * 1e6)}", "STATUS=Reloading")
+        if not await self.load():
+            notify("READY=1", f"STATUS=Reload failed, still running: {self.status()}")
+
+    async def drain(self) -> None:
+        """Stop accepting, let front-ends finish their connections, then close the tunnel."""
+        notify("STOPPING=1", "STATUS=Draining connections")
+        logger.info(f"Stopping: draining for up to {self.settings.drain_timeout:.0f}s")
+        await self.stop_children(list(FRONT_ENDS), self.settings.drain_timeout + 5)
+        await self.stop_children(list(self.children), 10)
+        if self.settings.ready_file and os.path.exists(self.settings.ready_file):
+            os.remove(self.settings.ready_file)
+
+    async def health_loop(self) -> None:
+        """Ping the systemd watchdog while the tunnel accepts connections."""
+        watchdog = watchdog_interval()
+        interval = min(self.settings.health_interval, watchdog) if watchdog else self.settings.health_interval
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.stopping.wait(), interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            if await port_open(launcher.tunnel_port()):
+                notify("WATCHDOG=1", f"STATUS={self.status()}")
+            else:
+                tunnel = self.children.get('tunnel')
+                error = tunnel.last_error if tunnel else ''
+                logger.warning(f"Tunnel port {launcher.tunnel_port()} not accepting: {error or 'restarting'}")
+                notify(f"STATUS=Tunnel down, reconnecting ({error or 'no error output'})")
+
+    async def run(self) -> int:
+        loop = asyncio.get_running_loop()
+        for sig, handler in ((signal.SIGINT, self.stopping.set), (signal.SIGTERM, self.stopping.set),
+                             (getattr(signal, 'SIGHUP', None), self.reloading.set)):
+            if sig is None:
+                continue
+            try:
+                loop.add_signal_handler(sig, handler)
+            except (NotImplementedError, AttributeError, ValueError):
+                pass
+
+        if not await self.load():
+            await self.drain()
+            return 1
+        health = asyncio.ensure_future(self.health_loop())
+        while not self.stopping.is_set():
+            stop_wait = asyncio.ensure_future(self.stopping.wait())
+            reload_wait = asyncio.ensure_future(self.reloading.wait())
+            await asyncio.wait([stop_wait, reload_wait], return_when=asyncio.FIRST_COMPLETED)
+            stop_wait.cancel()
+            reload_wait.cancel()
+            if self.reloading.is_set() and not self.stopping.is_set():
+                self.reloading.clear()
+                await self.reload()
+        health.cancel()
+        await self.drain()
+        return 0
+
+
+# ==================== PID FILE ====================
+def write_pid_file(path: str, drain_timeout: float) -> None:
+    try:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"pid": os.getpid(), "port": config.proxy_port,
+                       "stop_timeout": drain_timeout + STOP_GRACE}, f)
+    except OSError as e:
+        logger.warning(f"Failed to save daemon PID: {e}")
+
+
+# ==================== MAIN ====================
+def main() -> None:
+    """Daemon entry point (foreground; run it under systemd, a container or nohup)."""
+    parser = argparse.ArgumentParser(description="Headless SSH SOCKS5 proxy daemon")
+    parser.add_argument('--config', dest='config_file', help="JSON file with Config overrides")
+    parser.add_argument('--host', help="SSH config host (overrides the config file)")
+    parser.add_argument('--rank', action='store_true', help="Pick the host by measured handshake/throughput")
+    parser.add_argument('--drain-timeout', type=float, default=30.0,
+                        help="Seconds active connections get to finish on SIGTERM")
+    parser.add_argument('--ready-timeout', type=float, default=30.0, help="Seconds to wait for listening ports")
+    parser.add_argument('--health-interval', type=float, default=10.0, help="Tunnel health check interval")
+    parser.add_argument('--ready-file', help="Write {pid, host, port} here once ready")
+    parser.add_argument('--pid-file', default="x_daemon.pid", help="PID file for proxy_stop.py")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    # The launcher configured the root logger on import; only the level differs here
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    settings = DaemonSettings(
+        config_file=args.config_file,
+        host=args.host,
+        rank=args.rank,
+        drain_timeout=args.drain_timeout,
+        ready_timeout=args.ready_timeout,
+        health_interval=args.health_interval,
+        ready_file=args.ready_file,
+        pid_file=args.pid_file,
+    )
+
+    async def run() -> int:
+        return await Daemon(settings).run()
+
+    write_pid_file(settings.pid_file, settings.drain_timeout)
+    try:
+        code = asyncio.run(run())
+    except KeyboardInterrupt:
+        code = 0
+    finally:
+        if os.path.exists(settings.pid_file):
+            os.remove(settings.pid_file)
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,579 @@
+"""
+Local DNS Stub through the SOCKS5 Tunnel
+Answers UDP/TCP queries on 127.0.0.1 and forwards cache misses as DNS-over-TCP through the SSH tunnel.
+Keeps a TTL-respecting LRU cache with negative caching and prefetch of popular names.
+"""
+import argparse
+import asyncio
+import logging
+import random
+import struct
+import sys
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+from proxy_socks import open_socks_connection
+
+logger = logging.getLogger(__name__)
+
+# ============ DNS CONSTANTS ============
+HEADER = struct.Struct('!HHHHHH')
+RR_FIXED = struct.Struct('!HHIH')
+FLAG_QR = 0x8000
+FLAG_TC = 0x0200
+FLAG_RD = 0x0100
+FLAG_RA = 0x0080
+RCODE_NOERROR = 0
+RCODE_FORMERR = 1
+RCODE_SERVFAIL = 2
+RCODE_NXDOMAIN = 3
+TYPE_SOA = 6
+TYPE_OPT = 41
+UDP_LIMIT = 512
+
+QuestionKey = Tuple[str, int, int]
+
+
+# ============ SETTINGS ============
+@dataclass
+class DnsSettings:
+    """DNS stub settings."""
+    listen_host: str = '127.0.0.1'
+    listen_port: int = 5053  # Not 5353, which is mDNS
+    socks_host: str = '127.0.0.1'
+    socks_port: int = 1080
+    upstream_host: str = '1.1.1.1'
+    upstream_port: int = 53
+    cache_size: int = 4096
+    max_ttl: int = 86400
+    negative_ttl: int = 60
+    max_negative_ttl: int = 900
+    prefetch_hits: int = 3
+    prefetch_window: float = 0.1
+    query_timeout: float = 5.0
+
+
+# ==================== MESSAGE PARSING ====================
+@dataclass
+class DnsMessage:
+    """Fields of a DNS message needed for caching."""
+    msg_id: int
+    flags: int
+    question: Optional[QuestionKey]
+    question_end: int
+    answer_count: int
+    ttl_offsets: List[int] = field(default_factory=list)
+    min_answer_ttl: Optional[int] = None
+    soa_negative_ttl: Optional[int] = None
+    udp_size: int = UDP_LIMIT
+
+    @property
+    def rcode(self) -> int:
+        return self.flags & 0x000F
+
+
+def _skip_name(data: bytes, offset: int) -> int:
+    """Return offset right after a (possibly compressed) domain name."""
+    while True:
+        if offset >= len(data):
+            raise ValueError("Truncated domain name")
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        if length == 0:
+            return offset + 1
+        offset += 1 + length
+
+
+def _read_question_name(data: bytes, offset: int) -> Tuple[str, int]:
+    """Read an uncompressed question name."""
+    labels = []
+    while True:
+        if offset >= len(data):
+            raise ValueError("Truncated question name")
+        length = data[offset]
+        if length == 0:
+            return '.'.join(labels).lower(), offset + 1
+        if length & 0xC0:
+            raise ValueError("Compressed question name")
+        labels.append(data[offset + 1:offset + 1 + length].decode('ascii', errors='replace'))
+        offset += 1 + length
+
+
+def parse_message(data: bytes) -> DnsMessage:
+    """
+    Parse DNS message header, question and resource record TTLs.
+
+    Args:
+        data: Wire-format DNS message
+
+    Returns:
+        Parsed message (raises ValueError if malformed)
+    """
+    if len(data) < HEADER.size:
+        raise ValueError("Message shorter than header")
+    msg_id, flags, qdcount, ancount, nscount, arcount = HEADER.unpack_from(data)
+
+    offset = HEADER.size
+    question = None
+    for _ in range(qdcount):
+        name, offset = _read_question_name(data, offset)
+        if offset + 4 > len(data):
+            raise ValueError("Truncated question")
+        qtype, qclass = struct.unpack_from('!HH', data, offset)
+        offset += 4
+        if question is None:
+            question = (name, qtype, qclass)
+
+    message = DnsMessage(msg_id, flags, question, offset, ancount)
+    sections = [0] * ancount + [1] * nscount + [2] * arcount
+    for section in sections:
+        offset = _skip_name(data, offset)
+        if offset + RR_FIXED.size > len(data):
+            raise ValueError("Truncated resource record")
+        rtype, rclass, ttl, rdlength = RR_FIXED.unpack_from(data, offset)
+        ttl_offset = offset + 4
+        offset += RR_FIXED.size
+        rdata_end = offset + rdlength
+        if rdata_end > len(data):
+            raise ValueError("Truncated resource data")
+
+        if rtype == TYPE_OPT:
+            # OPT borrows the class field for the UDP payload size and the TTL for flags
+            message.udp_size = max(UDP_LIMIT, rclass)
+        else:
+            message.ttl_offsets.append(ttl_offset)
+            if section == 0:
+                if message.min_answer_ttl is None or ttl < message.min_answer_ttl:
+                    message.min_answer_ttl = ttl
+            elif section == 1 and rtype == TYPE_SOA and rdlength >= 20:
+                # RFC 2308: negative TTL is min(SOA TTL, SOA MINIMUM)
+                soa_minimum = struct.unpack_from('!I', data, rdata_end - 4)[0]
+                message.soa_negative_ttl = min(ttl, soa_minimum)
+        offset = rdata_end
+
+    return message
+
+
+def build_error_response(query: bytes, message: DnsMessage, rcode: int) -> bytes:
+    """Build response with given rcode echoing the query question."""
+    flags = FLAG_QR | FLAG_RA | (message.flags & FLAG_RD) | rcode
+    qdcount = 1 if message.question else 0
+    return HEADER.pack(message.msg_id, flags, qdcount, 0, 0, 0) + query[HEADER.size:message.question_end]
+
+
+def truncate_response(response: bytes, message: DnsMessage) -> bytes:
+    """Strip records and set TC so the client retries over TCP."""
+    qdcount = 1 if message.question else 0
+    header = HEADER.pack(message.msg_id, message.flags | FLAG_TC, qdcount, 0, 0, 0)
+    return header + response[HEADER.size:message.question_end]
+
+
+# ==================== CACHE ====================
+@dataclass
+class CacheEntry:
+    """Cached upstream response."""
+    response: bytes
+    ttl_offsets: List[int]
+    stored_at: float
+    ttl: int
+    negative: bool
+    hits: int = 0
+    prefetching: bool = False
+
+    @property
+    def expires(self) -> float:
+        return self.stored_at + self.ttl
+
+
+class DnsCache:
+    """TTL-respecting LRU cache of upstream responses keyed by question."""
+
+    def __init__(self, max_entries: int = 4096, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries: 'OrderedDict[QuestionKey, CacheEntry]' = OrderedDict()
+        self.stats = {'hits': 0, 'negative_hits': 0, 'misses': 0, 'evictions': 0, 'prefetches': 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: QuestionKey) -> Optional[CacheEntry]:
+        """
+        Look up live entry and mark it as recently used.
+
+        Args:
+            key: (name, qtype, qclass)
+
+        Returns:
+            Cache entry or None if missing/expired
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats['misses'] += 1
+            return None
+        if self.clock() >= entry.expires:
+            del self._entries[key]
+            self.stats['misses'] += 1
+            return None
+        self._entries.move_to_end(key)
+        entry.hits += 1
+        self.stats['negative_hits' if entry.negative else 'hits'] += 1
+        return entry
+
+    def put(self, key: QuestionKey, response: bytes, message: DnsMessage, ttl: int, negative: bool) -> None:
+        """Store response, evicting least recently used entries past capacity."""
+        previous = self._entries.pop(key, None)
+        entry = CacheEntry(response, message.ttl_offsets, self.clock(), ttl, negative)
+        if previous is not None:
+            # Keep popularity across refreshes so prefetch keeps hot names warm
+            entry.hits = previous.hits
+        self._entries[key] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def render(self, entry: CacheEntry, msg_id: int) -> bytes:
+        """
+        Produce response for client with its ID and TTLs decremented by age.
+
+        Args:
+            entry: Cache entry
+            msg_id: Client query ID
+
+        Returns:
+            Wire-format response
+        """
+        elapsed = int(self.clock() - entry.stored_at)
+        data = bytearray(entry.response)
+        struct.pack_into('!H', data, 0, msg_id)
+        if elapsed > 0:
+            for offset in entry.ttl_offsets:
+                ttl = struct.unpack_from('!I', data, offset)[0]
+                struct.pack_into('!I', data, offset, max(0, ttl - elapsed))
+        return bytes(data)
+
+
+# ==================== UPSTREAM RESOLVER ====================
+class TunnelResolver:
+    """Pipelines DNS-over-TCP queries through one SOCKS5 connection to the upstream resolver."""
+
+    def __init__(self, settings: DnsSettings):
+        self.settings = settings
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._connect_lock = asyncio.Lock()
+
+    async def _ensure_connection(self) -> asyncio.StreamWriter:
+        async with self._connect_lock:
+            if self._writer is None or self._writer.is_closing():
+                reader, writer = await open_socks_connection(
+                    self.settings.upstream_host, self.settings.upstream_port,
+                    self.settings.socks_host, self.settings.socks_port,
+                    timeout=self.settings.query_timeout)
+                self._writer = writer
+                self._reader_task = asyncio.get_running_loop().create_task(self._read_responses(reader, writer))
+                logger.info(f"Upstream DNS connection opened to "
+                            f"{self.settings.upstream_host}:{self.settings.upstream_port} via SOCKS5")
+            return self._writer
+
+    async def _read_responses(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                length = struct.unpack('!H', await reader.readexactly(2))[0]
+                response = await reader.readexactly(length)
+                if len(response) < 2:
+                    continue
+                future = self._pending.pop(struct.unpack_from('!H', response)[0], None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError) as e:
+            logger.info(f"Upstream DNS connection closed: {e!r}")
+        finally:
+            writer.close()
+            if self._writer is writer:
+                self._writer = None
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Upstream DNS connection closed"))
+            self._pending.clear()
+
+    def _allocate_id(self) -> int:
+        while True:
+            msg_id = random.randrange(0x10000)
+            if msg_id not in self._pending:
+                return msg_id
+
+    async def query(self, wire: bytes) -> bytes:
+        """
+        Send query upstream and wait for matching response.
+
+        Args:
+            wire: Wire-format query (its ID is replaced on the upstream connection)
+
+        Returns:
+            Upstream response with the original query ID restored
+        """
+        client_id = wire[:2]
+        for attempt in range(2):
+            writer = await self._ensure_connection()
+            msg_id = self._allocate_id()
+            future = asyncio.get_running_loop().create_future()
+            self._pending[msg_id] = future
+            writer.write(struct.pack('!HH', len(wire), msg_id) + wire[2:])
+            try:
+                response = await asyncio.wait_for(future, self.settings.query_timeout)
+                return client_id + response[2:]
+            except ConnectionError:
+                # Resolvers drop idle DNS-over-TCP connections; retry once on a fresh one
+                if attempt:
+                    raise
+            finally:
+                self._pending.pop(msg_id, None)
+        raise ConnectionError("Upstream DNS query failed")
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+
+
+# ==================== STUB ====================
+class DnsStub:
+    """Caching stub resolver answering from cache or through the tunnel."""
+
+    def __init__(self, settings: DnsSettings, resolver: Optional[TunnelResolver] = None,
+                 cache: Optional[DnsCache] = None):
+        self.settings = settings
+        self.resolver = resolver if resolver is not None else TunnelResolver(settings)
+        self.cache = cache if cache is not None else DnsCache(settings.cache_size)
+        self._inflight: Dict[QuestionKey, asyncio.Future] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _cache_ttl(self, message: DnsMessage) -> Tuple[Optional[int], bool]:
+        """Return (ttl, negative) for a cacheable response or (None, False)."""
+        if message.flags & FLAG_TC:
+            return None, False
+        if message.rcode == RCODE_NXDOMAIN or (message.rcode == RCODE_NOERROR and message.answer_count == 0):
+            ttl = message.soa_negative_ttl
+            if ttl is None:
+                ttl = self.settings.negative_ttl
+            return min(ttl, self.settings.max_negative_ttl), True
+        if message.rcode == RCODE_NOERROR and message.min_answer_ttl is not None:
+            return min(message.min_answer_ttl, self.settings.max_ttl), False
+        return None, False
+
+    async def _fetch(self, key: QuestionKey, wire: bytes) -> bytes:
+        """Resolve upstream, coalescing identical concurrent questions."""
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            response = await self.resolver.query(wire)
+            message = parse_message(response)
+            ttl, negative = self._cache_ttl(message)
+            if ttl:
+                self.cache.put(key, response, message, ttl, negative)
+            future.set_result(response)
+            return response
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Retrieve once so a failure nobody else awaited is not logged as unhandled
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def _maybe_prefetch(self, key: QuestionKey, entry: CacheEntry, wire: bytes) -> None:
+        """Refresh popular entries shortly before they expire."""
+        if entry.prefetching or entry.hits < self.settings.prefetch_hits:
+            return
+        remaining = entry.expires - self.cache.clock()
+        if remaining > entry.ttl * self.settings.prefetch_window:
+            return
+        entry.prefetching = True
+        self.cache.stats['prefetches'] += 1
+        task = asyncio.get_running_loop().create_task(self._prefetch(key, entry, wire))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _prefetch(self, key: QuestionKey, entry: CacheEntry, wire: bytes) -> None:
+        try:
+            await self._fetch(key, wire)
+        except Exception as e:
+            entry.prefetching = False
+            logger.debug(f"Prefetch failed for {key[0]}: {e!r}")
+
+    async def resolve(self, wire: bytes, max_size: Optional[int] = None) -> Optional[bytes]:
+        """
+        Answer one client query.
+
+        Args:
+            wire: Wire-format query
+            max_size: Maximum response size (UDP), None for TCP
+
+        Returns:
+            Wire-format response or None if query is unparseable
+        """
+        try:
+            query = parse_message(wire)
+        except ValueError:
+            logger.debug("Dropping malformed DNS query")
+            return None
+        if query.flags & FLAG_QR:
+            return None
+        if query.question is None:
+            return build_error_response(wire, query, RCODE_FORMERR)
+
+        key = query.question
+        entry = self.cache.get(key)
+        if entry is not None:
+            self._maybe_prefetch(key, entry, wire)
+            response = self.cache.render(entry, query.msg_id)
+        else:
+            try:
+                response = await self._fetch(key, wire)
+                response = wire[:2] + response[2:]
+            except Exception as e:
+                logger.warning(f"DNS query for {key[0]} failed: {e!r}")
+                return build_error_response(wire, query, RCODE_SERVFAIL)
+
+        if max_size is not None:
+            limit = max(max_size, query.udp_size)
+            if len(response) > limit:
+                response = truncate_response(response, parse_message(response))
+        return response
+
+    def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self.resolver.close()
+
+
+# ==================== SERVERS ====================
+class _UdpProtocol(asyncio.DatagramProtocol):
+    """UDP front-end for the stub."""
+
+    def __init__(self, stub: DnsStub):
+        self.stub = stub
+        self.transport = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        task = asyncio.get_running_loop().create_task(self._answer(data, addr))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _answer(self, data: bytes, addr) -> None:
+        response = await self.stub.resolve(data, max_size=UDP_LIMIT)
+        if response is not None and self.transport is not None:
+            self.transport.sendto(response, addr)
+
+
+async def _handle_tcp_client(stub: DnsStub, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Serve length-prefixed queries on one TCP connection."""
+    try:
+        while True:
+            length = struct.unpack('!H', await reader.readexactly(2))[0]
+            response = await stub.resolve(await reader.readexactly(length))
+            if response is None:
+                break
+            writer.write(struct.pack('!H', len(response)) + response)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_dns(settings: DnsSettings, ready: Optional[asyncio.Event] = None) -> None:
+    """
+    Run UDP and TCP listeners until cancelled.
+
+    Args:
+        settings: DNS stub settings
+        ready: Optional event set once both listeners are bound
+    """
+    loop = asyncio.get_running_loop()
+    stub = DnsStub(settings)
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: _UdpProtocol(stub), local_addr=(settings.listen_host, settings.listen_port))
+    server = await asyncio.start_server(
+        lambda r, w: _handle_tcp_client(stub, r, w), settings.listen_host, settings.listen_port)
+    logger.info(f"DNS stub listening on {settings.listen_host}:{settings.listen_port} "
+                f"(upstream {settings.upstream_host}:{settings.upstream_port} via SOCKS5 "
+                f"{settings.socks_host}:{settings.socks_port})")
+    if ready is not None:
+        ready.set()
+    try:
+        await asyncio.Future()
+    finally:
+        logger.info(f"DNS cache stats: {stub.cache.stats}")
+        server.close()
+        transport.close()
+        stub.close()
+
+
+def parse_host_port(value: str, default_port: int) -> Tuple[str, int]:
+    """Split 'host[:port]' (IPv6 literals in brackets)."""
+    if value.startswith('['):
+        host, _, rest = value[1:].partition(']')
+        return host, int(rest[1:]) if rest.startswith(':') else default_port
+    if value.count(':') == 1:
+        host, port = value.split(':')
+        return host, int(port)
+    return value, default_port
+
+
+# ==================== MAIN ====================
+def main() -> None:
+    """DNS stub entry point."""
+    parser = argparse.ArgumentParser(description="Local DNS stub forwarding through the SOCKS5 tunnel")
+    parser.add_argument('--listen', default='127.0.0.1', help="Listen address")
+    parser.add_argument('--port', type=int, default=5053, help="Listen port (UDP and TCP)")
+    parser.add_argument('--socks-host', default='127.0.0.1', help="SOCKS5 address of the tunnel or relay")
+    parser.add_argument('--socks-port', type=int, default=1080, help="Local SOCKS5 port of the SSH tunnel")
+    parser.add_argument('--upstream', default='1.1.1.1:53', help="Resolver reached through the tunnel")
+    parser.add_argument('--cache-size', type=int, default=4096, help="Maximum cached questions")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    upstream_host, upstream_port = parse_host_port(args.upstream, 53)
+    settings = DnsSettings(
+        listen_host=args.listen,
+        listen_port=args.port,
+        socks_host=args.socks_host,
+        socks_port=args.socks_port,
+        upstream_host=upstream_host,
+        upstream_port=upstream_port,
+        cache_size=args.cache_size,
+    )
+    try:
+        asyncio.run(serve_dns(settings))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        logger.error(f"DNS stub failed to start: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,584 @@
+"""
+HTTP Proxy Front-End for the SOCKS5 Tunnel
+Serves CONNECT tunnels and absolute-URI plain HTTP for clients that only understand HTTP_PROXY.
+Plain HTTP reuses pooled upstream connections per origin (keep-alive) and handles pipelined requests.
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from proxy_socks import SocksError, open_socks_connection, pipe
+
+logger = logging.getLogger(__name__)
+
+# ============ HTTP CONSTANTS ============
+HOP_BY_HOP = {
+    'connection', 'keep-alive', 'proxy-connection', 'proxy-authenticate',
+    'proxy-authorization', 'te', 'trailer', 'transfer-encoding', 'upgrade',
+}
+MAX_HEAD_SIZE = 64 * 1024
+COPY_CHUNK = 64 * 1024
+
+Headers = List[Tuple[str, str]]
+
+
+class HttpError(Exception):
+    """Request cannot be served; carries the status to send to the client."""
+
+    def __init__(self, status: int, reason: str):
+        super().__init__(f"{status} {reason}")
+        self.status = status
+        self.reason = reason
+
+
+@dataclass
+class HttpProxySettings:
+    """HTTP proxy settings."""
+    listen_host: str = '127.0.0.1'
+    listen_port: int = 8118
+    socks_host: str = '127.0.0.1'
+    socks_port: int = 1080
+    connect_timeout: float = 10.0
+    idle_timeout: float = 60.0
+    max_idle_per_origin: int = 8
+    max_idle: int = 256  # Idle connections over all origins (each holds a tunnel channel)
+    client_timeout: float = 300.0
+
+
+# ==================== MESSAGE PARSING ====================
+async def read_head(reader: asyncio.StreamReader) -> Optional[Tuple[str, Headers]]:
+    """
+    Read start line and headers.
+
+    Args:
+        reader: Stream to read from
+
+    Returns:
+        (start_line, headers) or None on clean EOF before any byte
+    """
+    try:
+        raw = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError as e:
+        if not e.partial.strip():
+            return None
+        raise HttpError(400, "Bad Request")
+    except asyncio.LimitOverrunError:
+        raise HttpError(431, "Request Header Fields Too Large")
+
+    lines = raw.decode('latin-1').split('\r\n')
+    # Tolerate stray CRLF between pipelined requests (RFC 9112 2.2)
+    while lines and not lines[0]:
+        lines.pop(0)
+    if not lines:
+        return None
+    headers = []
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, sep, value = line.partition(':')
+        if not sep or not name or name != name.strip():
+            raise HttpError(400, "Bad Request")
+        headers.append((name, value.strip()))
+    return lines[0], headers
+
+
+def get_header(headers: Headers, name: str) -> Optional[str]:
+    name = name.lower()
+    values = [v for k, v in headers if k.lower() == name]
+    return ', '.join(values) if values else None
+
+
+def header_tokens(headers: Headers, name: str) -> List[str]:
+    value = get_header(headers, name)
+    return [t.strip().lower() for t in value.split(',')] if value else []
+
+
+def strip_hop_by_hop(headers: Headers, chunked: bool = False) -> Headers:
+    """
+    Remove hop-by-hop headers including those listed in Connection.
+
+    Args:
+        headers: Message headers
+        chunked: Message is sent chunked, so Content-Length is dropped too
+            (RFC 9112 6.1: a sender must not forward both)
+    """
+    listed = set(header_tokens(headers, 'connection'))
+    if chunked:
+        listed.add('content-length')
+    return [(k, v) for k, v in headers if k.lower() not in HOP_BY_HOP and k.lower() not in listed]
+
+
+def render_head(start_line: str, headers: Headers) -> bytes:
+    lines = [start_line] + [f"{k}: {v}" for k, v in headers]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+def split_host_port(authority: str, default_port: int) -> Tuple[str, int]:
+    """Split 'host[:port]' with bracketed IPv6 support."""
+    try:
+        if authority.startswith('['):
+            host, _, rest = authority[1:].partition(']')
+            return host, int(rest[1:]) if rest.startswith(':') else default_port
+        host, sep, port = authority.rpartition(':')
+        if sep and port.isdigit():
+            return host, int(port)
+        return authority, default_port
+    except ValueError:
+        raise HttpError(400, "Bad Request")
+
+
+def wants_keep_alive(version: str, headers: Headers) -> bool:
+    tokens = header_tokens(headers, 'connection') + header_tokens(headers, 'proxy-connection')
+    if version == 'HTTP/1.1':
+        return 'close' not in tokens
+    return 'keep-alive' in tokens
+
+
+# ==================== BODY FORWARDING ====================
+async def copy_exact(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, length: int) -> None:
+    while length > 0:
+        data = await reader.read(min(length, COPY_CHUNK))
+        if not data:
+            raise asyncio.IncompleteReadError(b'', length)
+        writer.write(data)
+        length -= len(data)
+        await writer.drain()
+
+
+async def copy_chunked(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Forward a chunked body verbatim, including trailers."""
+    while True:
+        line = await reader.readuntil(b'\r\n')
+        writer.write(line)
+        try:
+            size = int(line.split(b';', 1)[0].strip(), 16)
+        except ValueError:
+            raise HttpError(502, "Bad Gateway")
+        if size == 0:
+            while True:
+                trailer = await reader.readuntil(b'\r\n')
+                writer.write(trailer)
+                if trailer == b'\r\n':
+                    await writer.drain()
+                    return
+        await copy_exact(reader, writer, size + 2)
+
+
+async def copy_dechunked(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Forward only the payload of a chunked body, dropping framing and trailers."""
+    while True:
+        line = await reader.readuntil(b'\r\n')
+        try:
+            size = int(line.split(b';', 1)[0].strip(), 16)
+        except ValueError:
+            raise HttpError(502, "Bad Gateway")
+        if size == 0:
+            while await reader.readuntil(b'\r\n') != b'\r\n':
+                pass
+            await writer.drain()
+            return
+        await copy_exact(reader, writer, size)
+        if await reader.readexactly(2) != b'\r\n':
+            raise HttpError(502, "Bad Gateway")
+
+
+def body_framing(headers: Headers) -> Tuple[str, int]:
+    """Return ('chunked', 0), ('length', n) or ('none', 0) per headers."""
+    if 'chunked' in header_tokens(headers, 'transfer-encoding'):
+        return 'chunked', 0
+    length = get_header(headers, 'content-length')
+    if length is not None:
+        try:
+            # Duplicate identical Content-Length values are allowed (RFC 9110 8.6)
+            values = {int(v) for v in length.split(',')}
+        except ValueError:
+            raise HttpError(400, "Bad Request")
+        if len(values) != 1 or min(values) < 0:
+            raise HttpError(400, "Bad Request")
+        return 'length', values.pop()
+    return 'none', 0
+
+
+async def forward_body(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                       framing: Tuple[str, int]) -> None:
+    kind, length = framing
+    if kind == 'chunked':
+        await copy_chunked(reader, writer)
+    elif kind == 'dechunk':
+        await copy_dechunked(reader, writer)
+    elif kind == 'length':
+        await copy_exact(reader, writer, length)
+
+
+# ==================== UPSTREAM POOL ====================
+@dataclass
+class _IdleConnection:
+    reader: asyncio.StreamReader
+    writer: asyncio.StreamWriter
+    since: float
+
+
+class UpstreamPool:
+    """
+    Keep-alive pool of SOCKS5-tunnelled connections per origin.
+
+    Idle connections are closed after idle_timeout by reap() (run periodically
+    by run_reaper) and the oldest one is closed when max_idle is reached.
+    """
+
+    def __init__(self, settings: HttpProxySettings):
+        self.settings = settings
+        self._idle: Dict[Tuple[str, int], List[_IdleConnection]] = {}  # Oldest first per origin
+        self.idle_count = 0
+        self.stats = {'connects': 0, 'reuses': 0, 'discarded': 0}
+
+    async def acquire(self, host: str, port: int) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter, bool]:
+        """
+        Get connection to origin, preferring the most recently used idle one.
+
+        Args:
+            host: Origin host
+            port: Origin port
+
+        Returns:
+            Tuple of (reader, writer, reused)
+        """
+        idle = self._idle.get((host, port), [])
+        now = time.monotonic()
+        while idle:
+            conn = idle.pop()
+            self.idle_count -= 1
+            if not idle:
+                del self._idle[(host, port)]
+            if (now - conn.since < self.settings.idle_timeout
+                    and not conn.reader.at_eof() and not conn.writer.is_closing()):
+                self.stats['reuses'] += 1
+                return conn.reader, conn.writer, True
+            conn.writer.close()
+            self.stats['discarded'] += 1
+
+        reader, writer = await open_socks_connection(
+            host, port, self.settings.socks_host, self.settings.socks_port,
+            timeout=self.settings.connect_timeout)
+        self.stats['connects'] += 1
+        return reader, writer, False
+
+    def release(self, host: str, port: int, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Return connection with a fully read response to the pool."""
+        idle = self._idle.get((host, port), [])
+        if len(idle) >= self.settings.max_idle_per_origin or writer.is_closing() or self.settings.max_idle <= 0:
+            writer.close()
+            return
+        if self.idle_count >= self.settings.max_idle:
+            self._discard_oldest()
+        self._idle.setdefault((host, port), idle).append(_IdleConnection(reader, writer, time.monotonic()))
+        self.idle_count += 1
+
+    def _discard_oldest(self) -> None:
+        key = min(self._idle, key=lambda k: self._idle[k][0].since)
+        idle = self._idle[key]
+        idle.pop(0).writer.close()
+        self.idle_count -= 1
+        self.stats['discarded'] += 1
+        if not idle:
+            del self._idle[key]
+
+    def reap(self, now: Optional[float] = None) -> int:
+        """Close idle connections past idle_timeout or closed by the origin; returns how many."""
+        now = time.monotonic() if now is None else now
+        closed = 0
+        for key in list(self._idle):
+            keep = []
+            for conn in self._idle[key]:
+                if (now - conn.since < self.settings.idle_timeout
+                        and not conn.reader.at_eof() and not conn.writer.is_closing()):
+                    keep.append(conn)
+                else:
+                    conn.writer.close()
+                    closed += 1
+            if keep:
+                self._idle[key] = keep
+            else:
+                del self._idle[key]
+        self.idle_count -= closed
+        self.stats['discarded'] += closed
+        return closed
+
+    async def run_reaper(self) -> None:
+        """Reap idle connections every half idle_timeout until cancelled."""
+        while True:
+            await asyncio.sleep(max(1.0, self.settings.idle_timeout / 2))
+            self.reap()
+
+    def close(self) -> None:
+        for idle in self._idle.values():
+            for conn in idle:
+                conn.writer.close()
+        self._idle.clear()
+        self.idle_count = 0
+
+
+# ==================== PROXY ====================
+class HttpProxy:
+    """HTTP/1.x proxy speaking SOCKS5 to the tunnel."""
+
+    def __init__(self, settings: HttpProxySettings, pool: Optional[UpstreamPool] = None):
+        self.settings = settings
+        self.pool = pool if pool is not None else UpstreamPool(settings)
+        self.stats = {'requests': 0, 'connects': 0, 'errors': 0}
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serve requests on one client connection until it closes."""
+        try:
+            while True:
+                head = await asyncio.wait_for(read_head(reader), self.settings.client_timeout)
+                if head is None:
+                    break
+                if not await self.handle_request(head, reader, writer):
+                    break
+        except HttpError as e:
+            self.stats['errors'] += 1
+            await self._send_error(writer, e)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send_error(self, writer: asyncio.StreamWriter, error: HttpError) -> None:
+        body = f"{error.status} {error.reason}\n".encode()
+        writer.write(render_head(f"HTTP/1.1 {error.status} {error.reason}", [
+            ('Content-Type', 'text/plain'), ('Content-Length', str(len(body))), ('Connection', 'close')]) + body)
+        try:
+            await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+
+    async def handle_request(self, head: Tuple[str, Headers], reader: asyncio.StreamReader,
+                             writer: asyncio.StreamWriter) -> bool:
+        """
+        Serve one request.
+
+        Returns:
+            True if the client connection can carry another request
+        """
+        start_line, headers = head
+        parts = start_line.split(' ')
+        if len(parts) != 3 or not parts[2].startswith('HTTP/1.'):
+            raise HttpError(400, "Bad Request")
+        method, target, version = parts
+        self.stats['requests'] += 1
+
+        if method == 'CONNECT':
+            await self._handle_connect(target, reader, writer)
+            return False
+        return await self._handle_plain(method, target, version, headers, reader, writer)
+
+    async def _open_tunnel(self, host: str, port: int) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        try:
+            return await open_socks_connection(host, port, self.settings.socks_host, self.settings.socks_port,
+                                               timeout=self.settings.connect_timeout)
+        except asyncio.TimeoutError:
+            raise HttpError(504, "Gateway Timeout")
+        except (SocksError, OSError, asyncio.IncompleteReadError) as e:
+            logger.info(f"Tunnel to {host}:{port} failed: {e!r}")
+            raise HttpError(502, "Bad Gateway")
+
+    async def _handle_connect(self, target: str, reader: asyncio.StreamReader,
+                              writer: asyncio.StreamWriter) -> None:
+        host, port = split_host_port(target, 443)
+        up_reader, up_writer = await self._open_tunnel(host, port)
+        self.stats['connects'] += 1
+        writer.write(b"HTTP/1.1 200 Connection Established\r\n\r\n")
+        await writer.drain()
+        try:
+            await asyncio.gather(pipe(reader, up_writer), pipe(up_reader, writer))
+        finally:
+            up_writer.close()
+
+    async def _handle_plain(self, method: str, target: str, version: str, headers: Headers,
+                            reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        url = urlsplit(target)
+        if url.scheme.lower() != 'http' or not url.netloc:
+            raise HttpError(400, "Bad Request")
+        authority = url.netloc.rsplit('@', 1)[-1]
+        host, port = split_host_port(authority, 80)
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
+
+        client_keep_alive = wants_keep_alive(version, headers)
+        upgrade = get_header(headers, 'upgrade')
+        request_framing = body_framing(headers)
+
+        out_headers = strip_hop_by_hop(headers, chunked=request_framing[0] == 'chunked')
+        # Absolute-form target overrides any Host sent by the client (RFC 9112 3.2.2)
+        out_headers = [('Host', authority)] + [(k, v) for k, v in out_headers if k.lower() != 'host']
+        if request_framing[0] == 'chunked':
+            out_headers.append(('Transfer-Encoding', 'chunked'))
+        if upgrade:
+            out_headers += [('Connection', 'Upgrade'), ('Upgrade', upgrade)]
+        elif version == 'HTTP/1.0':
+            out_headers.append(('Connection', 'keep-alive'))
+        if any(k.lower() == 'expect' and v.lower() == '100-continue' for k, v in out_headers):
+            # Body is streamed right after the head, so answer the expectation here
+            out_headers = [(k, v) for k, v in out_headers if k.lower() != 'expect']
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+        request_head = render_head(f"{method} {path} {version}", out_headers)
+        has_body = request_framing not in (('none', 0), ('length', 0))
+
+        for attempt in range(2):
+            try:
+                up_reader, up_writer, reused = await self.pool.acquire(host, port)
+            except asyncio.TimeoutError:
+                raise HttpError(504, "Gateway Timeout")
+            except (SocksError, OSError, asyncio.IncompleteReadError) as e:
+                logger.info(f"Tunnel to {host}:{port} failed: {e!r}")
+                raise HttpError(502, "Bad Gateway")
+            try:
+                up_writer.write(request_head)
+                await forward_body(reader, up_writer, request_framing)
+                response = await read_head(up_reader)
+                if response is None:
+                    raise ConnectionResetError("Upstream closed before response")
+                break
+            except (ConnectionError, asyncio.IncompleteReadError, OSError):
+                up_writer.close()
+                # A pooled connection may have been closed by the origin while idle;
+                # replay once on a fresh one unless the body is already consumed
+                if not reused or has_body or attempt:
+                    raise HttpError(502, "Bad Gateway")
+            except HttpError:
+                up_writer.close()
+                raise HttpError(502, "Bad Gateway")
+
+        try:
+            return await self._relay_response(method, version, client_keep_alive, response,
+                                              host, port, up_reader, up_writer, reader, writer)
+        except BaseException:
+            up_writer.close()
+            raise
+
+    async def _relay_response(self, method: str, version: str, client_keep_alive: bool,
+                              response: Tuple[str, Headers], host: str, port: int,
+                              up_reader: asyncio.StreamReader, up_writer: asyncio.StreamWriter,
+                              reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """Forward response (after interim 1xx) and decide reuse of both connections."""
+        while True:
+            status_line, resp_headers = response
+            parts = status_line.split(' ', 2)
+            try:
+                status = int(parts[1])
+            except (IndexError, ValueError):
+                raise HttpError(502, "Bad Gateway")
+            if 100 <= status < 200 and status != 101:
+                writer.write(render_head(status_line, resp_headers))
+                response = await read_head(up_reader)
+                if response is None:
+                    raise HttpError(502, "Bad Gateway")
+                continue
+            break
+
+        resp_version = parts[0]
+        if status == 101:
+            writer.write(render_head(status_line, resp_headers))
+            await writer.drain()
+            await asyncio.gather(pipe(reader, up_writer), pipe(up_reader, writer))
+            up_writer.close()
+            return False
+
+        if method == 'HEAD' or status in (204, 304):
+            framing = ('length', 0)
+        else:
+            framing = body_framing(resp_headers)
+        close_delimited = framing == ('none', 0) and not (method == 'HEAD' or status in (204, 304))
+        upstream_reusable = wants_keep_alive(resp_version, resp_headers) and not close_delimited
+        keep_client = client_keep_alive and not close_delimited
+
+        out_headers = strip_hop_by_hop(resp_headers, chunked=framing[0] == 'chunked')
+        if framing[0] == 'chunked' and version == 'HTTP/1.0':
+            # HTTP/1.0 clients cannot parse chunked framing: send the payload
+            # and delimit it by closing the connection
+            framing = ('dechunk', 0)
+            keep_client = False
+        elif framing[0] == 'chunked':
+            out_headers.append(('Transfer-Encoding', 'chunked'))
+        if not keep_client:
+            out_headers.append(('Connection', 'close'))
+        elif version == 'HTTP/1.0':
+            out_headers.append(('Connection', 'keep-alive'))
+        writer.write(render_head(status_line, out_headers))
+
+        if close_delimited:
+            await pipe(up_reader, writer)
+            up_writer.close()
+            return False
+        await forward_body(up_reader, writer, framing)
+        await writer.drain()
+
+        if upstream_reusable:
+            self.pool.release(host, port, up_reader, up_writer)
+        else:
+            up_writer.close()
+        return keep_client
+
+
+# ==================== SERVER ====================
+async def serve_http_proxy(settings: HttpProxySettings, ready: Optional[asyncio.Event] = None) -> None:
+    """
+    Run HTTP proxy listener until cancelled.
+
+    Args:
+        settings: HTTP proxy settings
+        ready: Optional event set once the listener is bound
+    """
+    proxy = HttpProxy(settings)
+    server = await asyncio.start_server(proxy.handle_client, settings.listen_host, settings.listen_port,
+                                        limit=MAX_HEAD_SIZE)
+    logger.info(f"HTTP proxy listening on {settings.listen_host}:{settings.listen_port} "
+                f"(SOCKS5 {settings.socks_host}:{settings.socks_port})")
+    reaper = asyncio.ensure_future(proxy.pool.run_reaper())
+    if ready is not None:
+        ready.set()
+    try:
+        await asyncio.Future()
+    finally:
+        logger.info(f"HTTP proxy stats: {proxy.stats}, pool: {proxy.pool.stats}")
+        reaper.cancel()
+        server.close()
+        proxy.pool.close()
+
+
+# ==================== MAIN ====================
+def main() -> None:
+    """HTTP proxy entry point."""
+    parser = argparse.ArgumentParser(description="HTTP/CONNECT proxy forwarding through the SOCKS5 tunnel")
+    parser.add_argument('--listen', default='127.0.0.1', help="Listen address")
+    parser.add_argument('--port', type=int, default=8118, help="Listen port")
+    parser.add_argument('--socks-host', default='127.0.0.1', help="SOCKS5 address of the tunnel or relay")
+    parser.add_argument('--socks-port', type=int, default=1080, help="Local SOCKS5 port of the SSH tunnel")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    settings = HttpProxySettings(listen_host=args.listen, listen_port=args.port,
+                                 socks_host=args.socks_host, socks_port=args.socks_port)
+    try:
+        asyncio.run(serve_http_proxy(settings))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        logger.error(f"HTTP proxy failed to start: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
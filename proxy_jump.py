@@ -0,0 +1,469 @@
+"""
+Multi-Hop SSH Paths (ProxyJump / ProxyCommand)
+Resolves ProxyJump chains from ~/.ssh/config into ssh options, measures candidate bastion
+paths (end-to-end handshake time and throughput) and caches the results per path.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ============ DEFAULTS ============
+DEFAULT_JUMP_CONFIG = "x_ssh_jump.conf"
+DEFAULT_PATH_STORE = "ssh_path_measurements.json"
+NO_WINDOW = 0x08000000 if os.name == 'nt' else 0
+
+
+# ==================== SSH CONFIG HELPERS ====================
+def host_option(host_info: Dict[str, str], key: str) -> Optional[str]:
+    """Case-insensitive lookup of an ssh config keyword (ssh keywords ignore case)."""
+    key = key.lower()
+    return next((v for k, v in host_info.items() if k.lower() == key), None)
+
+
+def without_options(host_info: Dict[str, str], *keys: str) -> Dict[str, str]:
+    drop = {k.lower() for k in keys}
+    return {k: v for k, v in host_info.items() if k.lower() not in drop}
+
+
+def split_jump_spec(spec: Optional[str]) -> List[str]:
+    """Split a ProxyJump value into hops ('none' or empty means a direct connection)."""
+    if not spec or spec.strip().lower() == 'none':
+        return []
+    return [item.strip() for item in spec.split(',') if item.strip()]
+
+
+def parse_hop(spec: str) -> Dict[str, str]:
+    """
+    Parse a literal ProxyJump hop: [ssh://][user@]host[:port], host may be [IPv6].
+
+    Args:
+        spec: Hop specification
+
+    Returns:
+        Host dictionary in parse_ssh_config format
+    """
+    value = spec[6:] if spec.startswith('ssh://') else spec
+    hop = {'name': spec}
+    if '@' in value:
+        hop['User'], value = value.rsplit('@', 1)
+    if value.startswith('['):
+        host, _, rest = value[1:].partition(']')
+        port = rest[1:] if rest.startswith(':') else ''
+    elif value.count(':') == 1:
+        host, port = value.split(':')
+    else:
+        host, port = value, ''
+    hop['HostName'] = host
+    if port:
+        hop['Port'] = port
+    return hop
+
+
+def resolve_jump_chain(spec: Optional[str], hosts: List[Dict[str, str]],
+                       _seen: Optional[frozenset] = None) -> List[Dict[str, str]]:
+    """
+    Resolve a ProxyJump value into the ordered list of hops, first hop first.
+    A bastion that has its own ProxyJump is reached through that chain, as ssh does.
+
+    Args:
+        spec: ProxyJump value
+        hosts: Hosts from parse_ssh_config
+
+    Returns:
+        List of hop dictionaries
+
+    Raises:
+        ValueError: ProxyJump chain loops back on itself
+    """
+    seen = _seen or frozenset()
+    hops = []
+    for item in split_jump_spec(spec):
+        if item in seen:
+            raise ValueError(f"ProxyJump loop at {item}")
+        known = next((h for h in hosts if h['name'] == item), None)
+        hop = dict(known) if known else parse_hop(item)
+        inner = host_option(hop, 'ProxyJump')
+        if known and inner:
+            hops.extend(resolve_jump_chain(inner, hosts, seen | {item}))
+        hops.append(hop)
+    return hops
+
+
+def host_jump_chain(host_info: Dict[str, str], hosts: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    return resolve_jump_chain(host_option(host_info, 'ProxyJump'), hosts, frozenset([host_info.get('name', '')]))
+
+
+def path_label(host_info: Dict[str, str], chain: Iterable[Dict[str, str]]) -> str:
+    """Human-readable path, e.g. 'bastion-a > exit-de'."""
+    names = [hop['name'] for hop in chain] + [host_info.get('name', '')]
+    label = ' > '.join(names)
+    proxy_command = host_option(host_info, 'ProxyCommand')
+    if proxy_command and proxy_command.lower() != 'none':
+        label += ' (ProxyCommand)'
+    return label
+
+
+# ==================== SSH OPTIONS ====================
+def hop_alias(hop: Dict[str, str], key_path: Optional[str]) -> str:
+    """Stable alias for a hop in the generated config."""
+    ident = f"{hop.get('User', '')}@{hop.get('HostName', hop['name'])}:{hop.get('Port', '22')}:{key_path or ''}"
+    return 'jump-' + hashlib.sha1(ident.encode()).hexdigest()[:10]
+
+
+def _hop_block(alias: str, hop: Dict[str, str], key_path: Optional[str]) -> str:
+    lines = [f"Host {alias}", f"    HostName {hop.get('HostName', hop['name'])}"]
+    if host_option(hop, 'Port'):
+        lines.append(f"    Port {host_option(hop, 'Port')}")
+    if host_option(hop, 'User'):
+        lines.append(f"    User {host_option(hop, 'User')}")
+    if key_path:
+        lines.append(f'    IdentityFile "{key_path}"')
+    if (host_option(hop, 'IdentitiesOnly') or '').lower() == 'yes':
+        lines.append("    IdentitiesOnly yes")
+    # Same options the tunnel itself uses; -o options are not passed on to jump hosts
+    lines += ["    ConnectTimeout 10", "    ServerAliveInterval 60", "    ServerAliveCountMax 3",
+              "    StrictHostKeyChecking no", "    UserKnownHostsFile /dev/null"]
+    return '\n'.join(lines) + '\n'
+
+
+def write_jump_config(chain: List[Dict[str, str]], default_key: Optional[str],
+                      path: str = DEFAULT_JUMP_CONFIG, include: Optional[str] = None) -> List[str]:
+    """
+    Add ssh config blocks for the hops to path and return their aliases.
+
+    Args:
+        chain: Hops from resolve_jump_chain
+        default_key: Key used for hops without their own IdentityFile
+        path: Generated config file (passed to ssh with -F, which jump hops inherit)
+        include: User ssh config included after the hop blocks, since -F replaces it
+
+    Returns:
+        Aliases in hop order
+    """
+    blocks: Dict[str, str] = {}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for block in f.read().split('\n\n'):
+                if block.startswith('Host '):
+                    blocks[block.split(None, 2)[1]] = block.strip() + '\n'
+    aliases = []
+    for hop in chain:
+        key_path = os.path.expanduser(host_option(hop, 'IdentityFile') or '') or default_key
+        alias = hop_alias(hop, key_path)
+        blocks[alias] = _hop_block(alias, hop, key_path)
+        aliases.append(alias)
+    text = '\n'.join(blocks[a] for a in sorted(blocks))
+    if include:
+        # Last, so the hop blocks win (ssh keeps the first value it finds for an option)
+        text += f'\nMatch all\n    Include "{os.path.abspath(include)}"\n'
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return aliases
+
+
+def jump_ssh_options(host_info: Dict[str, str], hosts: List[Dict[str, str]], key_path: Optional[str],
+                     config_path: str = DEFAULT_JUMP_CONFIG, user_config: Optional[str] = None) -> List[str]:
+    """
+    ssh options that route the connection like the host's ProxyCommand/ProxyJump.
+
+    Args:
+        host_info: Exit host
+        hosts: Hosts from parse_ssh_config (for bastion aliases)
+        key_path: Exit host key, also used for bastions without IdentityFile
+        config_path: Generated config file for the hops
+        user_config: User ssh config, kept in effect through an Include when it exists
+
+    Returns:
+        Extra ssh arguments (empty for a direct connection)
+    """
+    proxy_command = host_option(host_info, 'ProxyCommand')
+    if proxy_command and proxy_command.lower() != 'none':
+        return ['-o', f'ProxyCommand={proxy_command}']
+    chain = host_jump_chain(host_info, hosts)
+    if not chain:
+        return []
+    include = user_config if user_config and os.path.isfile(user_config) else None
+    aliases = write_jump_config(chain, key_path, config_path, include)
+    return ['-F', os.path.abspath(config_path), '-J', ','.join(aliases)]
+
+
+# ==================== PATH MEASUREMENT ====================
+@dataclass
+class PathMeasurement:
+    """End-to-end measurement of one path to an exit host."""
+    path: str
+    jump: str
+    handshake_ms: Optional[float]
+    mbps: Optional[float]
+    error: str
+    measured_at: float
+    expires_at: float
+
+
+def measure_command(command: List[str], probe_bytes: int, timeout: float = 30.0) -> Tuple[Optional[float], Optional[float], str]:
+    """
+    Run an ssh command that writes probe_bytes to stdout and time it.
+
+    Time to the first byte covers TCP, key exchange and authentication on every hop;
+    the rest of the transfer gives the throughput.
+
+    Args:
+        command: ssh command ending in a remote command such as 'head -c N /dev/zero'
+        probe_bytes: Expected output size
+        timeout: Kill the command after this many seconds
+
+    Returns:
+        (handshake_ms, mbps, error) - values are None on failure
+    """
+    start = time.perf_counter()
+    try:
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                stdin=subprocess.DEVNULL, creationflags=NO_WINDOW)
+    except OSError as e:
+        return None, None, str(e)
+    timed_out = []
+
+    def kill() -> None:
+        timed_out.append(True)
+        proc.kill()
+
+    timer = threading.Timer(timeout, kill)
+    timer.start()
+    first_byte = None
+    received = 0
+    try:
+        while True:
+            data = proc.stdout.read1(65536)
+            if not data:
+                break
+            if first_byte is None:
+                first_byte = time.perf_counter()
+            received += len(data)
+        proc.wait()
+        stderr = proc.stderr.read().decode(errors='replace').strip()
+    finally:
+        timer.cancel()
+    end = time.perf_counter()
+
+    if first_byte is None or received < probe_bytes:
+        if timed_out:
+            return None, None, f"timeout after {timeout:.0f}s"
+        return None, None, stderr.splitlines()[-1] if stderr else f"exit code {proc.returncode}"
+    handshake_ms = (first_byte - start) * 1000
+    mbps = received * 8 / max(end - first_byte, 1e-6) / 1e6
+    return handshake_ms, mbps, ''
+
+
+class PathStore:
+    """JSON file of path measurements keyed by path label, each with its own expiry."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.items: Dict[str, PathMeasurement] = {}
+
+    def load(self) -> 'PathStore':
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.items = {k: PathMeasurement(**v) for k, v in data.items()}
+        except Exception as e:
+            logger.warning(f"Failed to load path measurements from {self.path}: {e}")
+            self.items = {}
+        return self
+
+    def save(self) -> None:
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({k: asdict(v) for k, v in sorted(self.items.items())}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def fresh(self, label: str, now: Optional[float] = None) -> Optional[PathMeasurement]:
+        now = time.time() if now is None else now
+        item = self.items.get(label)
+        return item if item is not None and item.expires_at > now else None
+
+
+def choose_path(measurements: List[PathMeasurement], min_throughput: float = 0.5) -> Optional[PathMeasurement]:
+    """
+    Pick the path with the lowest handshake time among those reaching at least
+    min_throughput of the best measured throughput.
+
+    Args:
+        measurements: Candidate measurements
+        min_throughput: Fraction of the best throughput a path must reach
+
+    Returns:
+        Best measurement or None when every path failed
+    """
+    ok = [m for m in measurements if m.handshake_ms is not None]
+    if not ok:
+        return None
+    best_mbps = max(m.mbps or 0 for m in ok)
+    eligible = [m for m in ok if (m.mbps or 0) >= best_mbps * min_throughput]
+    return min(eligible, key=lambda m: m.handshake_ms)
+
+
+def candidate_hosts(host_info: Dict[str, str], candidates: Iterable[str]) -> List[Dict[str, str]]:
+    """The host as configured followed by one copy per alternative ProxyJump value."""
+    variants = [host_info]
+    own = (host_option(host_info, 'ProxyJump') or 'none').strip()
+    seen = {own} if not host_option(host_info, 'ProxyCommand') else set()
+    for spec in candidates:
+        spec = spec.strip() or 'none'
+        if spec in seen:
+            continue
+        seen.add(spec)
+        variant = without_options(host_info, 'ProxyJump', 'ProxyCommand')
+        variant['ProxyJump'] = spec
+        variants.append(variant)
+    return variants
+
+
+def select_path(host_info: Dict[str, str], hosts: List[Dict[str, str]], candidates: Iterable[str],
+                command_for: Callable[[Dict[str, str]], List[str]], store_path: str = DEFAULT_PATH_STORE,
+                ttl_hours: float = 6.0, probe_bytes: int = 1024 * 1024, remeasure: bool = False,
+                on_result: Optional[Callable[[PathMeasurement, bool], None]] = None
+                ) -> Tuple[Dict[str, str], List[PathMeasurement]]:
+    """
+    Measure every candidate path to the host (cached per path) and return the fastest.
+
+    Args:
+        host_info: Exit host
+        hosts: Hosts from parse_ssh_config
+        candidates: Alternative ProxyJump values ('none' = direct)
+        command_for: Builds the probe command for a host variant
+        store_path: Measurement cache file
+        ttl_hours: Cache lifetime of one measurement
+        probe_bytes: Bytes transferred per probe
+        remeasure: Ignore cached results
+        on_result: Called with (measurement, cached) for each path
+
+    Returns:
+        (host variant to connect with, measurements)
+    """
+    variants = candidate_hosts(host_info, candidates)
+    if len(variants) < 2:
+        return host_info, []
+
+    chosen, measurements = rank_paths(variants, hosts, command_for, store_path, ttl_hours,
+                                      probe_bytes, remeasure, on_result)
+    if chosen is None:
+        logger.warning(f"No candidate path to {host_info.get('name')} worked, using it as configured")
+        return host_info, measurements
+    return chosen, measurements
+
+
+def rank_paths(variants: List[Dict[str, str]], hosts: List[Dict[str, str]],
+               command_for: Callable[[Dict[str, str]], List[str]], store_path: str = DEFAULT_PATH_STORE,
+               ttl_hours: float = 6.0, probe_bytes: int = 1024 * 1024, remeasure: bool = False,
+               on_result: Optional[Callable[[PathMeasurement, bool], None]] = None
+               ) -> Tuple[Optional[Dict[str, str]], List[PathMeasurement]]:
+    """
+    Measure each host (or host variant) through the cache and pick the best with choose_path.
+
+    Args:
+        variants: Hosts to compare; paths to one host or different exit hosts
+        hosts: Hosts from parse_ssh_config
+        command_for: Builds the probe command for a host
+        store_path: Measurement cache file
+        ttl_hours: Cache lifetime of one measurement
+        probe_bytes: Bytes transferred per probe
+        remeasure: Ignore cached results
+        on_result: Called with (measurement, cached) for each path
+
+    Returns:
+        (best host or None when every path failed, measurements)
+    """
+    store = PathStore(store_path).load()
+    results: List[Tuple[Dict[str, str], PathMeasurement]] = []
+    for variant in variants:
+        try:
+            label = path_label(variant, host_jump_chain(variant, hosts))
+        except ValueError as e:
+            logger.warning(f"Skipping path for {variant.get('name')}: {e}")
+            continue
+        cached = None if remeasure else store.fresh(label)
+        if cached is None:
+            handshake_ms, mbps, error = measure_command(command_for(variant), probe_bytes)
+            now = time.time()
+            # Failed paths are retried sooner than successful ones
+            ttl = ttl_hours * 3600 if error == '' else min(ttl_hours * 3600, 600)
+            measurement = PathMeasurement(path=label, jump=host_option(variant, 'ProxyJump') or 'none',
+                                          handshake_ms=handshake_ms, mbps=mbps, error=error,
+                                          measured_at=now, expires_at=now + ttl)
+            store.items[label] = measurement
+        else:
+            measurement = cached
+        results.append((variant, measurement))
+        if on_result:
+            on_result(measurement, cached is not None)
+
+    try:
+        store.save()
+    except OSError as e:
+        logger.warning(f"Failed to save path measurements: {e}")
+
+    best = choose_path([m for _, m in results])
+    if best is None:
+        return None, [m for _, m in results]
+    logger.info(f"Selected path {best.path}: {best.handshake_ms:.0f} ms handshake, {best.mbps:.1f} Mbit/s")
+    return next(v for v, m in results if m is best), [m for _, m in results]
+
+
+def format_measurement(m: PathMeasurement, cached: bool = False) -> str:
+    if m.handshake_ms is None:
+        return f"{m.path:40s} failed: {m.error}"
+    return (f"{m.path:40s} {m.handshake_ms:8.0f} ms {m.mbps:8.1f} Mbit/s"
+            + ("  (cached)" if cached else ""))
+
+
+# ==================== MAIN ====================
+def main() -> None:
+    """Measure the paths to one host and print the ranking."""
+    from proxy_start_v25 import config, parse_ssh_config, validate_key_file, build_probe_command
+
+    parser = argparse.ArgumentParser(description="Measure ProxyJump paths to an SSH host")
+    parser.add_argument('host', help="Host alias from ~/.ssh/config")
+    parser.add_argument('--candidate', action='append', default=[],
+                        help="Alternative ProxyJump value, e.g. bastion-b or none (repeatable)")
+    parser.add_argument('--remeasure', action='store_true', help="Ignore cached measurements")
+    parser.add_argument('--probe-kb', type=int, default=config.jump_probe_kb, help="Probe transfer size")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    hosts = parse_ssh_config(config.ssh_config_path)
+    host = next((h for h in hosts if h['name'] == args.host), None)
+    if host is None:
+        parser.error(f"host {args.host} not found in {config.ssh_config_path}")
+    key_path = validate_key_file(host.get('IdentityFile', '')) if host.get('IdentityFile') else None
+    candidates = config.jump_candidates.get(args.host, []) + args.candidate
+    probe_bytes = args.probe_kb * 1024
+
+    print(f"{'path':40s} {'handshake':>11s} {'throughput':>15s}")
+    chosen, measurements = select_path(
+        host, hosts, candidates, lambda h: build_probe_command(h, key_path, probe_bytes),
+        store_path=config.jump_store_file, ttl_hours=config.jump_cache_hours, probe_bytes=probe_bytes,
+        remeasure=args.remeasure, on_result=lambda m, cached: print(format_measurement(m, cached)))
+    if not measurements:
+        print("Only one path configured; add alternatives with --candidate or config.jump_candidates")
+        return
+    print(f"\nSelected: {path_label(chosen, host_jump_chain(chosen, hosts))}")
+
+
+if __name__ == "__main__":
+    main()
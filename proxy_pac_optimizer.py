@@ -0,0 +1,445 @@
+"""
+Measurement-Driven PAC Optimizer
+Races a direct TCP/TLS connect against a SOCKS5 CONNECT through the tunnel for each domain,
+stores results with expiry and emits DIRECT/proxy rules for the PAC generator.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import ssl
+import statistics
+import sys
+import time
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, Iterable, List, Optional
+
+from proxy_socks import open_socks_connection
+
+logger = logging.getLogger(__name__)
+
+# ============ DEFAULTS ============
+DEFAULT_STORE_FILE = "pac_measurements.json"
+DEFAULT_RULES_FILE = "pac_rules.json"
+
+
+@dataclass
+class OptimizerSettings:
+    """Optimizer settings."""
+    socks_host: str = '127.0.0.1'
+    socks_port: int = 1080
+    port: int = 443
+    tls: bool = True
+    samples: int = 3
+    timeout: float = 5.0
+    concurrency: int = 16
+    rate: float = 10.0
+    ttl_hours: float = 24.0
+    margin: float = 0.2
+    min_gain_ms: float = 5.0
+
+
+@dataclass
+class Measurement:
+    """Latency measurement of one domain."""
+    domain: str
+    direct_ms: Optional[float]
+    tunnel_ms: Optional[float]
+    measured_at: float
+    expires_at: float
+
+    @property
+    def verdict(self) -> Optional[str]:
+        """'direct', 'proxy' or None when both paths failed."""
+        if self.direct_ms is None and self.tunnel_ms is None:
+            return None
+        if self.direct_ms is None:
+            return 'proxy'
+        if self.tunnel_ms is None:
+            return 'direct'
+        return 'direct' if self.direct_ms <= self.tunnel_ms else 'proxy'
+
+
+# ==================== DOMAIN INPUT ====================
+def normalize_domain(entry: str) -> Optional[str]:
+    """
+    Extract bare host name from a domain, host:port or URL line.
+
+    Args:
+        entry: Raw input line
+
+    Returns:
+        Lowercase host name or None for comments/IP literals/blank lines/invalid names
+    """
+    entry = entry.strip().lower()
+    if not entry or entry.startswith('#'):
+        return None
+    entry = entry.split()[0]
+    if '://' in entry:
+        entry = entry.split('://', 1)[1]
+    entry = entry.split('/', 1)[0].rsplit('@', 1)[-1]
+    if entry.startswith('['):
+        return None
+    host = entry.split(':', 1)[0].strip('.')
+    if not host or host.replace('.', '').isdigit() or '.' not in host:
+        return None
+    try:
+        host.encode('idna')  # Empty or over-long labels cannot be resolved or sent to SOCKS
+    except UnicodeError:
+        return None
+    return host
+
+
+def load_domains(lines: Iterable[str]) -> List[str]:
+    """Normalize and deduplicate domains preserving input order."""
+    seen = {}
+    for line in lines:
+        host = normalize_domain(line)
+        if host:
+            seen.setdefault(host, None)
+    return list(seen)
+
+
+# ==================== MEASUREMENT ====================
+def _tls_context() -> ssl.SSLContext:
+    # Only handshake latency matters here, certificate validity does not
+    ctx = ssl.create_default_context()
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
+
+class RateLimiter:
+    """Spaces out connection attempts to at most `rate` per second."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+async def _start_tls(writer: asyncio.StreamWriter, host: str, ctx: ssl.SSLContext) -> None:
+    loop = asyncio.get_running_loop()
+    transport = await loop.start_tls(writer.transport, writer.transport.get_protocol(), ctx,
+                                     server_hostname=host)
+    transport.close()
+
+
+async def measure_direct(host: str, settings: OptimizerSettings) -> Optional[float]:
+    """
+    Time a direct TCP (and TLS) connect including local name resolution.
+
+    Args:
+        host: Destination host
+        settings: Optimizer settings
+
+    Returns:
+        Milliseconds or None on failure
+    """
+    start = time.perf_counter()
+    writer = None
+    try:
+        ctx = _tls_context() if settings.tls else None
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, settings.port, ssl=ctx,
+                                    server_hostname=host if ctx else None),
+            settings.timeout)
+        return (time.perf_counter() - start) * 1000
+    except (OSError, asyncio.TimeoutError, ssl.SSLError, UnicodeError, ValueError) as e:
+        logger.debug(f"Direct connect to {host} failed: {e!r}")
+        return None
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def measure_tunnel(host: str, settings: OptimizerSettings) -> Optional[float]:
+    """
+    Time a SOCKS5 CONNECT (and TLS) through the tunnel with remote name resolution.
+
+    Args:
+        host: Destination host
+        settings: Optimizer settings
+
+    Returns:
+        Milliseconds or None on failure
+    """
+    start = time.perf_counter()
+    writer = None
+    try:
+        _, writer = await open_socks_connection(host, settings.port, settings.socks_host,
+                                                settings.socks_port, timeout=settings.timeout)
+        if settings.tls:
+            await asyncio.wait_for(_start_tls(writer, host, _tls_context()), settings.timeout)
+        return (time.perf_counter() - start) * 1000
+    except (OSError, asyncio.TimeoutError, ssl.SSLError, asyncio.IncompleteReadError,
+            UnicodeError, ValueError) as e:
+        logger.debug(f"Tunnel connect to {host} failed: {e!r}")
+        return None
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _median(values: List[Optional[float]]) -> Optional[float]:
+    ok = [v for v in values if v is not None]
+    return round(statistics.median(ok), 1) if ok else None
+
+
+async def measure_domain(host: str, settings: OptimizerSettings, limiter: RateLimiter) -> Measurement:
+    """
+    Race direct and tunnel connects for one domain over several samples.
+
+    Args:
+        host: Destination host
+        settings: Optimizer settings
+        limiter: Shared rate limiter
+
+    Returns:
+        Measurement with median latencies
+    """
+    direct, tunnel = [], []
+    for _ in range(settings.samples):
+        await limiter.acquire()
+        d, t = await asyncio.gather(measure_direct(host, settings), measure_tunnel(host, settings))
+        direct.append(d)
+        tunnel.append(t)
+    now = time.time()
+    return Measurement(host, _median(direct), _median(tunnel), now, now + settings.ttl_hours * 3600)
+
+
+async def measure_domains(domains: List[str], settings: OptimizerSettings,
+                          on_result: Optional[Callable[[Measurement], None]] = None) -> List[Measurement]:
+    """Measure domains with bounded concurrency and rate, reporting each result as it completes."""
+    limiter = RateLimiter(settings.rate)
+    semaphore = asyncio.Semaphore(settings.concurrency)
+
+    async def run(host: str) -> Measurement:
+        async with semaphore:
+            result = await measure_domain(host, settings, limiter)
+            logger.info(f"{host}: direct={result.direct_ms} ms tunnel={result.tunnel_ms} ms")
+            if on_result is not None:
+                on_result(result)
+            return result
+
+    return list(await asyncio.gather(*(run(host) for host in domains)))
+
+
+# ==================== RESULT STORE ====================
+class MeasurementStore:
+    """JSON file of measurements keyed by domain, each with its own expiry."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.items: Dict[str, Measurement] = {}
+
+    def load(self) -> 'MeasurementStore':
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.items = {k: Measurement(**v) for k, v in data.items()}
+        except Exception as e:
+            logger.warning(f"Failed to load measurements from {self.path}: {e}")
+            self.items = {}
+        return self
+
+    def save(self) -> None:
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({k: asdict(v) for k, v in sorted(self.items.items())}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def stale(self, domains: List[str], now: Optional[float] = None) -> List[str]:
+        """Return domains without an unexpired measurement."""
+        now = time.time() if now is None else now
+        return [d for d in domains if d not in self.items or self.items[d].expires_at <= now]
+
+    def update(self, measurements: Iterable[Measurement]) -> None:
+        for m in measurements:
+            self.items[m.domain] = m
+
+    def prune(self, now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        self.items = {k: v for k, v in self.items.items() if v.expires_at > now}
+
+
+# ==================== RULE GENERATION ====================
+def build_rules(measurements: Iterable[Measurement], margin: float = 0.2,
+                min_gain_ms: float = 5.0) -> Dict[str, List[str]]:
+    """
+    Turn measurements into DIRECT/proxy domain lists.
+
+    A domain is only moved off its default when the winner is faster by both
+    the relative margin and the absolute gain, so jitter does not flip rules.
+
+    Args:
+        measurements: Measurements to classify
+        margin: Required relative advantage (0.2 = 20% faster)
+        min_gain_ms: Required absolute advantage in milliseconds
+
+    Returns:
+        Dict with sorted 'direct' and 'proxy' domain lists
+    """
+    direct, proxy = [], []
+    for m in measurements:
+        verdict = m.verdict
+        if verdict is None:
+            continue
+        if m.direct_ms is not None and m.tunnel_ms is not None:
+            fast, slow = sorted((m.direct_ms, m.tunnel_ms))
+            if slow - fast < min_gain_ms or slow < fast * (1 + margin):
+                continue
+        (direct if verdict == 'direct' else proxy).append(m.domain)
+    return {'direct': sorted(direct), 'proxy': sorted(proxy)}
+
+
+def save_pac_rules(path: str, rules: Dict[str, List[str]]) -> None:
+    """Write rule lists, keeping hand-written sections (e.g. bandwidth limits) of an existing file."""
+    data = {}
+    try:
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+    except Exception as e:
+        logger.warning(f"Existing PAC rules in {path} not readable, overwriting: {e}")
+    data.update(rules, generated_at=int(time.time()))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_pac_rules(path: str) -> Optional[Dict[str, List[str]]]:
+    """
+    Load rule set written by this optimizer.
+
+    Args:
+        path: Path to rules JSON
+
+    Returns:
+        Dict with 'direct' and 'proxy' lists or None if missing/invalid
+    """
+    try:
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return {'direct': list(data.get('direct', [])), 'proxy': list(data.get('proxy', []))}
+    except Exception as e:
+        logger.warning(f"Failed to load PAC rules from {path}: {e}")
+        return None
+
+
+def render_pac_rules(rules: Optional[Dict[str, List[str]]], proxy: str) -> str:
+    """
+    Render learned rules as a PAC (JavaScript) block for FindProxyForURL.
+
+    The block walks the host's parent domains from most to least specific
+    and does one object lookup per label.
+
+    Args:
+        rules: Rule set from load_pac_rules (None renders nothing)
+        proxy: PAC proxy string for tunnelled domains
+
+    Returns:
+        JavaScript snippet (empty string if there are no rules)
+    """
+    if not rules or not (rules.get('direct') or rules.get('proxy')):
+        return ''
+    learned_proxy = json.dumps(dict.fromkeys(rules.get('proxy', []), 1))
+    learned_direct = json.dumps(dict.fromkeys(rules.get('direct', []), 1))
+    return f'''    // Learned by proxy_pac_optimizer.py (measured latency)
+    var learnedProxy = {learned_proxy};
+    var learnedDirect = {learned_direct};
+    for (var d = host; d; d = d.indexOf(".") < 0 ? "" : d.substring(d.indexOf(".") + 1)) {{
+        if (learnedProxy.hasOwnProperty(d)) {{
+            return "{proxy}";
+        }}
+        if (learnedDirect.hasOwnProperty(d)) {{
+            return "DIRECT";
+        }}
+    }}
+'''
+
+
+# ==================== MAIN ====================
+def main() -> None:
+    """PAC optimizer entry point."""
+    parser = argparse.ArgumentParser(description="Learn which domains are faster DIRECT or through the tunnel")
+    parser.add_argument('domains', help="File with domains, host:port or URLs (one per line, '-' for stdin)")
+    parser.add_argument('--socks-port', type=int, default=1080, help="Local SOCKS5 port of the SSH tunnel")
+    parser.add_argument('--port', type=int, default=443, help="Destination port to connect to")
+    parser.add_argument('--no-tls', action='store_true', help="Measure TCP connect only")
+    parser.add_argument('--samples', type=int, default=3, help="Samples per domain (median is used)")
+    parser.add_argument('--concurrency', type=int, default=16, help="Domains measured in parallel")
+    parser.add_argument('--rate', type=float, default=10.0, help="Max measurement rounds per second")
+    parser.add_argument('--ttl-hours', type=float, default=24.0, help="Measurement expiry")
+    parser.add_argument('--margin', type=float, default=0.2, help="Required relative advantage")
+    parser.add_argument('--store', default=DEFAULT_STORE_FILE, help="Measurement store JSON")
+    parser.add_argument('--rules', default=DEFAULT_RULES_FILE, help="Output PAC rules JSON")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    settings = OptimizerSettings(
+        socks_port=args.socks_port,
+        port=args.port,
+        tls=not args.no_tls,
+        samples=max(1, args.samples),
+        concurrency=max(1, args.concurrency),
+        rate=args.rate,
+        ttl_hours=args.ttl_hours,
+        margin=args.margin,
+    )
+
+    try:
+        if args.domains == '-':
+            domains = load_domains(sys.stdin)
+        else:
+            with open(args.domains, 'r', encoding='utf-8') as f:
+                domains = load_domains(f)
+    except OSError as e:
+        logger.error(f"Failed to read domain list: {e}")
+        sys.exit(1)
+
+    store = MeasurementStore(args.store).load()
+    store.prune()
+    pending = store.stale(domains)
+    print(f"Domains: {len(domains)}, cached: {len(domains) - len(pending)}, to measure: {len(pending)}")
+
+    if pending:
+        try:
+            asyncio.run(measure_domains(pending, settings, on_result=lambda m: store.update([m])))
+        except KeyboardInterrupt:
+            print("Interrupted, saving partial results")
+        finally:
+            store.save()
+
+    rules = build_rules(store.items.values(), settings.margin, settings.min_gain_ms)
+    save_pac_rules(args.rules, rules)
+
+    for domain in domains:
+        m = store.items.get(domain)
+        if m is not None:
+            print(f"{domain:40} direct={m.direct_ms!s:>8} ms  tunnel={m.tunnel_ms!s:>8} ms  -> {m.verdict}")
+    print(f"Rules written to {args.rules}: {len(rules['direct'])} DIRECT, {len(rules['proxy'])} proxy")
+
+
+if __name__ == "__main__":
+    main()
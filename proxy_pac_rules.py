@@ -0,0 +1,382 @@
+"""
+Compiled PAC Rules
+Compiles the generated PAC file (proxy_pac.back template plus learned rules) into lookup tables so
+clients without a JavaScript engine get the same answer as the browser:
+
+    rules = compile_pac_file("proxy.pac")
+    rules.resolve("www.example.com")   # -> "SOCKS5 127.0.0.1:1080" or "DIRECT"
+
+FindProxyForURL is read as a sequence of blocks; the first matching block returns. Supported
+conditions (joined with ||): isPlainHostName(host), host === "x", shExpMatch(host, "pattern"),
+dnsDomainIs(host, "x") and isInNet(host, "ip", "mask"), plus the learned-rules loop rendered by
+proxy_pac_optimizer.py. isInNet matches IP literals only (host names are not resolved). Hosts are
+compared verbatim, as the browser does: lowercased only if the PAC does host.toLowerCase(), and a
+trailing dot is kept ("localhost." is not a plain host name).
+"""
+import ipaddress
+import json
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+CACHE_SIZE = 65536
+
+_IF = re.compile(r'if\s*\(')
+_RETURN = re.compile(r'\{?\s*return\s+"([^"]*)"\s*;?\s*\}?')
+_LOWER = re.compile(r'host\s*=\s*host\.toLowerCase\(\)\s*;')
+_VAR = re.compile(r'var\s+(\w+)\s*=\s*')
+_FOR = re.compile(r'for\s*\(')
+_LEARNED_CHECK = re.compile(r'(\w+)\.hasOwnProperty\(d\)\s*\)\s*\{\s*return\s+"([^"]*)"')
+_PLAIN = re.compile(r'isPlainHostName\(\s*host\s*\)$')
+_EQUALS = re.compile(r'host\s*===?\s*"([^"]*)"$')
+_SHEXP = re.compile(r'shExpMatch\(\s*host\s*,\s*"([^"]*)"\s*\)$')
+_DOMAIN_IS = re.compile(r'dnsDomainIs\(\s*host\s*,\s*"([^"]*)"\s*\)$')
+_IN_NET = re.compile(r'isInNet\(\s*host\s*,\s*"([^"]*)"\s*,\s*"([^"]*)"\s*\)$')
+
+
+# ==================== PARSING ====================
+def strip_comments(source: str) -> str:
+    """Remove // and /* */ comments outside string literals."""
+    out, i, n = [], 0, len(source)
+    while i < n:
+        c = source[i]
+        if c in '"\'':
+            end = i + 1
+            while end < n and source[end] != c:
+                end += 2 if source[end] == '\\' else 1
+            out.append(source[i:end + 1])
+            i = end + 1
+        elif source.startswith('//', i):
+            i = source.find('\n', i)
+            i = n if i < 0 else i
+        elif source.startswith('/*', i):
+            i = source.find('*/', i + 2)
+            i = n if i < 0 else i + 2
+        else:
+            out.append(c)
+            i += 1
+    return ''.join(out)
+
+
+def _closing(source: str, start: int, open_char: str, close_char: str) -> int:
+    """Index just past the bracket matching source[start] (strings are skipped)."""
+    depth, i = 0, start
+    while i < len(source):
+        c = source[i]
+        if c == '"':
+            i = source.index('"', i + 1)
+        elif c == open_char:
+            depth += 1
+        elif c == close_char:
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    raise ValueError("unbalanced brackets in PAC")
+
+
+def shexp_regex(pattern: str) -> 're.Pattern':
+    """shExpMatch pattern as an anchored regex (* any run, ? one character)."""
+    return re.compile(''.join('.*' if c == '*' else '.' if c == '?' else re.escape(c) for c in pattern) + r'\Z')
+
+
+def _function_body(source: str) -> str:
+    match = re.search(r'function\s+FindProxyForURL\s*\(\s*\w+\s*,\s*host\s*\)\s*', source)
+    if not match or source[match.end()] != '{':
+        raise ValueError("FindProxyForURL(url, host) not found")
+    return source[match.end() + 1:_closing(source, match.end(), '{', '}') - 1]
+
+
+# ==================== RULE SET ====================
+class _Node:
+    """Trie node; fields hold the first block index matching at this node."""
+    __slots__ = ('children', 'exact', 'below', 'learned')
+
+    def __init__(self):
+        self.children: Dict[str, '_Node'] = {}
+        self.exact: Optional[int] = None   # host is exactly this name
+        self.below: Optional[int] = None   # host has more labels (subdomain / prefix)
+        self.learned: Optional[str] = None  # Result of the learned block for this domain
+
+    def child(self, label: str) -> '_Node':
+        node = self.children.get(label)
+        if node is None:
+            node = self.children[label] = _Node()
+        return node
+
+
+def _first(current: Optional[int], block: int) -> int:
+    return block if current is None else min(current, block)
+
+
+class PacRuleSet:
+    """
+    PAC decision table: blocks in PAC order, each with one result.
+
+    Lookups combine a reversed-label suffix trie (exact names, "*.domain" patterns and
+    learned domains), a forward label trie ("prefix.*"), a CIDR index (isInNet) and
+    regexes for any other shExpMatch pattern; the lowest matching block wins.
+    """
+
+    def __init__(self, cache_size: int = CACHE_SIZE):
+        self.results: List[str] = []      # Block index -> PAC result
+        self.conditions: List[List[Tuple[str, object]]] = []  # Parsed conditions (reference evaluator)
+        self.default = "DIRECT"
+        self.suffixes = _Node()
+        self.prefixes = _Node()
+        self.networks: Dict[int, Dict[int, int]] = {}  # prefix length -> network int -> block
+        self.patterns: List[Tuple[int, 're.Pattern']] = []
+        self.plain: Optional[int] = None
+        self.learned_block: Optional[int] = None
+        self.lowercase = False            # PAC starts with host = host.toLowerCase()
+        self.resolve = lru_cache(maxsize=cache_size)(self._resolve)
+
+    # ---------- building ----------
+    def add_block(self, conditions: List[Tuple[str, object]], result: str) -> None:
+        block = len(self.results)
+        self.results.append(result)
+        self.conditions.append(conditions)
+        for kind, value in conditions:
+            if kind == 'plain':
+                self.plain = _first(self.plain, block)
+            elif kind == 'exact':
+                node = self._suffix_node(value)
+                node.exact = _first(node.exact, block)
+            elif kind == 'subdomain':
+                node = self._suffix_node(value)
+                node.below = _first(node.below, block)
+            elif kind == 'prefix':
+                node = self.prefixes
+                for label in value.split('.'):
+                    node = node.child(label)
+                node.below = _first(node.below, block)
+            elif kind == 'net':
+                network = value
+                table = self.networks.setdefault(network.prefixlen, {})
+                key = int(network.network_address) >> (32 - network.prefixlen)
+                table[key] = _first(table.get(key), block)
+            else:  # 'glob'
+                self.patterns.append((block, shexp_regex(value)))
+        self.patterns.sort(key=lambda item: item[0])
+
+    def add_learned(self, checks: List[Tuple[Dict[str, object], str]]) -> None:
+        """Learned-rules loop: per domain level, checks in order (e.g. proxy before direct)."""
+        block = len(self.results)
+        self.learned_block = block
+        self.results.append('')
+        self.conditions.append([('learned', checks)])
+        for domains, result in reversed(checks):  # Earlier checks win at the same level
+            for domain in domains:
+                self._suffix_node(domain).learned = result
+
+    def _suffix_node(self, name: str) -> _Node:
+        node = self.suffixes
+        for label in reversed(name.split('.')):
+            node = node.child(label)
+        return node
+
+    # ---------- lookup ----------
+    def _resolve(self, host: str) -> str:
+        if self.lowercase:
+            host = host.lower()
+        labels = host.split('.')
+        best, learned = len(self.results), None
+        if self.plain is not None and len(labels) == 1:
+            best = self.plain
+
+        node, depth, last = self.suffixes, 0, len(labels) - 1
+        for label in reversed(labels):
+            node = node.children.get(label)
+            if node is None:
+                break
+            if node.learned is not None:
+                learned = node.learned  # Deepest level wins, as the loop walks most specific first
+            if depth == last:
+                if node.exact is not None and node.exact < best:
+                    best = node.exact
+            elif node.below is not None and node.below < best:
+                best = node.below
+            depth += 1
+
+        node = self.prefixes
+        for label in labels[:-1]:
+            node = node.children.get(label)
+            if node is None:
+                break
+            if node.below is not None and node.below < best:
+                best = node.below
+
+        if self.networks and len(labels) == 4 and host.replace('.', '').isdigit():
+            try:
+                address = int(ipaddress.IPv4Address(host))
+            except ValueError:
+                address = None
+            if address is not None:
+                for length, table in self.networks.items():
+                    block = table.get(address >> (32 - length))
+                    if block is not None and block < best:
+                        best = block
+
+        for block, regex in self.patterns:
+            if block >= best:
+                break
+            if regex.match(host):
+                best = block
+                break
+        if learned is not None and self.learned_block < best:
+            return learned
+        return self.results[best] if best < len(self.results) else self.default
+
+    def resolve_linear(self, host: str) -> str:
+        """Reference evaluator: walks the blocks in order like the PAC does (slow, for checks)."""
+        if self.lowercase:
+            host = host.lower()
+        for block, conditions in enumerate(self.conditions):
+            for kind, value in conditions:
+                if kind == 'learned':
+                    d = host
+                    while d:
+                        for domains, result in value:
+                            if d in domains:
+                                return result
+                        d = d.partition('.')[2]
+                elif _condition_matches(kind, value, host):
+                    return self.results[block]
+        return self.default
+
+    def resolve_many(self, hosts: List[str]) -> List[str]:
+        resolve = self.resolve
+        return [resolve(h) for h in hosts]
+
+
+def _condition_matches(kind: str, value: object, host: str) -> bool:
+    if kind == 'plain':
+        return '.' not in host
+    if kind == 'exact':
+        return host == value
+    if kind == 'subdomain':
+        return host.endswith('.' + value)
+    if kind == 'prefix':
+        return host.startswith(value + '.')
+    if kind == 'net':
+        try:
+            return ipaddress.IPv4Address(host) in value
+        except ValueError:
+            return False
+    return bool(shexp_regex(value).match(host))
+
+
+# ==================== COMPILER ====================
+def parse_condition(text: str) -> List[Tuple[str, object]]:
+    """
+    Parse an if-condition (terms joined by ||) into (kind, value) pairs.
+
+    Raises:
+        ValueError: Unsupported construct (&&, negation, dnsResolve, ...)
+    """
+    if '&&' in text or '!' in text:
+        raise ValueError(f"unsupported PAC condition: {text.strip()}")
+    conditions = []
+    for term in text.split('||'):
+        term = term.strip()
+        while term.startswith('(') and term.endswith(')') and _closing(term, 0, '(', ')') == len(term):
+            term = term[1:-1].strip()
+        if _PLAIN.match(term):
+            conditions.append(('plain', None))
+        elif _EQUALS.match(term):
+            conditions.append(('exact', _EQUALS.match(term).group(1)))
+        elif _SHEXP.match(term):
+            conditions.append(classify_pattern(_SHEXP.match(term).group(1)))
+        elif _DOMAIN_IS.match(term):
+            domain = _DOMAIN_IS.match(term).group(1)
+            if '*' in domain or '?' in domain:
+                raise ValueError(f"unsupported PAC condition: {term}")
+            conditions.append(('subdomain', domain[1:]) if domain.startswith('.') else ('glob', '*' + domain))
+        elif _IN_NET.match(term):
+            address, mask = _IN_NET.match(term).groups()
+            conditions.append(('net', ipaddress.IPv4Network(f"{address}/{mask}", strict=False)))
+        else:
+            raise ValueError(f"unsupported PAC condition: {term}")
+    return conditions
+
+
+def classify_pattern(pattern: str) -> Tuple[str, str]:
+    """Map a shExpMatch pattern to the cheapest exact index: exact, subdomain, prefix or glob."""
+    if '*' not in pattern and '?' not in pattern:
+        return 'exact', pattern
+    middle = pattern[2:] if pattern.startswith('*.') else None
+    if middle and '*' not in middle and '?' not in middle:
+        return 'subdomain', middle
+    middle = pattern[:-2] if pattern.endswith('.*') else None
+    if middle and '*' not in middle and '?' not in middle:
+        return 'prefix', middle
+    return 'glob', pattern
+
+
+def compile_pac(source: str, cache_size: int = CACHE_SIZE) -> PacRuleSet:
+    """
+    Compile PAC source into a PacRuleSet.
+
+    Args:
+        source: PAC file content
+        cache_size: LRU entries for resolve()
+
+    Returns:
+        Compiled rule set
+
+    Raises:
+        ValueError: The PAC uses constructs that cannot be evaluated without JavaScript
+    """
+    body = strip_comments(_function_body(source))
+    rules = PacRuleSet(cache_size)
+    variables: Dict[str, Dict[str, object]] = {}
+    pos = 0
+    while True:
+        while pos < len(body) and body[pos] in ' \t\r\n;':
+            pos += 1
+        if pos >= len(body):
+            raise ValueError("PAC has no final return")
+        match = _LOWER.match(body, pos)
+        if match:
+            if rules.results:
+                raise ValueError("host.toLowerCase() after the first rule is not supported")
+            rules.lowercase = True
+            pos = match.end()
+            continue
+        match = _VAR.match(body, pos)
+        if match:
+            value, end = json.JSONDecoder().raw_decode(body, match.end())
+            if not isinstance(value, dict):
+                raise ValueError(f"unsupported PAC variable {match.group(1)}")
+            variables[match.group(1)] = value
+            pos = end
+            continue
+        match = _FOR.match(body, pos)
+        if match:
+            end = _closing(body, _closing(body, match.end() - 1, '(', ')'), '{', '}')
+            checks = [(variables[name], result)
+                      for name, result in _LEARNED_CHECK.findall(body[pos:end]) if name in variables]
+            if not checks:
+                raise ValueError("unsupported loop in PAC")
+            rules.add_learned(checks)
+            pos = end
+            continue
+        match = _IF.match(body, pos)
+        if match:
+            cond_end = _closing(body, match.end() - 1, '(', ')')
+            action = _RETURN.match(body, cond_end + len(body[cond_end:]) - len(body[cond_end:].lstrip()))
+            if action is None:
+                raise ValueError(f"unsupported PAC statement after if: {body[cond_end:cond_end + 40]!r}")
+            rules.add_block(parse_condition(body[match.end():cond_end - 1]), action.group(1))
+            pos = action.end()
+            continue
+        match = re.compile(r'return\s+"([^"]*)"').match(body, pos)
+        if match:
+            rules.default = match.group(1)
+            return rules
+        raise ValueError(f"unsupported PAC statement: {body[pos:pos + 40]!r}")
+
+
+def compile_pac_file(path: str, cache_size: int = CACHE_SIZE) -> PacRuleSet:
+    with open(path, 'r', encoding='utf-8') as f:
+        return compile_pac(f.read(), cache_size)
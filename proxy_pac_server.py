@@ -0,0 +1,315 @@
+"""
+PAC HTTP Server
+Serves only the generated PAC file: proxy.pac to local clients and, in gateway mode, the LAN
+variant (gateway address instead of 127.0.0.1) to clients from the allowed networks.
+Unlike `python -m http.server` it never exposes the rest of the work directory (key_pass).
+
+Clients without a JavaScript engine ask /resolve instead; answers come from the same PAC,
+compiled by proxy_pac_rules.py:
+
+    GET  /resolve?host=www.example.com         -> {"host": ..., "proxy": "SOCKS5 127.0.0.1:1080"}
+    GET  /resolve?url=https://example.com/a    -> same, host taken from the URL
+    POST /resolve  text/plain, one host per line  -> one result per line
+    POST /resolve  {"hosts": [...]}               -> {"results": [...]}
+"""
+import argparse
+import http.client
+import ipaddress
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, quote, urlsplit
+
+from proxy_pac_rules import PacRuleSet, compile_pac_file
+
+logger = logging.getLogger(__name__)
+
+PAC_CONTENT_TYPE = "application/x-ns-proxy-autoconfig"
+PAC_PATHS = ('/proxy.pac', '/wpad.dat')
+RESOLVE_PATH = '/resolve'
+MAX_BATCH_BYTES = 64 * 1024 * 1024
+
+
+# ============ SETTINGS ============
+@dataclass
+class PacServerSettings:
+    """PAC server settings."""
+    listen_host: str = '127.0.0.1'
+    port: int = 8080
+    pac_file: str = "proxy.pac"
+    lan_pac_file: Optional[str] = None
+    allow: List[str] = field(default_factory=list)  # LAN client CIDRs (loopback is always served)
+
+
+# ==================== SERVER ====================
+class PacServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, settings: PacServerSettings):
+        self.settings = settings
+        self.allow = [ipaddress.ip_network(net, strict=False) for net in settings.allow]
+        if ':' in settings.listen_host:
+            self.address_family = socket.AF_INET6
+        super().__init__((settings.listen_host, settings.port), PacRequestHandler)
+        self._rules: Dict[str, Tuple[float, PacRuleSet]] = {}
+        self._rules_lock = threading.Lock()
+
+    def pac_for(self, ip: str) -> Optional[str]:
+        """PAC file for a client address, or None if the client is not allowed."""
+        try:
+            addr = ipaddress.ip_address(ip.split('%')[0])
+        except ValueError:
+            return None
+        if addr.version == 6 and addr.ipv4_mapped:
+            addr = addr.ipv4_mapped
+        if addr.is_loopback:
+            return self.settings.pac_file
+        if self.settings.lan_pac_file and any(addr in net for net in self.allow):
+            return self.settings.lan_pac_file
+        return None
+
+    def rules_for(self, pac_file: str) -> PacRuleSet:
+        """
+        Compiled rules of a PAC file, recompiled when the file changes (launcher or daemon reload).
+
+        Raises:
+            OSError: PAC file not readable
+            ValueError: PAC cannot be compiled
+        """
+        mtime = os.stat(pac_file).st_mtime
+        with self._rules_lock:
+            cached = self._rules.get(pac_file)
+            if cached is None or cached[0] != mtime:
+                rules = compile_pac_file(pac_file)
+                logger.info(f"Compiled {pac_file}: {len(rules.results)} rule blocks")
+                cached = self._rules[pac_file] = (mtime, rules)
+            return cached[1]
+
+
+def host_of(value: str) -> str:
+    """Host name of a URL, or the value itself if it is not a URL."""
+    return (urlsplit(value).hostname or '') if '://' in value else value
+
+
+class PacRequestHandler(BaseHTTPRequestHandler):
+    server: PacServer
+    protocol_version = 'HTTP/1.1'  # Keep-alive for batch clients
+
+    def _send(self, body: bytes, content_type: str, status: int = 200) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _rules(self) -> Optional[PacRuleSet]:
+        """Rules of the PAC this client would get (errors are answered here)."""
+        pac_file = self.server.pac_for(self.client_address[0])
+        if pac_file is None:
+            self.send_error(403)
+            return None
+        try:
+            return self.server.rules_for(pac_file)
+        except (OSError, ValueError) as e:
+            logger.error(f"Cannot compile {pac_file}: {e}")
+            self.send_error(503, "PAC cannot be compiled for lookups")
+            return None
+
+    def do_GET(self) -> None:
+        path, _, query = self.path.partition('?')
+        if path == RESOLVE_PATH:
+            self.resolve_one(parse_qs(query))
+            return
+        if path not in PAC_PATHS:
+            self.send_error(404)
+            return
+        pac_file = self.server.pac_for(self.client_address[0])
+        if pac_file is None:
+            self.send_error(403)
+            return
+        try:
+            with open(pac_file, 'rb') as f:
+                body = f.read()
+        except OSError as e:
+            logger.error(f"Cannot read {pac_file}: {e}")
+            self.send_error(503)
+            return
+        self._send(body, PAC_CONTENT_TYPE)
+
+    def resolve_one(self, params: Dict[str, List[str]]) -> None:
+        host = params.get('host', [''])[0] or host_of(params.get('url', [''])[0])
+        if not host:
+            self.send_error(400, "host or url parameter required")
+            return
+        rules = self._rules()
+        if rules is not None:
+            self._send(json.dumps({'host': host, 'proxy': rules.resolve(host)}).encode(), 'application/json')
+
+    def do_POST(self) -> None:
+        if self.path.partition('?')[0] != RESOLVE_PATH:
+            self.send_error(404)
+            return
+        if self.server.pac_for(self.client_address[0]) is None:
+            self.send_error(403)  # Before reading: others must not tie up threads with bodies
+            return
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            self.send_error(411)
+            return
+        if length < 0:
+            self.send_error(400)
+            return
+        if length > MAX_BATCH_BYTES:
+            self.send_error(413)
+            return
+        body = self.rfile.read(length)
+        rules = self._rules()
+        if rules is None:
+            return
+        if self.headers.get_content_type() == 'application/json':
+            try:
+                hosts = json.loads(body)['hosts']
+            except (ValueError, KeyError, TypeError):
+                hosts = None
+            if not isinstance(hosts, list) or not all(isinstance(h, str) for h in hosts):
+                self.send_error(400, 'expected {"hosts": [...]}')
+                return
+            results = rules.resolve_many([host_of(h) for h in hosts])
+            self._send(json.dumps({'results': results}).encode(), 'application/json')
+        else:
+            hosts = body.decode('utf-8', 'replace').splitlines()
+            self._send('\n'.join(rules.resolve_many(hosts)).encode() + b'\n', 'text/plain; charset=utf-8')
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(f"{self.client_address[0]} - {format % args}")
+
+
+# ==================== CLIENT ====================
+class PacClient:
+    """
+    Client for /resolve, for scripts that pick a proxy per URL without a JavaScript engine.
+
+        client = PacClient("http://127.0.0.1:8080")
+        client.resolve("https://example.com/page")     # "SOCKS5 127.0.0.1:1080" or "DIRECT"
+        client.resolve_many(hosts)                      # batched POSTs, results in order
+        requests.get(url, proxies=proxies_for(client.resolve(url)))
+    """
+
+    def __init__(self, base_url: str = "http://127.0.0.1:8080", timeout: float = 30.0, batch: int = 50000):
+        url = urlsplit(base_url)
+        self.host, self.port = url.hostname or '127.0.0.1', url.port or 80
+        self.timeout = timeout
+        self.batch = batch
+        self._conn: Optional[http.client.HTTPConnection] = None
+
+    def _request(self, method: str, path: str, body: Optional[bytes] = None,
+                 headers: Optional[Dict[str, str]] = None) -> bytes:
+        for attempt in (0, 1):  # Reconnect once if the kept-alive connection was closed
+            if self._conn is None:
+                self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self._conn.request(method, path, body, headers or {})
+                response = self._conn.getresponse()
+                data = response.read()
+            except (ConnectionError, http.client.HTTPException):
+                self.close()
+                if attempt:
+                    raise
+                continue
+            if response.status != 200:
+                raise RuntimeError(f"PAC server answered {response.status} {response.reason}")
+            return data
+
+    def resolve(self, host_or_url: str) -> str:
+        """PAC result for one host name or URL."""
+        key = 'url' if '://' in host_or_url else 'host'
+        data = self._request('GET', f"{RESOLVE_PATH}?{key}={quote(host_or_url, safe='')}")
+        return json.loads(data)['proxy']
+
+    def resolve_many(self, hosts: Iterable[str]) -> List[str]:
+        """PAC results for many host names (or URLs), in order."""
+        hosts = [host_of(h) for h in hosts]
+        results: List[str] = []
+        for start in range(0, len(hosts), self.batch):
+            body = ('\n'.join(hosts[start:start + self.batch]) + '\n').encode('utf-8')
+            data = self._request('POST', RESOLVE_PATH, body, {'Content-Type': 'text/plain; charset=utf-8'})
+            results.extend(data.decode('utf-8').splitlines())
+        return results
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def proxies_for(result: str) -> Dict[str, str]:
+    """
+    First usable entry of a PAC result as a requests/urllib proxies dict.
+
+    Args:
+        result: PAC result, e.g. "SOCKS5 127.0.0.1:1080; PROXY 127.0.0.1:8118"
+
+    Returns:
+        {'http': ..., 'https': ...}, or {} for DIRECT
+    """
+    for entry in result.split(';'):
+        kind, _, address = entry.strip().partition(' ')
+        kind = kind.upper()
+        if kind == 'DIRECT':
+            return {}
+        scheme = {'SOCKS5': 'socks5h', 'SOCKS': 'socks5h', 'PROXY': 'http', 'HTTPS': 'https'}.get(kind)
+        if scheme and address:
+            return {'http': f"{scheme}://{address}", 'https': f"{scheme}://{address}"}
+    return {}
+
+
+# ==================== MAIN ====================
+def main() -> None:
+    """PAC server entry point."""
+    parser = argparse.ArgumentParser(description="Serve the proxy PAC file to local and LAN clients")
+    parser.add_argument('--listen', default='127.0.0.1', help="Listen address")
+    parser.add_argument('--port', type=int, default=8080, help="Listen port")
+    parser.add_argument('--pac', default="proxy.pac", help="PAC for local clients")
+    parser.add_argument('--lan-pac', help="PAC with the gateway address for LAN clients")
+    parser.add_argument('--allow', action='append', default=[], help="LAN client network, CIDR (repeatable)")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    settings = PacServerSettings(
+        listen_host=args.listen,
+        port=args.port,
+        pac_file=os.path.abspath(args.pac),
+        lan_pac_file=os.path.abspath(args.lan_pac) if args.lan_pac else None,
+        allow=args.allow,
+    )
+    try:
+        server = PacServer(settings)
+    except ValueError as e:
+        parser.error(f"invalid --allow network: {e}")
+    except OSError as e:
+        logger.error(f"PAC server failed to start: {e}")
+        sys.exit(1)
+    logger.info(f"Serving {settings.pac_file} on {settings.listen_host}:{settings.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+"""
+Platform Backends
+Host menu, system proxy and process control behind small pluggable classes, so the
+interactive Windows launcher and the headless daemon (proxy_daemon.py) share one code path.
+"""
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== PROCESS CONTROL ====================
+class ProcessControl:
+    """Starting and stopping helper processes (POSIX)."""
+    name = "posix"
+
+    def popen_kwargs(self, detached: bool = False) -> Dict:
+        """Extra subprocess.Popen arguments; detached helpers survive the launcher's terminal."""
+        return {'start_new_session': True} if detached else {}
+
+    def background_python(self) -> str:
+        """Interpreter for windowless background helpers."""
+        return sys.executable
+
+    def kill(self, pid: int, force: bool = False) -> bool:
+        """
+        Stop a process (SIGTERM lets relays drain; force sends SIGKILL).
+
+        Returns:
+            True if the signal was delivered
+        """
+        try:
+            os.kill(pid, signal.SIGKILL if force else signal.SIGTERM)
+            return True
+        except (ProcessLookupError, PermissionError):
+            return False
+
+    def alive(self, pid: int) -> bool:
+        """True while a process with this PID exists."""
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass  # Exists, owned by another user
+        return True
+
+    def pids_on_port(self, port: int) -> List[int]:
+        """PIDs listening on a local TCP port (empty if lsof is unavailable)."""
+        if not shutil.which('lsof'):
+            return []
+        result = subprocess.run(['lsof', '-t', f'-iTCP:{port}', '-sTCP:LISTEN'],
+                                capture_output=True, text=True, errors='ignore')
+        return [int(p) for p in result.stdout.split() if p.isdigit()]
+
+    def cleanup_command(self, work_dir: str) -> List[str]:
+        """Command that stops helpers and restores system settings."""
+        return [sys.executable, os.path.join(work_dir, "proxy_stop.py")]
+
+
+class WindowsProcessControl(ProcessControl):
+    """Windows: windowless detached helpers, taskkill and netstat."""
+    name = "windows"
+    DETACHED = 0x00000008
+    NO_WINDOW = 0x08000000
+
+    def popen_kwargs(self, detached: bool = False) -> Dict:
+        return {'creationflags': (self.DETACHED if detached else 0) | self.NO_WINDOW}
+
+    def background_python(self) -> str:
+        pythonw = sys.executable.replace("python.exe", "pythonw.exe")
+        if not shutil.which(pythonw) and not os.path.exists(pythonw):
+            pythonw = sys.executable
+        return pythonw
+
+    def kill(self, pid: int, force: bool = True) -> bool:
+        try:
+            subprocess.run(['taskkill', '/PID', str(pid), '/F'],
+                           capture_output=True, creationflags=self.NO_WINDOW)
+            return True
+        except Exception:
+            return False
+
+    def alive(self, pid: int) -> bool:
+        result = subprocess.run(['tasklist', '/FI', f'PID eq {pid}', '/FO', 'CSV', '/NH'], capture_output=True,
+                                text=True, errors='ignore', creationflags=self.NO_WINDOW)
+        return f'"{pid}"' in result.stdout
+
+    def pids_on_port(self, port: int) -> List[int]:
+        result = subprocess.run(['netstat', '-ano', '-p', 'TCP'], capture_output=True, text=True,
+                                shell=True, errors='ignore')
+        pids = []
+        for line in result.stdout.splitlines():
+            parts = line.strip().split()
+            # Proto, Local Address, Foreign Address, State, PID
+            if len(parts) >= 5 and parts[1].endswith(f':{port}') and parts[3] == 'LISTENING':
+                if parts[-1].isdigit():
+                    pids.append(int(parts[-1]))
+        return pids
+
+    def cleanup_command(self, work_dir: str) -> List[str]:
+        return [os.path.join(work_dir, "stop_proxy.bat")]
+
+
+# ==================== SYSTEM PROXY ====================
+class SystemProxy:
+    """No system proxy changes (headless mode): clients are pointed at the proxy explicitly."""
+    name = "none"
+
+    def enable_pac(self, pac_url: str) -> bool:
+        logger.info(f"System proxy left unchanged (PAC available at {pac_url})")
+        return True
+
+    def disable(self) -> bool:
+        return True
+
+
+class WindowsSystemProxy(SystemProxy):
+    """WinINet settings of the current user (PowerShell to enable, registry to disable)."""
+    name = "windows"
+
+    def enable_pac(self, pac_url: str) -> bool:
+        try:
+            ps_script = f'''
+$regPath = "HKCU:\\Software\\Microsoft\\Windows\\CurrentVersion\\Internet Settings"
+Set-ItemProperty -Path $regPath -Name "AutoConfigURL" -Value "{pac_url}"
+Set-ItemProperty -Path $regPath -Name "ProxyEnable" -Value 0
+Get-Item -Path $regPath | Select-Object AutoConfigURL
+'''
+            result = subprocess.run(
+                ['powershell', '-NoProfile', '-Command', ps_script],
+                capture_output=True,
+                text=True,
+                timeout=10
+            )
+            if result.returncode == 0:
+                logger.info(f"System proxy configured with PAC: {pac_url}")
+                return True
+            logger.error(f"PowerShell error: {result.stderr}")
+            return False
+        except subprocess.TimeoutExpired:
+            logger.error("PowerShell command timeout")
+            return False
+        except Exception as e:
+            logger.error(f"Failed to enable PAC proxy: {e}")
+            return False
+
+    def disable(self) -> bool:
+        import winreg
+        reg_path = r"Software\Microsoft\Windows\CurrentVersion\Internet Settings"
+        try:
+            with winreg.OpenKey(winreg.HKEY_CURRENT_USER, reg_path, 0, winreg.KEY_SET_VALUE) as key:
+                winreg.SetValueEx(key, "ProxyEnable", 0, winreg.REG_DWORD, 0)
+                winreg.SetValueEx(key, "AutoConfigURL", 0, winreg.REG_SZ, "")
+            return True
+        except OSError as e:
+            logger.error(f"Failed to disable system proxy: {e}")
+            return False
+
+
+class GnomeSystemProxy(SystemProxy):
+    """GNOME / desktop Linux proxy settings via gsettings."""
+    name = "gnome"
+
+    def _gsettings(self, key: str, value: str) -> bool:
+        try:
+            result = subprocess.run(['gsettings', 'set', 'org.gnome.system.proxy', key, value],
+                                    capture_output=True, text=True, timeout=10)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logger.error(f"gsettings failed: {e}")
+            return False
+        if result.returncode != 0:
+            logger.error(f"gsettings error: {result.stderr.strip()}")
+        return result.returncode == 0
+
+    def enable_pac(self, pac_url: str) -> bool:
+        return self._gsettings('autoconfig-url', pac_url) and self._gsettings('mode', 'auto')
+
+    def disable(self) -> bool:
+        return self._gsettings('mode', 'none')
+
+
+# ==================== HOST MENU ====================
+def default_host_index(hosts: List[Dict[str, str]], auto_select_tag: str) -> Optional[int]:
+    """Index of the first host whose name contains auto_select_tag."""
+    return next((i for i, h in enumerate(hosts) if auto_select_tag in h.get('name', '')), None)
+
+
+def host_line(host: Dict[str, str]) -> str:
+    keyfile = host.get('IdentityFile', 'N/A')
+    status_icon = "✓" if os.path.exists(keyfile) else "✗"
+    return (f"{host['name']} -> {host.get('User', 'root')}@{host.get('HostName', 'N/A')}:"
+            f"{host.get('Port', '22')} [{status_icon} {os.path.basename(keyfile)}]")
+
+
+class HostMenu:
+    """Non-interactive selection: the auto-select host, else the first one."""
+    name = "auto"
+
+    def select(self, hosts: List[Dict[str, str]], auto_select_tag: str = "_PRIME",
+               timeout: float = 10) -> Optional[Dict[str, str]]:
+        if not hosts:
+            print("No hosts found in SSH config!")
+            return None
+        index = default_host_index(hosts, auto_select_tag)
+        selected = hosts[index if index is not None else 0]
+        print(f"No interactive console. Auto-selecting: {selected['name']}")
+        return selected
+
+
+class WindowsConsoleMenu(HostMenu):
+    """Arrow-key console menu (msvcrt) with auto-select countdown."""
+    name = "console"
+
+    def select(self, hosts, auto_select_tag="_PRIME", timeout=10):
+        try:
+            import msvcrt  # Windows console only
+        except ImportError:
+            return super().select(hosts, auto_select_tag, timeout)
+        if not hosts:
+            print("No hosts found in SSH config!")
+            return None
+
+        prime_index = default_host_index(hosts, auto_select_tag)
+        selected = prime_index if prime_index is not None else 0
+        start_time = time.time()
+
+        def clear_screen():
+            os.system('cls' if os.name == 'nt' else 'clear')
+
+        def print_menu():
+            print("Select SSH host (↑↓ Arrow keys, Enter to select, Q to quit):")
+            print("=" * 70)
+            for i, host in enumerate(hosts):
+                marker = "►" if i == selected else " "
+                print(f"{marker} {host_line(host)}")
+            print("=" * 70)
+            print()
+
+        def print_timer_line(remaining):
+            sys.stdout.write(f"\033[s")
+            sys.stdout.write(f"\033[{len(hosts)+4}H")
+            sys.stdout.write("\r")
+            sys.stdout.write(f"↑↓: Navigate | Enter: Select | Q: Quit | Auto-select in {remaining}s\033[K")
+            sys.stdout.write(f"\033[u")
+            sys.stdout.flush()
+
+        clear_screen()
+        print_menu()
+        print_timer_line(int(timeout))
+
+        while True:
+            if msvcrt.kbhit():
+                key = msvcrt.getch()
+                moved = False
+
+                if key == b'\xe0':  # arrow keys
+                    arrow_key = msvcrt.getch()
+                    if arrow_key == b'H':
+                        selected = max(0, selected - 1)
+                        moved = True
+                    elif arrow_key == b'P':
+                        selected = min(len(hosts) - 1, selected + 1)
+                        moved = True
+                elif key == b'\r':
+                    sys.stdout.write(f"\033[2B")
+                    return hosts[selected]
+                elif key.lower() in (b'q', b'\x1b'):
+                    sys.stdout.write(f"\033[2B")
+                    return None
+
+                if moved:
+                    clear_screen()
+                    print_menu()
+                    print_timer_line(int(timeout - (time.time() - start_time)))
+                    start_time = time.time()  # Сбрасываем таймер
+
+            remaining = max(0, int(timeout - (time.time() - start_time)))
+            print_timer_line(remaining)
+
+            if prime_index is not None and remaining == 0:
+                print(f"\nNo input detected. Auto-selecting: {hosts[prime_index]['name']}")
+                return hosts[prime_index]
+
+            time.sleep(0.0001)
+
+
+class TerminalMenu(HostMenu):
+    """Numbered prompt for POSIX terminals; the auto-select host is taken after timeout."""
+    name = "terminal"
+
+    def select(self, hosts, auto_select_tag="_PRIME", timeout=10):
+        import select
+        if not hosts:
+            print("No hosts found in SSH config!")
+            return None
+
+        prime_index = default_host_index(hosts, auto_select_tag)
+        print("Select SSH host (number, Enter for default, Q to quit):")
+        print("=" * 70)
+        for i, host in enumerate(hosts, 1):
+            marker = "►" if i - 1 == (prime_index or 0) else " "
+            print(f"{marker} {i}. {host_line(host)}")
+        print("=" * 70)
+        wait = timeout if prime_index is not None else None
+        if wait:
+            print(f"Auto-select in {int(wait)}s")
+
+        while True:
+            sys.stdout.write("> ")
+            sys.stdout.flush()
+            ready, _, _ = select.select([sys.stdin], [], [], wait)
+            if not ready:
+                print(f"\nNo input detected. Auto-selecting: {hosts[prime_index]['name']}")
+                return hosts[prime_index]
+            answer = sys.stdin.readline().strip()
+            if answer.lower() == 'q':
+                return None
+            if not answer:
+                return hosts[prime_index or 0]
+            if answer.isdigit() and 1 <= int(answer) <= len(hosts):
+                return hosts[int(answer) - 1]
+            wait = None  # The user is typing; stop the countdown
+
+
+# ==================== BACKEND SELECTION ====================
+@dataclass
+class PlatformBackends:
+    """Backends used by the launcher, proxy_stop.py and the daemon."""
+    menu: HostMenu
+    system_proxy: SystemProxy
+    process: ProcessControl
+
+
+def get_backends(headless: bool = False) -> PlatformBackends:
+    """
+    Pick backends for the current platform.
+
+    Args:
+        headless: No TTY menu and no system proxy changes (daemon mode)
+
+    Returns:
+        PlatformBackends instance
+    """
+    if os.name == 'nt':
+        process = WindowsProcessControl()
+    else:
+        process = ProcessControl()
+    if headless:
+        return PlatformBackends(HostMenu(), SystemProxy(), process)
+
+    if os.name == 'nt':
+        return PlatformBackends(WindowsConsoleMenu(), WindowsSystemProxy(), process)
+    menu = TerminalMenu() if sys.stdin is not None and sys.stdin.isatty() else HostMenu()
+    desktop = os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY')
+    system_proxy = GnomeSystemProxy() if desktop and shutil.which('gsettings') else SystemProxy()
+    return PlatformBackends(menu, system_proxy, process)
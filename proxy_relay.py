@@ -0,0 +1,930 @@
+"""
+Local SOCKS5 Relay in front of the SSH Tunnels
+Bounded memory per connection (transport flow control), optional global in-flight cap,
+deficit round robin across clients for a configured link rate and per-rule bandwidth caps.
+New connections go to the tunnel with the most spare probed throughput.
+"""
+import argparse
+import asyncio
+import ipaddress
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field, asdict
+from typing import Deque, Dict, Hashable, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from proxy_access_log import DEFAULT_RECORDS, AccessLog
+from proxy_socks import (SOCKS_VERSION, CMD_CONNECT, SocksError, encode_address,
+                         open_socks_connection, read_address)
+
+logger = logging.getLogger(__name__)
+
+MBPS = 125000  # bytes per second in one Mbit/s
+
+
+# ============ SETTINGS ============
+@dataclass
+class RelaySettings:
+    """Relay settings."""
+    listen_host: str = '127.0.0.1'
+    listen_port: int = 1080
+    upstreams: List[Tuple[str, int]] = field(default_factory=lambda: [('127.0.0.1', 1081)])
+    conn_buffer: int = 64 * 1024
+    chunk: int = 16 * 1024
+    memory_cap: int = 0
+    link_down_mbps: float = 0.0
+    link_up_mbps: float = 0.0
+    fair_key: str = 'ip'
+    quantum: int = 16 * 1024
+    connect_timeout: float = 10.0
+    handshake_timeout: float = 10.0
+    rules_file: Optional[str] = None
+    reuse_port: bool = False
+    stats_interval: float = 0.0
+    drain_timeout: float = 0.0
+    allow: List[str] = field(default_factory=list)  # Client CIDRs (empty = any)
+    max_client_conns: int = 0
+    max_active: int = 0
+    queue_timeout: float = 10.0
+    access_log: Optional[str] = None  # Binary ring file (proxy_access_log.py)
+    access_log_records: int = DEFAULT_RECORDS
+    probe_url: Optional[str] = None  # http:// payload pulled through each tunnel (None = no probing)
+    probe_interval: float = 300.0  # Seconds between probes of the same tunnel
+    probe_bytes: int = 1024 * 1024
+    probe_saturation: float = 0.7  # Skip probes while user traffic is above this share of capacity
+
+
+# ==================== RATE LIMITING ====================
+class TokenBucket:
+    """Byte token bucket; a request may overdraw once when the bucket holds at least a burst."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate * 0.25, 64 * 1024)
+        self.clock = clock
+        self.tokens = self.burst
+        self._stamp = clock()
+
+    def take(self, n: int) -> float:
+        """
+        Take n tokens if available.
+
+        Args:
+            n: Bytes to send
+
+        Returns:
+            0 if taken, otherwise seconds until enough tokens accumulate
+        """
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+        need = min(n, self.burst)
+        if self.tokens >= need:
+            self.tokens -= n
+            return 0.0
+        return (need - self.tokens) / self.rate
+
+    async def consume(self, n: int) -> None:
+        while True:
+            wait = self.take(n)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+@dataclass
+class _Group:
+    waiters: Deque[Tuple[int, asyncio.Future]] = field(default_factory=deque)
+    deficit: int = 0
+
+
+class FairScheduler:
+    """
+    Deficit round robin over client groups sharing one link rate.
+
+    A flow that has to wait joins its group's queue; each round gives every
+    backlogged group one quantum of bytes, so a client with many bulk
+    connections gets the same share as a client with one interactive flow.
+    """
+
+    def __init__(self, rate: float, quantum: int = 16 * 1024):
+        self.bucket = TokenBucket(rate)
+        self.quantum = quantum
+        self._groups: 'OrderedDict[Hashable, _Group]' = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+
+    async def acquire(self, key: Hashable, n: int) -> None:
+        """Wait until n bytes of key's flow may be sent."""
+        if not self._groups and not self.bucket.take(n):
+            return
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = _Group()
+        future = asyncio.get_running_loop().create_future()
+        group.waiters.append((n, future))
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        await future
+
+    async def _run(self) -> None:
+        try:
+            while self._groups:
+                key, group = next(iter(self._groups.items()))
+                self._groups.move_to_end(key)
+                group.deficit += self.quantum
+                while group.waiters:
+                    n, future = group.waiters[0]
+                    if future.done():
+                        group.waiters.popleft()
+                        continue
+                    if n > group.deficit:
+                        break
+                    wait = self.bucket.take(n)
+                    if wait:
+                        await asyncio.sleep(wait)
+                        continue
+                    group.waiters.popleft()
+                    group.deficit -= n
+                    future.set_result(None)
+                if not group.waiters and self._groups.get(key) is group:
+                    del self._groups[key]
+        finally:
+            self._task = None
+
+
+class MemoryBudget:
+    """Global cap on bytes read from one side and not yet drained to the other."""
+
+    def __init__(self, cap: int):
+        self.cap = cap
+        self.used = 0
+        self.peak = 0
+        self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+
+    async def acquire(self, n: int) -> None:
+        n = min(n, self.cap)
+        if not self._waiters and self.used + n <= self.cap:
+            self._grant(n)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((n, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(n)
+            raise
+
+    def _grant(self, n: int) -> None:
+        self.used += n
+        self.peak = max(self.peak, self.used)
+
+    def release(self, n: int) -> None:
+        self.used -= min(n, self.cap)
+        while self._waiters:
+            n, future = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+            if self.used + n > self.cap:
+                break
+            self._waiters.popleft()
+            self._grant(n)
+            future.set_result(None)
+
+
+# ==================== BANDWIDTH RULES ====================
+def match_domain(host: str, table: Dict[str, object]) -> Optional[object]:
+    """
+    Find entry for host or its closest parent domain.
+
+    Args:
+        host: Destination host name
+        table: Mapping of domain -> value ("example.com" covers its subdomains)
+
+    Returns:
+        Matched value or None
+    """
+    host = host.lower().rstrip('.')
+    while host:
+        if host in table:
+            return table[host]
+        _, _, host = host.partition('.')
+    return None
+
+
+def load_bandwidth_rules(path: Optional[str]) -> Dict[str, TokenBucket]:
+    """
+    Load per-rule bandwidth caps from the PAC rules file.
+
+    The optional "bandwidth_mbps" section maps domains to a cap in Mbit/s
+    shared by all connections matching that rule, e.g.
+    {"bandwidth_mbps": {"updates.example.com": 5}}.
+
+    Args:
+        path: Path to pac_rules.json (None disables rules)
+
+    Returns:
+        Dict of domain -> shared token bucket
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            limits = json.load(f).get('bandwidth_mbps', {})
+        rules = {d.lower().lstrip('*.'): TokenBucket(float(mbps) * MBPS)
+                 for d, mbps in limits.items() if float(mbps) > 0}
+        logger.info(f"Loaded {len(rules)} bandwidth rules from {path}")
+        return rules
+    except Exception as e:
+        logger.warning(f"Failed to load bandwidth rules from {path}: {e}")
+        return {}
+
+
+# ==================== ADMISSION CONTROL ====================
+@dataclass
+class ClientStats:
+    """Counters of one client address."""
+    active: int = 0
+    queued: int = 0
+    total: int = 0
+    rejected: int = 0
+    timeouts: int = 0
+    bytes_up: int = 0
+    bytes_down: int = 0
+
+
+class Admission:
+    """
+    Gateway admission: client allowlist, per-client connection cap and a global
+    concurrency limit. Connections over the limit queue for up to queue_timeout;
+    a freed slot goes to the waiting client with the fewest active connections.
+    Counters are kept for at most max_clients addresses; the least recently
+    seen idle clients are forgotten first.
+    """
+
+    def __init__(self, allow: Iterable[str] = (), max_per_client: int = 0,
+                 max_active: int = 0, queue_timeout: float = 10.0, max_clients: int = 4096):
+        self.allow = [ipaddress.ip_network(net, strict=False) for net in allow]
+        self.max_per_client = max_per_client
+        self.max_active = max_active
+        self.queue_timeout = queue_timeout
+        self.max_clients = max_clients
+        self.active = 0
+        self.clients: Dict[str, ClientStats] = {}  # Least recently seen first
+        self.waiters: List[Tuple[str, asyncio.Future]] = []
+
+    def client(self, ip: str) -> ClientStats:
+        stats = self.clients.pop(ip, None)
+        if stats is None:
+            stats = ClientStats()
+            if len(self.clients) >= self.max_clients:
+                self._evict_idle()
+        self.clients[ip] = stats
+        return stats
+
+    def _evict_idle(self) -> None:
+        """Forget the least recently seen idle clients, down to 3/4 of max_clients (amortizes the scan)."""
+        excess = len(self.clients) - self.max_clients * 3 // 4
+        idle = [ip for ip, c in self.clients.items() if not c.active and not c.queued]
+        for ip in idle[:excess]:
+            del self.clients[ip]
+
+    def allowed(self, ip: str) -> bool:
+        if not self.allow:
+            return True
+        try:
+            addr = ipaddress.ip_address(ip.split('%')[0])
+        except ValueError:
+            return False
+        if addr.version == 6 and addr.ipv4_mapped:
+            addr = addr.ipv4_mapped
+        return any(addr in net for net in self.allow)
+
+    def _admit(self, client: ClientStats) -> None:
+        self.active += 1
+        client.active += 1
+        client.total += 1
+
+    async def acquire(self, ip: str) -> None:
+        """
+        Admit one connection from ip, queueing while the global limit is reached.
+
+        Raises:
+            SocksError: Per-client cap reached (reply 2) or no slot within queue_timeout (reply 1)
+        """
+        client = self.client(ip)
+        if self.max_per_client and client.active + client.queued >= self.max_per_client:
+            client.rejected += 1
+            raise SocksError(f"{ip} already has {self.max_per_client} connections", reply=2)
+        if not self.max_active or (self.active < self.max_active and not self.waiters):
+            self._admit(client)
+            return
+
+        entry = (ip, asyncio.get_running_loop().create_future())
+        self.waiters.append(entry)
+        client.queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(entry[1]), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if entry[1].done():
+                return  # Granted as the timeout fired
+            self.waiters.remove(entry)
+            client.queued -= 1
+            client.timeouts += 1
+            raise SocksError(f"No free slot for {ip} in {self.queue_timeout:.0f}s", reply=1)
+        except asyncio.CancelledError:
+            if entry[1].done():
+                self.release(ip)
+            else:
+                self.waiters.remove(entry)
+                client.queued -= 1
+            raise
+
+    def release(self, ip: str) -> None:
+        client = self.clients[ip]
+        self.active -= 1
+        client.active -= 1
+        while self.waiters and self.active < self.max_active:
+            # min() keeps the first of equals, so ties are served in arrival order
+            entry = min(self.waiters, key=lambda w: self.clients[w[0]].active)
+            self.waiters.remove(entry)
+            waiter = self.clients[entry[0]]
+            waiter.queued -= 1
+            self._admit(waiter)
+            entry[1].set_result(None)
+
+    def snapshot(self) -> Dict[str, object]:
+        return {'active': self.active, 'queued': len(self.waiters),
+                'clients': {ip: asdict(c) for ip, c in self.clients.items()}}
+
+
+# ==================== RELAY ====================
+@dataclass
+class Upstream:
+    """One SSH dynamic-forward (SOCKS5) port."""
+    host: str
+    port: int
+    active: int = 0
+    connections: int = 0
+    failures: int = 0
+    probe_mbps: float = 0.0  # EWMA of probed throughput (0 = not measured yet)
+    probes: int = 0
+
+
+@dataclass
+class Connection:
+    """Relayed client connection."""
+    client: Tuple[str, int]
+    group: Hashable
+    dest_host: str = ''
+    dest_port: int = 0
+    upstream: Optional[Upstream] = None
+    started: float = 0.0
+    setup_ms: float = 0.0
+    bytes_up: int = 0
+    bytes_down: int = 0
+    buckets: List[TokenBucket] = field(default_factory=list)
+
+
+class Relay:
+    """SOCKS5 server relaying CONNECTs to the least loaded upstream tunnel."""
+
+    def __init__(self, settings: RelaySettings):
+        self.settings = settings
+        self.upstreams = [Upstream(h, p) for h, p in settings.upstreams]
+        self.memory = MemoryBudget(settings.memory_cap) if settings.memory_cap > 0 else None
+        self.down = FairScheduler(settings.link_down_mbps * MBPS, settings.quantum) \
+            if settings.link_down_mbps > 0 else None
+        self.up = FairScheduler(settings.link_up_mbps * MBPS, settings.quantum) \
+            if settings.link_up_mbps > 0 else None
+        self.rules = load_bandwidth_rules(settings.rules_file)
+        self.admission = Admission(settings.allow, settings.max_client_conns,
+                                   settings.max_active, settings.queue_timeout)
+        self.stats = {'active': 0, 'total': 0, 'failed': 0, 'bytes_up': 0, 'bytes_down': 0,
+                      'denied': 0, 'rejected': 0}
+        self.access_log = AccessLog(settings.access_log, settings.access_log_records) \
+            if settings.access_log else None
+
+    def client_group(self, peer: Tuple[str, int]) -> Hashable:
+        """Fair-queueing key: client address, or each connection on its own."""
+        return peer[0] if self.settings.fair_key == 'ip' else tuple(peer[:2])
+
+    def choose_upstream(self) -> Upstream:
+        """
+        Least loaded upstream, or once tunnels are probed the one with the most throughput
+        per active connection (unprobed tunnels count as the probed average).
+        """
+        rates = [u.probe_mbps for u in self.upstreams if u.probe_mbps > 0]
+        if not rates:
+            return min(self.upstreams, key=lambda u: (u.active, u.failures))
+        average = sum(rates) / len(rates)
+        return max(self.upstreams, key=lambda u: ((u.probe_mbps or average) / (u.active + 1), -u.failures))
+
+    @staticmethod
+    async def _reply(writer: asyncio.StreamWriter, code: int) -> None:
+        writer.write(bytes([SOCKS_VERSION, code, 0]) + encode_address('0.0.0.0', 0))
+        await writer.drain()
+
+    async def _read_request(self, reader: asyncio.StreamReader,
+                            writer: asyncio.StreamWriter) -> Optional[Tuple[str, int]]:
+        """Serve SOCKS5 greeting and return CONNECT destination, or None if refused."""
+        version, nmethods = await reader.readexactly(2)
+        methods = await reader.readexactly(nmethods)
+        if version != SOCKS_VERSION:
+            return None
+        if 0 not in methods:
+            writer.write(bytes([SOCKS_VERSION, 0xFF]))
+            await writer.drain()
+            return None
+        writer.write(bytes([SOCKS_VERSION, 0]))
+        await writer.drain()
+
+        version, cmd, _ = await reader.readexactly(3)
+        try:
+            host, port = await read_address(reader)
+        except SocksError as e:
+            await self._reply(writer, e.reply)
+            return None
+        if cmd != CMD_CONNECT:
+            await self._reply(writer, 7)
+            return None
+        return host, port
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Accept one SOCKS5 client and relay it through an upstream tunnel."""
+        peer = writer.get_extra_info('peername') or ('?', 0)
+        ip = str(peer[0])
+        if not self.admission.allowed(ip):
+            self.stats['denied'] += 1
+            writer.close()
+            return
+        conn = Connection(client=peer[:2], group=self.client_group(peer), started=time.monotonic())
+        writer.transport.set_write_buffer_limits(high=self.settings.conn_buffer)
+        up_writer = None
+        admitted = False
+        try:
+            request = await asyncio.wait_for(self._read_request(reader, writer), self.settings.handshake_timeout)
+            if request is None:
+                return
+            conn.dest_host, conn.dest_port = request
+            try:
+                await self.admission.acquire(ip)
+            except SocksError as e:
+                self.stats['rejected'] += 1
+                await self._reply(writer, e.reply)
+                return
+            admitted = True
+            try:
+                up_reader, up_writer = await self._connect_upstream(conn)
+            except SocksError as e:
+                await self._reply(writer, e.reply)
+                return
+            await self._reply(writer, 0)
+            conn.setup_ms = (time.monotonic() - conn.started) * 1000
+            await self.relay(conn, reader, writer, up_reader, up_writer)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        except asyncio.CancelledError:
+            pass  # Connections left after a drain are cancelled at loop shutdown
+        finally:
+            writer.close()
+            if up_writer is not None:
+                up_writer.close()
+            if conn.upstream is not None:
+                conn.upstream.active -= 1
+                self.stats['active'] -= 1
+            if admitted:
+                self.admission.release(ip)
+                client = self.admission.clients[ip]
+                client.bytes_up += conn.bytes_up
+                client.bytes_down += conn.bytes_down
+            self.connection_closed(conn)
+
+    async def _connect_upstream(self, conn: Connection) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """Open CONNECT through an upstream (raises SocksError carrying the reply for the client)."""
+        upstream = self.choose_upstream()
+        conn.upstream = upstream
+        upstream.active += 1
+        upstream.connections += 1
+        self.stats['active'] += 1
+        self.stats['total'] += 1
+        try:
+            up_reader, up_writer = await self._open_upstream(conn, upstream)
+        except SocksError:
+            self.stats['failed'] += 1
+            raise
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            upstream.failures += 1
+            self.stats['failed'] += 1
+            logger.info(f"Upstream {upstream.host}:{upstream.port} failed for "
+                        f"{conn.dest_host}:{conn.dest_port}: {e!r}")
+            raise SocksError(f"Upstream unavailable: {e!r}") from e
+        up_writer.transport.set_write_buffer_limits(high=self.settings.conn_buffer)
+        rule = match_domain(conn.dest_host, self.rules) if self.rules else None
+        if rule is not None:
+            conn.buckets.append(rule)
+        return up_reader, up_writer
+
+    async def _open_upstream(self, conn: Connection,
+                             upstream: Upstream) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """Open the upstream stream for conn (overridden by in-process transports)."""
+        return await open_socks_connection(
+            conn.dest_host, conn.dest_port, upstream.host, upstream.port,
+            timeout=self.settings.connect_timeout, limit=self.settings.conn_buffer // 2)
+
+    async def relay(self, conn: Connection, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                    up_reader: asyncio.StreamReader, up_writer: asyncio.StreamWriter) -> None:
+        await asyncio.gather(
+            self._pump(conn, reader, up_writer, self.up, 'bytes_up'),
+            self._pump(conn, up_reader, writer, self.down, 'bytes_down'))
+
+    async def _pump(self, conn: Connection, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                    scheduler: Optional[FairScheduler], counter: str) -> None:
+        """
+        Copy one direction with backpressure.
+
+        drain() blocks while the peer's write buffer is above conn_buffer, and
+        while we are blocked the source StreamReader fills up and pauses its
+        transport, so a slow peer stops the sender instead of growing memory.
+        """
+        chunk = self.settings.chunk
+        try:
+            while True:
+                data = await reader.read(chunk)
+                if not data:
+                    break
+                n = len(data)
+                if self.memory is not None:
+                    await self.memory.acquire(n)
+                try:
+                    for bucket in conn.buckets:
+                        await bucket.consume(n)
+                    if scheduler is not None:
+                        await scheduler.acquire(conn.group, n)
+                    writer.write(data)
+                    await writer.drain()
+                finally:
+                    if self.memory is not None:
+                        self.memory.release(n)
+                setattr(conn, counter, getattr(conn, counter) + n)
+                self.stats[counter] += n
+            if writer.can_write_eof():
+                writer.write_eof()
+        except (ConnectionError, OSError):
+            writer.close()
+
+    def connection_closed(self, conn: Connection) -> None:
+        """Hook called once per finished client connection; records CONNECTs in the access log."""
+        if self.access_log is None or not conn.dest_host:
+            return
+        duration = time.monotonic() - conn.started
+        upstream = conn.upstream
+        self.access_log.write(time.time() - duration, duration * 1000, conn.setup_ms,
+                              conn.bytes_up, conn.bytes_down, conn.dest_host, conn.dest_port, str(conn.client[0]),
+                              next((i for i, u in enumerate(self.upstreams) if u is upstream), None),
+                              0 if upstream is None else upstream.port, conn.setup_ms > 0)
+
+    def close(self) -> None:
+        if self.access_log is not None:
+            self.access_log.close()
+            self.access_log = None
+
+    def snapshot(self) -> Dict[str, object]:
+        """Counters for the stats stream read by proxy_workers.py and the stats file."""
+        return {
+            'pid': os.getpid(),
+            'stats': dict(self.stats),
+            'upstreams': [{'port': u.port, 'active': u.active, 'connections': u.connections,
+                           'failures': u.failures, 'probe_mbps': round(u.probe_mbps, 2)}
+                          for u in self.upstreams],
+            'admission': self.admission.snapshot(),
+        }
+
+
+async def report_stats(relay: Relay, interval: float) -> None:
+    """Print one JSON stats line to stdout every interval seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        sys.stdout.write(json.dumps(relay.snapshot()) + '\n')
+        sys.stdout.flush()
+
+
+async def write_stats_file(relay: Relay, path: str, interval: float) -> None:
+    """Rewrite the stats JSON file every interval seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(relay.snapshot(), f, indent=2)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logger.warning(f"Failed to write relay stats: {e}")
+
+
+# ==================== THROUGHPUT PROBING ====================
+class ThroughputProber:
+    """
+    Periodically pulls a bounded payload through each upstream and keeps an EWMA of Mbps.
+
+    One probe runs at a time, spread evenly over probe_interval. A probe is skipped
+    while user traffic of the last WINDOW seconds is above probe_saturation of the
+    link rate (or, without a configured rate, of the probed total), so probing
+    never competes with a busy link.
+    """
+    ALPHA = 0.3
+    TIMEOUT = 30.0
+    MIN_BYTES = 64 * 1024  # Shorter transfers say more about latency than throughput
+    WINDOW = 1.0
+
+    def __init__(self, relay: Relay):
+        self.relay = relay
+        self.settings = relay.settings
+        self.target = split_probe_url(self.settings.probe_url)
+        self.skipped = 0
+
+    def _user_bytes(self) -> int:
+        return self.relay.stats['bytes_up'] + self.relay.stats['bytes_down']
+
+    async def user_mbps(self) -> float:
+        """Relayed user throughput over the next WINDOW seconds."""
+        start, before = time.monotonic(), self._user_bytes()
+        await asyncio.sleep(self.WINDOW)
+        return (self._user_bytes() - before) / (time.monotonic() - start) / MBPS
+
+    async def saturated(self) -> bool:
+        capacity = self.settings.link_down_mbps or sum(u.probe_mbps for u in self.relay.upstreams)
+        return capacity > 0 and await self.user_mbps() >= self.settings.probe_saturation * capacity
+
+    async def measure(self, upstream: Upstream) -> Optional[float]:
+        """
+        Throughput of one upstream in Mbit/s.
+
+        Counts bytes after the first response chunk (so connect and request time are
+        excluded); a transfer cut by the timeout still yields a (low) rate.
+
+        Returns:
+            Mbit/s, or None if the probe failed or moved too little data
+        """
+        host, port, path = self.target
+        conn = Connection(client=('probe', 0), group='probe', dest_host=host, dest_port=port)
+        deadline = time.monotonic() + self.TIMEOUT
+        writer = None
+        try:
+            reader, writer = await asyncio.wait_for(self.relay._open_upstream(conn, upstream),
+                                                    self.settings.connect_timeout)
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n"
+                         f"User-Agent: just-proxy-probe\r\n\r\n".encode('ascii'))
+            await writer.drain()
+            if not await asyncio.wait_for(reader.read(self.settings.chunk), self.TIMEOUT):
+                return None
+            start, received = time.monotonic(), 0
+            while received < self.settings.probe_bytes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    data = await asyncio.wait_for(reader.read(self.settings.chunk), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if not data:
+                    break
+                received += len(data)
+            elapsed = time.monotonic() - start
+        except (SocksError, OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            logger.info(f"Probe through {upstream.host}:{upstream.port} failed: {e!r}")
+            return None
+        finally:
+            if writer is not None:
+                writer.close()
+        if received < self.MIN_BYTES or elapsed <= 0:
+            return None
+        return received / elapsed / MBPS
+
+    def record(self, upstream: Upstream, mbps: float) -> None:
+        """Fold a measurement into the upstream's EWMA."""
+        upstream.probe_mbps = mbps if not upstream.probes else \
+            self.ALPHA * mbps + (1 - self.ALPHA) * upstream.probe_mbps
+        upstream.probes += 1
+        logger.info(f"Probe {upstream.host}:{upstream.port}: {mbps:.1f} Mbps (EWMA {upstream.probe_mbps:.1f})")
+
+    async def run(self) -> None:
+        while True:
+            for upstream in list(self.relay.upstreams):
+                if await self.saturated():
+                    self.skipped += 1
+                    logger.debug("Link busy, probe skipped")
+                else:
+                    mbps = await self.measure(upstream)
+                    if mbps is not None:
+                        self.record(upstream, mbps)
+                await asyncio.sleep(self.settings.probe_interval / max(1, len(self.relay.upstreams)))
+
+
+# ==================== SERVER ====================
+async def drain_connections(relay: Relay, timeout: float) -> int:
+    """Wait up to timeout seconds for active connections to finish; returns those still open."""
+    deadline = time.monotonic() + timeout
+    while relay.stats['active'] > 0 and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    return relay.stats['active']
+
+
+async def serve_relay(settings: RelaySettings, ready: Optional[asyncio.Event] = None,
+                      relay: Optional[Relay] = None, stopping: Optional[asyncio.Event] = None,
+                      stats_file: Optional[str] = None) -> None:
+    """
+    Run relay listener until cancelled or stopping is set.
+
+    Args:
+        settings: Relay settings
+        ready: Optional event set once the listener is bound
+        relay: Relay instance to serve (created from settings if None)
+        stopping: Optional event; once set the listener closes and active connections
+            get up to settings.drain_timeout seconds to finish
+        stats_file: Optional JSON file (counters, per-client admission) refreshed every 5 seconds
+    """
+    relay = relay if relay is not None else Relay(settings)
+    # SO_REUSEPORT lets several worker processes bind the same port (Linux spreads accepts)
+    extra = {'reuse_port': True} if settings.reuse_port else {}
+    server = await asyncio.start_server(relay.handle_client, settings.listen_host, settings.listen_port,
+                                        limit=settings.conn_buffer // 2, backlog=4096, **extra)
+    logger.info(f"Relay listening on {settings.listen_host}:{settings.listen_port} -> "
+                f"{', '.join(f'{h}:{p}' for h, p in settings.upstreams)}")
+    tasks = []
+    if settings.stats_interval > 0:
+        tasks.append(asyncio.ensure_future(report_stats(relay, settings.stats_interval)))
+    if stats_file:
+        tasks.append(asyncio.ensure_future(write_stats_file(relay, stats_file, 5.0)))
+    if settings.probe_url:
+        tasks.append(asyncio.ensure_future(ThroughputProber(relay).run()))
+    if ready is not None:
+        ready.set()
+    try:
+        if stopping is None:
+            await asyncio.Future()
+        await stopping.wait()
+        server.close()  # Stop accepting; established connections keep relaying
+        if settings.drain_timeout > 0 and relay.stats['active']:
+            logger.info(f"Draining {relay.stats['active']} connection(s) for up to {settings.drain_timeout}s")
+            left = await drain_connections(relay, settings.drain_timeout)
+            if left:
+                logger.warning(f"Drain timeout, closing {left} connection(s)")
+    finally:
+        logger.info(f"Relay stats: {relay.stats}")
+        for task in tasks:
+            task.cancel()
+        server.close()
+        relay.close()
+
+
+def raise_fd_limit() -> int:
+    """Raise soft RLIMIT_NOFILE to the hard limit where supported; returns the soft limit."""
+    try:
+        import resource
+    except ImportError:
+        return 0
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > soft:
+        target = hard if hard != resource.RLIM_INFINITY else max(soft, 65536)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            soft = target
+        except (ValueError, OSError):
+            pass
+    return soft
+
+
+def parse_upstream(value: str) -> Tuple[str, int]:
+    host, _, port = value.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def parse_network(value: str) -> str:
+    ipaddress.ip_network(value, strict=False)  # argparse reports the ValueError
+    return value
+
+
+def split_probe_url(value: str) -> Tuple[str, int, str]:
+    """Split an http:// probe URL into (host, port, path); raises ValueError otherwise."""
+    url = urlsplit(value)
+    if url.scheme != 'http' or not url.hostname:
+        raise ValueError(f"probe URL must be http://host[:port]/path: {value}")
+    path = (url.path or '/') + (f"?{url.query}" if url.query else '')
+    return url.hostname, url.port or 80, path
+
+
+def parse_probe_url(value: str) -> str:
+    split_probe_url(value)  # argparse reports the ValueError
+    return value
+
+
+def add_probe_arguments(parser: argparse.ArgumentParser) -> None:
+    """Register throughput probe options (relay and in-process transport)."""
+    parser.add_argument('--probe-url', type=parse_probe_url, help="http:// payload pulled through each tunnel to weight dispatch")
+    parser.add_argument('--probe-interval', type=float, default=300.0, help="Seconds between probes of a tunnel")
+    parser.add_argument('--probe-kb', type=int, default=1024, help="Bytes pulled per probe, KiB")
+    parser.add_argument('--probe-saturation', type=float, default=0.7,
+                        help="Skip probes while user traffic exceeds this share of the link")
+
+
+def probe_settings(args: argparse.Namespace) -> Dict[str, object]:
+    """RelaySettings fields for the probe options."""
+    return {'probe_url': args.probe_url, 'probe_interval': max(1.0, args.probe_interval),
+            'probe_bytes': args.probe_kb * 1024, 'probe_saturation': args.probe_saturation}
+
+
+def add_relay_arguments(parser: argparse.ArgumentParser) -> None:
+    """Register relay command-line options."""
+    parser.add_argument('--listen', default='127.0.0.1', help="Listen address")
+    parser.add_argument('--port', type=int, default=1080, help="Listen port")
+    parser.add_argument('--upstream', action='append', type=parse_upstream,
+                        help="Upstream SOCKS5 host:port (ssh -D), repeatable")
+    parser.add_argument('--conn-buffer-kb', type=int, default=64, help="Per-connection buffer budget")
+    parser.add_argument('--memory-cap-mb', type=float, default=0, help="Global in-flight cap (0 = off)")
+    parser.add_argument('--link-down-mbps', type=float, default=0, help="Downlink rate for fair queueing")
+    parser.add_argument('--link-up-mbps', type=float, default=0, help="Uplink rate for fair queueing")
+    parser.add_argument('--fair-key', choices=('ip', 'port'), default='ip',
+                        help="Fair-queue per client address or per connection")
+    parser.add_argument('--rules', default=None, help="pac_rules.json with bandwidth_mbps section")
+    parser.add_argument('--reuse-port', action='store_true', help="Bind with SO_REUSEPORT (worker mode)")
+    parser.add_argument('--stats-interval', type=float, default=0, help="Print JSON stats every N seconds")
+    parser.add_argument('--drain-timeout', type=float, default=0,
+                        help="On SIGTERM stop accepting and let connections finish for N seconds")
+    parser.add_argument('--allow', action='append', default=[], type=parse_network,
+                        help="Client network allowed to connect, CIDR (repeatable; default: any)")
+    parser.add_argument('--max-client-conns', type=int, default=0, help="Connections per client address (0 = off)")
+    parser.add_argument('--max-active', type=int, default=0, help="Concurrent relayed connections (0 = off)")
+    parser.add_argument('--queue-timeout', type=float, default=10.0,
+                        help="Seconds a connection waits for a slot under --max-active")
+    parser.add_argument('--access-log', help="Per-connection binary ring log (read with proxy_access_log.py)")
+    parser.add_argument('--access-log-records', type=int, default=DEFAULT_RECORDS,
+                        help="Ring capacity in records (128 bytes each)")
+    add_probe_arguments(parser)
+    parser.add_argument('-v', '--verbose', action='store_true')
+
+
+def settings_from_args(args: argparse.Namespace) -> RelaySettings:
+    return RelaySettings(
+        listen_host=args.listen,
+        listen_port=args.port,
+        upstreams=args.upstream or [('127.0.0.1', 1081)],
+        conn_buffer=args.conn_buffer_kb * 1024,
+        memory_cap=int(args.memory_cap_mb * 1024 * 1024),
+        link_down_mbps=args.link_down_mbps,
+        link_up_mbps=args.link_up_mbps,
+        fair_key=args.fair_key,
+        rules_file=args.rules,
+        reuse_port=args.reuse_port,
+        stats_interval=args.stats_interval,
+        drain_timeout=args.drain_timeout,
+        allow=args.allow,
+        max_client_conns=args.max_client_conns,
+        max_active=args.max_active,
+        queue_timeout=args.queue_timeout,
+        access_log=args.access_log,
+        access_log_records=args.access_log_records,
+        **probe_settings(args),
+    )
+
+
+# ==================== MAIN ====================
+def main() -> None:
+    """Relay entry point."""
+    parser = argparse.ArgumentParser(description="SOCKS5 relay with backpressure and fair scheduling")
+    add_relay_arguments(parser)
+    parser.add_argument('--stats-file', help="JSON file with counters and per-client admission stats")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    raise_fd_limit()
+    settings = settings_from_args(args)
+
+    async def run() -> None:
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGTERM, stopping.set)
+        except (NotImplementedError, AttributeError, ValueError):
+            pass
+        await serve_relay(settings, stopping=stopping, stats_file=args.stats_file)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        logger.error(f"Relay failed to start: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+SOCKS5 Client Helpers
+Minimal asyncio SOCKS5 CONNECT handshake (RFC 1928, no authentication) for the local SSH tunnel
+"""
+import asyncio
+import ipaddress
+import struct
+from typing import Tuple
+
+# ============ PROTOCOL CONSTANTS ============
+SOCKS_VERSION = 5
+CMD_CONNECT = 1
+ATYP_IPV4 = 1
+ATYP_DOMAIN = 3
+ATYP_IPV6 = 4
+
+SOCKS_REPLIES = {
+    1: "general SOCKS server failure",
+    2: "connection not allowed by ruleset",
+    3: "network unreachable",
+    4: "host unreachable",
+    5: "connection refused",
+    6: "TTL expired",
+    7: "command not supported",
+    8: "address type not supported",
+}
+
+
+class SocksError(Exception):
+    """Raised when the SOCKS5 proxy rejects or breaks the handshake."""
+
+    def __init__(self, message: str, reply: int = 1):
+        super().__init__(message)
+        self.reply = reply
+
+
+# ==================== ADDRESS ENCODING ====================
+def encode_address(host: str, port: int) -> bytes:
+    """
+    Encode destination as SOCKS5 ATYP + address + port.
+
+    Args:
+        host: IPv4/IPv6 literal or domain name
+        port: Destination port
+
+    Returns:
+        Encoded address bytes
+    """
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        name = host.encode('idna')
+        if not 0 < len(name) < 256:
+            raise SocksError(f"Invalid destination host: {host!r}")
+        return bytes([ATYP_DOMAIN, len(name)]) + name + struct.pack('!H', port)
+
+    atyp = ATYP_IPV4 if ip.version == 4 else ATYP_IPV6
+    return bytes([atyp]) + ip.packed + struct.pack('!H', port)
+
+
+async def read_address(reader: asyncio.StreamReader) -> Tuple[str, int]:
+    """
+    Read SOCKS5 ATYP + address + port from stream.
+
+    Args:
+        reader: Stream positioned at the ATYP byte
+
+    Returns:
+        Tuple of (host, port)
+    """
+    atyp = (await reader.readexactly(1))[0]
+    if atyp == ATYP_IPV4:
+        host = str(ipaddress.IPv4Address(await reader.readexactly(4)))
+    elif atyp == ATYP_IPV6:
+        host = str(ipaddress.IPv6Address(await reader.readexactly(16)))
+    elif atyp == ATYP_DOMAIN:
+        length = (await reader.readexactly(1))[0]
+        host = (await reader.readexactly(length)).decode('idna')
+    else:
+        raise SocksError(f"Unsupported address type: {atyp}", reply=8)
+    port = struct.unpack('!H', await reader.readexactly(2))[0]
+    return host, port
+
+
+# ==================== CONNECT ====================
+async def socks5_handshake(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                           dest_host: str, dest_port: int) -> Tuple[str, int]:
+    """
+    Perform SOCKS5 greeting and CONNECT on an already open stream.
+
+    Args:
+        reader: Stream reader connected to the proxy
+        writer: Stream writer connected to the proxy
+        dest_host: Destination host (resolved by the proxy if it is a name)
+        dest_port: Destination port
+
+    Returns:
+        Bound address reported by the proxy
+    """
+    # OpenSSH's dynamic forwarder parses one message per read, so the
+    # greeting reply must arrive before CONNECT is sent
+    writer.write(bytes([SOCKS_VERSION, 1, 0]))
+    await writer.drain()
+    version, method = await reader.readexactly(2)
+    if version != SOCKS_VERSION or method != 0:
+        raise SocksError("Proxy requires unsupported authentication method")
+
+    writer.write(bytes([SOCKS_VERSION, CMD_CONNECT, 0]) + encode_address(dest_host, dest_port))
+    await writer.drain()
+
+    version, reply, _ = await reader.readexactly(3)
+    if version != SOCKS_VERSION:
+        raise SocksError(f"Invalid SOCKS version in reply: {version}")
+    bound = await read_address(reader)
+    if reply != 0:
+        raise SocksError(SOCKS_REPLIES.get(reply, f"unknown error {reply}"), reply=reply)
+    return bound
+
+
+async def open_socks_connection(dest_host: str, dest_port: int,
+                                proxy_host: str = '127.0.0.1', proxy_port: int = 1080,
+                                timeout: float = 10.0,
+                                limit: int = 2 ** 16) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """
+    Open TCP stream to destination through SOCKS5 proxy.
+
+    Args:
+        dest_host: Destination host
+        dest_port: Destination port
+        proxy_host: SOCKS5 proxy address
+        proxy_port: SOCKS5 proxy port
+        timeout: Timeout for the whole handshake in seconds
+        limit: StreamReader buffer limit (reading pauses at twice this size)
+
+    Returns:
+        Tuple of (reader, writer) connected to destination
+    """
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(proxy_host, proxy_port, limit=limit), timeout)
+    try:
+        await asyncio.wait_for(socks5_handshake(reader, writer, dest_host, dest_port), timeout)
+    except BaseException:
+        writer.close()
+        raise
+    return reader, writer
+
+
+# ==================== STREAM RELAY ====================
+async def pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, bufsize: int = 65536) -> int:
+    """
+    Copy data from reader to writer until EOF, then half-close writer.
+
+    Args:
+        reader: Source stream
+        writer: Destination stream
+        bufsize: Maximum bytes per read
+
+    Returns:
+        Number of bytes copied
+    """
+    total = 0
+    try:
+        while True:
+            data = await reader.read(bufsize)
+            if not data:
+                break
+            writer.write(data)
+            total += len(data)
+            await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+    except (ConnectionError, OSError):
+        writer.close()
+    return total
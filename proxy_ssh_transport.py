@@ -0,0 +1,577 @@
+"""
+In-Process SSH Transport (paramiko)
+Alternative to spawning ssh -D: SOCKS5 CONNECTs are served as direct-tcpip channels over
+one or more SSH transports per host, with per-channel byte counters and failure reasons.
+Requires paramiko 3.2 or newer (PKey.from_path).
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Deque, Dict, List, Optional, Tuple
+
+from proxy_access_log import DEFAULT_RECORDS
+from proxy_jump import host_jump_chain, host_option, without_options
+from proxy_relay import (Connection, Relay, RelaySettings, ThroughputProber, Upstream, add_probe_arguments,
+                         probe_settings, raise_fd_limit, report_stats, write_stats_file)
+from proxy_socks import SocksError
+
+try:
+    import paramiko
+except ImportError:
+    paramiko = None
+
+logger = logging.getLogger(__name__)
+
+# SSH_MSG_CHANNEL_OPEN_FAILURE reason codes (RFC 4254) -> (reason, SOCKS5 reply)
+CHANNEL_FAILURES = {
+    1: ("administratively prohibited", 2),
+    2: ("connect failed", 5),
+    3: ("unknown channel type", 1),
+    4: ("resource shortage", 1),
+}
+
+
+# ============ SETTINGS ============
+@dataclass
+class SshTransportSettings:
+    """SSH transport pool settings."""
+    hostname: str
+    port: int = 22
+    username: str = 'root'
+    key_path: Optional[str] = None
+    passphrase: Optional[str] = None
+    transports: int = 2
+    connect_timeout: float = 10.0
+    keepalive: int = 60  # Same as ServerAliveInterval=60 of the ssh -D command
+    window_size: int = 2 * 1024 * 1024
+    chunk: int = 32 * 1024
+    open_threads: int = 64
+    recent_channels: int = 100
+    jumps: List['SshTransportSettings'] = field(default_factory=list)  # Bastions, first hop first
+    proxy_command: Optional[str] = None
+
+
+@dataclass
+class ChannelRecord:
+    """Counters of one direct-tcpip channel."""
+    id: int
+    transport: int
+    dest: str
+    opened: float
+    closed: float = 0.0
+    bytes_up: int = 0
+    bytes_down: int = 0
+    error: str = ''
+
+
+def describe_failure(exc: BaseException) -> Tuple[str, Optional[int]]:
+    """
+    Classify a transport or channel failure.
+
+    Args:
+        exc: Exception raised while connecting or opening a channel
+
+    Returns:
+        (reason, SOCKS5 reply) - reply is None when the transport itself failed
+    """
+    if paramiko is not None:
+        if isinstance(exc, paramiko.ChannelException):
+            reason, reply = CHANNEL_FAILURES.get(exc.code, (f"open failed (code {exc.code})", 1))
+            return f"channel: {reason}", reply
+        if isinstance(exc, paramiko.AuthenticationException):
+            return f"auth: {exc}", None
+        if isinstance(exc, paramiko.SSHException):
+            if 'Timeout opening channel' in str(exc):
+                return "channel: open timeout", 4
+            return f"ssh: {exc}", None
+    if isinstance(exc, (socket.timeout, TimeoutError)):
+        return "network: connect timeout", None
+    if isinstance(exc, OSError):
+        return f"network: {exc.strerror or exc}", None
+    if isinstance(exc, EOFError):
+        return "ssh: connection closed by server", None
+    return f"error: {exc!r}", None
+
+
+def load_keys(settings: SshTransportSettings) -> List['paramiko.PKey']:
+    """Private key from key_path (with passphrase) followed by ssh-agent keys."""
+    keys = []
+    if settings.key_path:
+        passphrase = settings.passphrase.encode() if settings.passphrase else None
+        try:
+            keys.append(paramiko.PKey.from_path(settings.key_path, passphrase))
+        except paramiko.PasswordRequiredException:
+            logger.info(f"{settings.key_path} is encrypted and no passphrase given, trying ssh-agent")
+        except (OSError, paramiko.SSHException, ValueError) as e:
+            logger.warning(f"Failed to load {settings.key_path}: {e}")
+    try:
+        keys.extend(paramiko.Agent().get_keys())
+    except (OSError, paramiko.SSHException) as e:
+        logger.debug(f"ssh-agent unavailable: {e}")
+    return keys
+
+
+# ==================== TRANSPORT ====================
+class SshTransport:
+    """One authenticated paramiko transport, reconnected on demand (blocking methods)."""
+
+    def __init__(self, index: int, settings: SshTransportSettings):
+        self.index = index
+        self.settings = settings
+        self.transport: Optional['paramiko.Transport'] = None
+        self.jump_transports: List['paramiko.Transport'] = []
+        self.channels = 0
+        self.opened = 0
+        self.failures = 0
+        self.connects = 0
+        self.last_error = ''
+        self._lock = threading.Lock()
+
+    @property
+    def is_active(self) -> bool:
+        return self.transport is not None and self.transport.is_active()
+
+    def connect(self) -> None:
+        """Connect and authenticate (through the bastions, if any) unless already active."""
+        with self._lock:
+            if self.is_active:
+                return
+            self.close()
+            s = self.settings
+            try:
+                transport = self._start(s, self._open_socket())
+            except BaseException:
+                self.close()
+                raise
+            transport.set_keepalive(s.keepalive)
+            self.transport = transport
+            self.connects += 1
+            via = f" via {', '.join(j.hostname for j in s.jumps)}" if s.jumps else ''
+            logger.info(f"Transport {self.index} connected to {s.username}@{s.hostname}:{s.port}{via}")
+
+    def _open_socket(self):
+        """Socket-like object to the exit host: ProxyCommand, a channel through the last bastion, or TCP."""
+        s = self.settings
+        if s.proxy_command:
+            command = s.proxy_command.replace('%h', s.hostname).replace('%p', str(s.port)).replace('%r', s.username)
+            return paramiko.ProxyCommand(command)
+        sock = None
+        for hop, target in zip(s.jumps, s.jumps[1:] + [s]):
+            jump = self._start(hop, sock if sock is not None else self._tcp(hop))
+            jump.set_keepalive(s.keepalive)
+            self.jump_transports.append(jump)
+            sock = jump.open_channel('direct-tcpip', (target.hostname, target.port), ('127.0.0.1', 0),
+                                     timeout=s.connect_timeout)
+        return sock if sock is not None else self._tcp(s)
+
+    @staticmethod
+    def _tcp(settings: SshTransportSettings) -> socket.socket:
+        sock = socket.create_connection((settings.hostname, settings.port), timeout=settings.connect_timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _start(self, settings: SshTransportSettings, sock) -> 'paramiko.Transport':
+        transport = paramiko.Transport(sock)
+        transport.default_window_size = self.settings.window_size
+        try:
+            # Host key is not verified, matching StrictHostKeyChecking=no of the ssh -D command
+            transport.start_client(timeout=settings.connect_timeout)
+            self._authenticate(transport, settings)
+        except BaseException:
+            transport.close()
+            raise
+        return transport
+
+    @staticmethod
+    def _authenticate(transport: 'paramiko.Transport', settings: SshTransportSettings) -> None:
+        keys = load_keys(settings)
+        if not keys:
+            raise paramiko.AuthenticationException(
+                f"no usable key for {settings.hostname} (check IdentityFile, key_pass or ssh-agent)")
+        for key in keys:
+            try:
+                transport.auth_publickey(settings.username, key)
+            except paramiko.AuthenticationException as e:
+                logger.debug(f"Key {key.get_name()} rejected by {settings.hostname}: {e}")
+                continue
+            if transport.is_authenticated():
+                return
+        raise paramiko.AuthenticationException(
+            f"all {len(keys)} key(s) rejected for {settings.username}@{settings.hostname}")
+
+    def open_channel(self, dest_host: str, dest_port: int) -> 'paramiko.Channel':
+        self.connect()
+        return self.transport.open_channel('direct-tcpip', (dest_host, dest_port), ('127.0.0.1', 0),
+                                           timeout=self.settings.connect_timeout)
+
+    def close(self) -> None:
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+        for jump in reversed(self.jump_transports):
+            jump.close()
+        self.jump_transports = []
+
+
+# ==================== TRANSPORT POOL ====================
+class SshTransportPool:
+    """Several transports to one host; channels are bridged to asyncio streams."""
+
+    def __init__(self, settings: SshTransportSettings):
+        if paramiko is None:
+            raise RuntimeError("paramiko is not installed (pip install 'paramiko>=3.2')")
+        self.settings = settings
+        self.transports = [SshTransport(i, settings) for i in range(max(1, settings.transports))]
+        self.recent: Deque[ChannelRecord] = deque(maxlen=settings.recent_channels)
+        self.open: Dict[int, ChannelRecord] = {}
+        self.failure_reasons: Dict[str, int] = {}
+        self.executor = ThreadPoolExecutor(max_workers=settings.open_threads, thread_name_prefix='ssh-open')
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def choose(self) -> SshTransport:
+        """Connected transport with the fewest channels, else the one failing least."""
+        return min(self.transports, key=lambda t: (not t.is_active, t.channels, t.failures))
+
+    async def connect_all(self) -> List[str]:
+        """Connect every transport; returns failure reasons (empty when all are up)."""
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*(loop.run_in_executor(self.executor, t.connect)
+                                         for t in self.transports), return_exceptions=True)
+        errors = []
+        for transport, result in zip(self.transports, results):
+            if isinstance(result, BaseException):
+                reason, _ = describe_failure(result)
+                self._failed(transport, reason)
+                errors.append(reason)
+        return errors
+
+    def _failed(self, transport: SshTransport, reason: str) -> None:
+        transport.failures += 1
+        transport.last_error = reason
+        self.failure_reasons[reason] = self.failure_reasons.get(reason, 0) + 1
+
+    async def open_connection(self, dest_host: str, dest_port: int, transport: Optional[SshTransport] = None,
+                              limit: int = 2 ** 16) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """
+        Open a direct-tcpip channel and return it as asyncio streams.
+
+        Args:
+            dest_host: Destination host (resolved by the server)
+            dest_port: Destination port
+            transport: Transport to use (default: choose())
+            limit: StreamReader buffer limit
+
+        Returns:
+            (reader, writer) pair
+
+        Raises:
+            SocksError: Server refused the channel (reply set from the reason code)
+            ConnectionError: Transport could not be connected
+        """
+        transport = transport or self.choose()
+        loop = asyncio.get_running_loop()
+        try:
+            channel = await loop.run_in_executor(self.executor, transport.open_channel, dest_host, dest_port)
+        except Exception as e:
+            reason, reply = describe_failure(e)
+            if reply is None:
+                self._failed(transport, reason)
+                raise ConnectionError(f"transport {transport.index}: {reason}") from e
+            # Refused by the server for this destination; the transport itself is fine
+            self.failure_reasons[reason] = self.failure_reasons.get(reason, 0) + 1
+            raise SocksError(f"{dest_host}:{dest_port}: {reason}", reply) from e
+
+        local, remote = socket.socketpair()
+        record = ChannelRecord(id=next(self._ids), transport=transport.index,
+                               dest=f"{dest_host}:{dest_port}", opened=time.time())
+        with self._lock:
+            transport.channels += 1
+            transport.opened += 1
+            self.open[record.id] = record
+        self._bridge(transport, channel, remote, record)
+        return await asyncio.open_connection(sock=local, limit=limit)
+
+    def _bridge(self, transport: SshTransport, channel: 'paramiko.Channel', sock: socket.socket,
+                record: ChannelRecord) -> None:
+        """
+        Copy between the channel and one end of a socketpair in two threads.
+
+        Blocking sends keep memory bounded: a slow client fills the socket buffer, which
+        stops channel reads and lets the SSH window close; a full window blocks uploads.
+        """
+        chunk = self.settings.chunk
+        remaining = [2]
+
+        def finish(error: str) -> None:
+            if error and not record.error:
+                record.error = error
+            if error:
+                # Wake the other direction
+                channel.close()
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            with self._lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+                transport.channels -= 1
+                self.open.pop(record.id, None)
+                record.closed = time.time()
+                self.recent.append(record)
+            channel.close()
+            sock.close()
+
+        def upload() -> None:
+            error = ''
+            try:
+                while True:
+                    data = sock.recv(chunk)
+                    if not data:
+                        break
+                    channel.sendall(data)
+                    record.bytes_up += len(data)
+                channel.shutdown_write()
+            except (OSError, EOFError, paramiko.SSHException) as e:
+                error = f"upload: {describe_failure(e)[0]}"
+            finish(error)
+
+        def download() -> None:
+            error = ''
+            try:
+                while True:
+                    data = channel.recv(chunk)
+                    if not data:
+                        break
+                    sock.sendall(data)
+                    record.bytes_down += len(data)
+                if not transport.is_active:
+                    error = "download: transport closed"
+                else:
+                    sock.shutdown(socket.SHUT_WR)
+            except (OSError, EOFError, paramiko.SSHException) as e:
+                error = f"download: {describe_failure(e)[0]}"
+            finish(error)
+
+        for target in (upload, download):
+            threading.Thread(target=target, name=f"ssh-chan-{record.id}", daemon=True).start()
+
+    def snapshot(self) -> Dict[str, object]:
+        """Per-transport and per-channel counters."""
+        with self._lock:
+            open_channels = [asdict(r) for r in self.open.values()]
+            recent = [asdict(r) for r in self.recent]
+        return {
+            'transports': [{
+                'index': t.index,
+                'active': t.is_active,
+                'channels': t.channels,
+                'opened': t.opened,
+                'connects': t.connects,
+                'failures': t.failures,
+                'last_error': t.last_error,
+            } for t in self.transports],
+            'failure_reasons': dict(self.failure_reasons),
+            'open_channels': open_channels,
+            'recent_channels': recent,
+        }
+
+    def close(self) -> None:
+        for transport in self.transports:
+            transport.close()
+        self.executor.shutdown(wait=False)
+
+
+# ==================== RELAY ====================
+class TransportRelay(Relay):
+    """SOCKS5 relay whose upstreams are in-process SSH transports instead of ssh -D ports."""
+
+    def __init__(self, settings: RelaySettings, pool: SshTransportPool):
+        super().__init__(settings)
+        self.pool = pool
+        self.upstreams = [Upstream(pool.settings.hostname, pool.settings.port) for _ in pool.transports]
+        self._transports = {id(u): t for u, t in zip(self.upstreams, pool.transports)}
+
+    async def _open_upstream(self, conn: Connection,
+                             upstream: Upstream) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        return await self.pool.open_connection(conn.dest_host, conn.dest_port, self._transports[id(upstream)],
+                                               limit=self.settings.conn_buffer // 2)
+
+    def snapshot(self) -> Dict[str, object]:
+        snapshot = super().snapshot()
+        snapshot.update(self.pool.snapshot())
+        return snapshot
+
+
+async def serve_transport(relay_settings: RelaySettings, pool: SshTransportPool,
+                          stats_file: Optional[str] = None, ready: Optional[asyncio.Event] = None) -> None:
+    """
+    Connect the transports, then serve SOCKS5 until cancelled.
+
+    Args:
+        relay_settings: Listener settings
+        pool: Transport pool
+        stats_file: Optional JSON file refreshed every 5 seconds
+        ready: Optional event set once the listener is bound
+    """
+    errors = await pool.connect_all()
+    if len(errors) == len(pool.transports):
+        raise ConnectionError(f"no SSH transport could be established: {errors[0]}")
+    for reason in errors:
+        logger.warning(f"Transport failed, will retry on demand: {reason}")
+
+    relay = TransportRelay(relay_settings, pool)
+    server = await asyncio.start_server(relay.handle_client, relay_settings.listen_host,
+                                        relay_settings.listen_port, limit=relay_settings.conn_buffer // 2,
+                                        backlog=1024)
+    logger.info(f"SOCKS5 on {relay_settings.listen_host}:{relay_settings.listen_port} -> "
+                f"{len(pool.transports)} transport(s) to {pool.settings.hostname}")
+    tasks = []
+    if relay_settings.stats_interval > 0:
+        tasks.append(asyncio.ensure_future(report_stats(relay, relay_settings.stats_interval)))
+    if stats_file:
+        tasks.append(asyncio.ensure_future(write_stats_file(relay, stats_file, 5.0)))
+    if relay_settings.probe_url:
+        tasks.append(asyncio.ensure_future(ThroughputProber(relay).run()))
+    if ready is not None:
+        ready.set()
+    try:
+        await asyncio.Future()
+    finally:
+        for task in tasks:
+            task.cancel()
+        server.close()
+        relay.close()
+        pool.close()
+
+
+# ==================== MAIN ====================
+def _host_settings(host: Dict[str, str], key_path: Optional[str], passphrase: Optional[str]) -> SshTransportSettings:
+    try:
+        port = int(host_option(host, 'Port') or 22)
+    except ValueError:
+        logger.warning(f"Invalid port in SSH config: {host_option(host, 'Port')}")
+        port = 22
+    return SshTransportSettings(
+        hostname=host_option(host, 'HostName') or host['name'],
+        port=port,
+        username=host_option(host, 'User') or 'root',
+        key_path=key_path,
+        passphrase=passphrase,
+    )
+
+
+def settings_from_ssh_config(host_name: str, jump: Optional[str] = None) -> Optional[SshTransportSettings]:
+    """
+    Build transport settings from a ~/.ssh/config host and the key_pass file.
+
+    Args:
+        host_name: Host alias
+        jump: ProxyJump value overriding the one in ssh config (e.g. chosen by path selection)
+
+    Returns:
+        Settings, or None if the host is unknown or its jump chain is invalid
+    """
+    from proxy_start_v25 import config, parse_ssh_config, validate_key_file, load_passphrase_from_file
+
+    hosts = parse_ssh_config(config.ssh_config_path)
+    host = next((h for h in hosts if h['name'] == host_name), None)
+    if host is None:
+        logger.error(f"Host {host_name} not found in {config.ssh_config_path}")
+        return None
+    if jump is not None:
+        host = without_options(host, 'ProxyJump', 'ProxyCommand')
+        host['ProxyJump'] = jump
+
+    passphrase = load_passphrase_from_file()
+    key_path = validate_key_file(host['IdentityFile']) if host.get('IdentityFile') else None
+    settings = _host_settings(host, key_path, passphrase)
+    proxy_command = host_option(host, 'ProxyCommand')
+    if proxy_command and proxy_command.lower() != 'none':
+        settings.proxy_command = proxy_command
+        return settings
+    try:
+        chain = host_jump_chain(host, hosts)
+    except ValueError as e:
+        logger.error(f"Invalid ProxyJump for {host_name}: {e}")
+        return None
+    for hop in chain:
+        hop_key = host_option(hop, 'IdentityFile')
+        settings.jumps.append(_host_settings(hop, validate_key_file(hop_key) if hop_key else key_path, passphrase))
+    return settings
+
+
+def main() -> None:
+    """Transport entry point."""
+    parser = argparse.ArgumentParser(description="SOCKS5 over in-process SSH transports (paramiko)")
+    parser.add_argument('--host', help="Host alias from ~/.ssh/config")
+    parser.add_argument('--hostname', help="SSH server address (instead of --host)")
+    parser.add_argument('--ssh-port', type=int, default=22, help="SSH server port")
+    parser.add_argument('--user', default='root', help="SSH user")
+    parser.add_argument('--key', help="Private key file")
+    parser.add_argument('--jump', help="ProxyJump value overriding ssh config (with --host)")
+    parser.add_argument('--transports', type=int, default=2, help="Parallel SSH transports to the host")
+    parser.add_argument('--listen', default='127.0.0.1', help="Listen address")
+    parser.add_argument('--port', type=int, default=1080, help="SOCKS5 listen port")
+    parser.add_argument('--conn-buffer-kb', type=int, default=64, help="Per-connection buffer budget")
+    parser.add_argument('--stats-interval', type=float, default=0, help="Print JSON stats every N seconds")
+    parser.add_argument('--stats-file', help="JSON file with transport and channel counters")
+    parser.add_argument('--access-log', help="Per-connection binary ring log (read with proxy_access_log.py)")
+    parser.add_argument('--access-log-records', type=int, default=DEFAULT_RECORDS, help="Ring capacity in records")
+    add_probe_arguments(parser)
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    if paramiko is None:
+        logger.error("paramiko is not installed (pip install 'paramiko>=3.2')")
+        sys.exit(1)
+
+    if args.host:
+        settings = settings_from_ssh_config(args.host, args.jump)
+        if settings is None:
+            sys.exit(1)
+    elif args.hostname:
+        settings = SshTransportSettings(hostname=args.hostname, port=args.ssh_port,
+                                        username=args.user, key_path=args.key)
+    else:
+        parser.error("either --host or --hostname is required")
+    settings.transports = max(1, args.transports)
+
+    relay_settings = RelaySettings(
+        listen_host=args.listen,
+        listen_port=args.port,
+        upstreams=[],
+        conn_buffer=args.conn_buffer_kb * 1024,
+        stats_interval=args.stats_interval,
+        access_log=args.access_log,
+        access_log_records=args.access_log_records,
+        **probe_settings(args),
+    )
+    raise_fd_limit()
+
+    try:
+        asyncio.run(serve_transport(relay_settings, SshTransportPool(settings), args.stats_file))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        logger.error(f"SSH transport failed: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,18 +5,21 @@ OPTIMIZED VERSION - Automatic passphrase, PAC from template, no windows, daemon
 import os
 import os.path
 import subprocess
-import msvcrt
 import re
 import json
 import time
 import shutil
+import socket
 import sys
-import threading
-from pathlib import Path
 from typing import Optional, Dict, List
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import logging
 
+from proxy_platform import get_backends, PlatformBackends
+
+# Startup path: optional features (PAC optimizer, jump paths, console menu) import their
+# modules on first use, so the tunnel is listening before asyncio/ssl are ever loaded.
+
 # ============ LOGGING SETUP ============
 logging.basicConfig(
     level=logging.WARNING,
@@ -47,7 +50,7 @@ def color(sym: str) -> str:
 class Config:
     """Configuration class for application settings."""
     ssh_config_path: str = os.path.join(os.environ.get('USERPROFILE', os.path.expanduser('~')), '.ssh/config')
-    ssh_path: str = "ssh.exe"
+    ssh_path: str = "ssh.exe" if os.name == 'nt' else "ssh"
     proxy_port: int = 1080
     state_file: str = "x_proxy_state.json"
     pac_http_pid_file: str = "x_http_pac.pid"
@@ -57,6 +60,45 @@ class Config:
     pac_template_file: str = os.path.join(os.getcwd(), "proxy_pac.back")
     ssh_agent_dir: str = os.path.join(os.environ.get('USERPROFILE', os.path.expanduser('~')), '.ssh/agent')
     ssh_tunnel_pid_file: str = "x_ssh_tunnel.pid" 
+    pac_socks_fallback: bool = False
+    pac_rules_file: str = os.path.join(os.getcwd(), "pac_rules.json")
+    dns_stub_enabled: bool = False
+    dns_stub_port: int = 5053
+    dns_upstream: str = "1.1.1.1:53"
+    dns_stub_pid_file: str = "x_dns_stub.pid"
+    http_proxy_enabled: bool = False
+    http_proxy_port: int = 8118
+    http_proxy_pid_file: str = "x_http_proxy.pid"
+    pac_http_proxy_fallback: bool = False
+    relay_enabled: bool = False
+    relay_tunnel_port: int = 1081
+    relay_conn_buffer_kb: int = 64
+    relay_memory_cap_mb: float = 0
+    relay_link_down_mbps: float = 0
+    relay_link_up_mbps: float = 0
+    relay_pid_file: str = "x_relay.pid"
+    ssh_backend: str = "ssh"  # "ssh" (ssh.exe -D) or "paramiko" (in-process, proxy_ssh_transport.py)
+    ssh_transports: int = 2
+    ssh_transport_stats_file: str = "x_ssh_transport_stats.json"
+    tray_enabled: bool = True
+    jump_candidates: Dict[str, List[str]] = field(default_factory=dict)  # host -> alternative ProxyJump values
+    jump_probe_kb: int = 1024
+    jump_cache_hours: float = 6.0
+    jump_store_file: str = os.path.join(os.getcwd(), "ssh_path_measurements.json")
+    jump_config_file: str = os.path.join(os.getcwd(), "x_ssh_jump.conf")
+    headless: bool = False  # No TTY menu and no system proxy changes (proxy_daemon.py)
+    gateway_bind: str = "127.0.0.1"  # "0.0.0.0" or a LAN address shares SOCKS5 and PAC with the LAN
+    gateway_allow: List[str] = field(default_factory=list)  # LAN client networks (CIDR) in gateway mode
+    gateway_address: str = ""  # Address in the LAN PAC ("" = bind address or LAN interface address)
+    gateway_max_client_conns: int = 0  # Per client address (0 = unlimited)
+    gateway_max_active: int = 0  # Concurrent connections through the tunnel (0 = unlimited)
+    gateway_queue_timeout: float = 10.0  # Seconds a connection may wait for a slot
+    relay_stats_file: str = "x_relay_stats.json"
+    access_log_file: str = "x_access.log"  # Per-connection ring log of relay / transport ("" = off)
+    access_log_records: int = 65536  # Ring capacity (128 bytes per record)
+    probe_url: str = ""  # http:// payload pulled through each tunnel to weight dispatch ("" = off)
+    probe_interval: float = 300.0  # Seconds between probes of one tunnel
+    probe_kb: int = 1024
         
     def validate(self) -> bool:
         """Validate configuration."""
@@ -66,12 +108,86 @@ class Config:
         if not 1024 <= self.pac_http_port <= 65535:
             logger.error(f"Invalid PAC HTTP port: {self.pac_http_port}")
             return False
+        if self.dns_stub_enabled and not 1024 <= self.dns_stub_port <= 65535:
+            logger.error(f"Invalid DNS stub port: {self.dns_stub_port}")
+            return False
+        if self.http_proxy_enabled and not 1024 <= self.http_proxy_port <= 65535:
+            logger.error(f"Invalid HTTP proxy port: {self.http_proxy_port}")
+            return False
+        if self.relay_enabled and (not 1024 <= self.relay_tunnel_port <= 65535
+                                   or self.relay_tunnel_port == self.proxy_port):
+            logger.error(f"Invalid relay tunnel port: {self.relay_tunnel_port}")
+            return False
+        if self.ssh_backend not in ("ssh", "paramiko"):
+            logger.error(f"Invalid SSH backend: {self.ssh_backend}")
+            return False
+        if is_shared_address(self.gateway_bind):
+            # The relay is what enforces the allowlist and connection limits
+            if not self.relay_enabled:
+                logger.error("Gateway mode (gateway_bind) requires relay_enabled")
+                return False
+            if not self.gateway_allow:
+                logger.error("Gateway mode requires gateway_allow (client networks, e.g. 192.168.1.0/24)")
+                return False
+            import ipaddress
+            for net in self.gateway_allow:
+                try:
+                    ipaddress.ip_network(net, strict=False)
+                except ValueError as e:
+                    logger.error(f"Invalid gateway_allow network: {e}")
+                    return False
+        if self.probe_url and not self.probe_url.startswith("http://"):
+            logger.error(f"Invalid probe URL (http:// only): {self.probe_url}")
+            return False
         return True
 
 
 config = Config()
 
 
+def backends() -> PlatformBackends:
+    """Menu, system proxy and process control backends for this platform and mode."""
+    return get_backends(config.headless)
+
+
+# ==================== SHARED GATEWAY ====================
+WILDCARD_HOSTS = ("0.0.0.0", "::", "")
+
+
+def is_shared_address(host: str) -> bool:
+    """True if a listen address is reachable from other machines (not loopback)."""
+    if host == "localhost":
+        return False
+    import ipaddress
+    try:
+        return not ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return True  # Host name of a LAN interface
+
+
+def local_proxy_host() -> str:
+    """Address this machine's clients and helpers use to reach the relay and PAC server."""
+    return "127.0.0.1" if config.gateway_bind in WILDCARD_HOSTS else config.gateway_bind
+
+
+def gateway_host() -> str:
+    """Address LAN clients reach the gateway at (written into the LAN PAC)."""
+    if config.gateway_address:
+        return config.gateway_address
+    if config.gateway_bind not in WILDCARD_HOSTS:
+        return config.gateway_bind
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(("192.0.2.1", 9))  # Selects the default-route interface, sends nothing
+            return s.getsockname()[0]
+    except OSError:
+        return socket.gethostname()
+
+
+def lan_pac_path() -> str:
+    return os.path.join(config.work_dir, "proxy_lan.pac")
+
+
 # ==================== PASSPHRASE MANAGEMENT ====================
 def load_passphrase_from_file() -> Optional[str]:
     """
@@ -251,17 +367,19 @@ def save_proxy_state(host_info: Dict, key_path: str, has_password: bool) -> bool
 
 
 # ==================== PAC FILE FROM TEMPLATE ====================
-def generate_pac_file_from_template(pac_path: str, port: int) -> bool:
+def generate_pac_file_from_template(pac_path: str, port: int, proxy: Optional[str] = None) -> bool:
     """
     Generate PAC file from proxy_pac.back template.
     
     Args:
         pac_path: Path where PAC file will be saved
         port: SOCKS5 proxy port
+        proxy: PAC proxy result (default: pac_proxy_string(port))
         
     Returns:
         True if successful
     """
+    proxy = proxy or pac_proxy_string(port)
     try:
         if not 1024 <= port <= 65535:
             logger.error(f"Invalid port for PAC: {port}")
@@ -277,14 +395,16 @@ def generate_pac_file_from_template(pac_path: str, port: int) -> bool:
                 pac_content = pac_content.replace('__PORT__', str(port))
                 pac_content = pac_content.replace('${PORT}', str(port))
                 pac_content = pac_content.replace(':1080', f':{port}')
+                pac_content = pac_content.replace(f'"SOCKS5 127.0.0.1:{port}"', f'"{proxy}"')
+                pac_content = pac_content.replace('    // __LEARNED_RULES__\n', learned_pac_rules(port, proxy))
                 
                 logger.info(f"Loaded PAC template from {config.pac_template_file}")
             except Exception as e:
                 logger.warning(f"Failed to load PAC template, using default: {e}")
-                pac_content = generate_default_pac(port)
+                pac_content = generate_default_pac(port, proxy)
         else:
             logger.info(f"PAC template not found, using default PAC")
-            pac_content = generate_default_pac(port)
+            pac_content = generate_default_pac(port, proxy)
         
         with open(pac_path, "w", encoding="utf-8") as f:
             f.write(pac_content)
@@ -296,16 +416,66 @@ def generate_pac_file_from_template(pac_path: str, port: int) -> bool:
         return False
 
 
-def generate_default_pac(port: int) -> str:
+def pac_proxy_string(port: int, host: str = "127.0.0.1", lan: bool = False) -> str:
+    """
+    Build PAC proxy result for the SOCKS tunnel.
+    
+    With pac_socks_fallback the result lists "SOCKS5" first (remote DNS in
+    browsers that support it) and plain "SOCKS" as fallback for clients
+    that do not understand the SOCKS5 keyword. With pac_http_proxy_fallback
+    and the HTTP front-end enabled, "PROXY" is appended last.
+    
+    Args:
+        port: SOCKS5 proxy port
+        host: Proxy address as seen by the PAC's clients
+        lan: PAC for LAN clients (the HTTP front-end only listens on loopback)
+        
+    Returns:
+        PAC proxy string
+    """
+    if ':' in host:
+        host = f"[{host}]"
+    proxy = f"SOCKS5 {host}:{port}"
+    if config.pac_socks_fallback:
+        proxy += f"; SOCKS {host}:{port}"
+    if config.http_proxy_enabled and config.pac_http_proxy_fallback and not lan:
+        proxy += f"; PROXY 127.0.0.1:{config.http_proxy_port}"
+    return proxy
+
+
+def learned_pac_rules(port: int, proxy: Optional[str] = None) -> str:
+    """
+    Render DIRECT/proxy rules learned by proxy_pac_optimizer.py.
+    
+    Args:
+        port: SOCKS5 proxy port
+        proxy: PAC proxy result (default: pac_proxy_string(port))
+        
+    Returns:
+        PAC snippet (empty if no rules file)
+    """
+    if not os.path.exists(config.pac_rules_file):
+        return ""
+    from proxy_pac_optimizer import load_pac_rules, render_pac_rules
+    
+    rules = load_pac_rules(config.pac_rules_file)
+    if rules:
+        logger.info(f"Learned PAC rules: {len(rules['direct'])} DIRECT, {len(rules['proxy'])} proxy")
+    return render_pac_rules(rules, proxy or pac_proxy_string(port))
+
+
+def generate_default_pac(port: int, proxy: Optional[str] = None) -> str:
     """
     Generate default PAC content.
     
     Args:
         port: SOCKS5 proxy port
+        proxy: PAC proxy result (default: pac_proxy_string(port))
         
     Returns:
         PAC file content
     """
+    proxy = proxy or pac_proxy_string(port)
     return f'''function FindProxyForURL(url, host) {{
     host = host.toLowerCase();
     // Local networks - no proxy
@@ -316,7 +486,7 @@ def generate_default_pac(port: int) -> str:
         host === "localhost") {{
         return "DIRECT";
     }}
-    // Domains and services - no proxy
+{learned_pac_rules(port, proxy)}    // Domains and services - no proxy
     if (shExpMatch(host, "*.local") ||
         shExpMatch(host, "*.ru") ||
         shExpMatch(host, "vk.*") ||
@@ -325,12 +495,33 @@ def generate_default_pac(port: int) -> str:
         return "DIRECT";
     }}
     // All other traffic through SOCKS5 proxy
-    return "SOCKS5 127.0.0.1:{port}";
+    return "{proxy}";
 }}'''
 
 
 
 
+def generate_pac_files(pac_path: str) -> bool:
+    """
+    Generate the PAC for this machine and, in gateway mode, the LAN PAC pointing at the gateway.
+    
+    Args:
+        pac_path: Path of the local PAC file
+        
+    Returns:
+        True if successful
+    """
+    local_proxy = pac_proxy_string(config.proxy_port, local_proxy_host())
+    if not generate_pac_file_from_template(pac_path, config.proxy_port, local_proxy):
+        return False
+    if is_shared_address(config.gateway_bind):
+        lan_proxy = pac_proxy_string(config.proxy_port, gateway_host(), lan=True)
+        if not generate_pac_file_from_template(lan_pac_path(), config.proxy_port, lan_proxy):
+            return False
+        print(color("✓") + f" LAN PAC generated for gateway {gateway_host()}")
+    return True
+
+
 # ==================== SYSTEM PROXY ====================
 def set_system_proxy_with_pac_http(pac_url: str) -> bool:
     """
@@ -342,37 +533,32 @@ def set_system_proxy_with_pac_http(pac_url: str) -> bool:
     Returns:
         True if successful
     """
-    try:
-        ps_script = f'''
-$regPath = "HKCU:\\Software\\Microsoft\\Windows\\CurrentVersion\\Internet Settings"
-Set-ItemProperty -Path $regPath -Name "AutoConfigURL" -Value "{pac_url}"
-Set-ItemProperty -Path $regPath -Name "ProxyEnable" -Value 0
-Get-Item -Path $regPath | Select-Object AutoConfigURL
-'''
-        
-        result = subprocess.run(
-            ['powershell', '-NoProfile', '-Command', ps_script],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
-        
-        if result.returncode == 0:
-            print(color("✓") + f" PAC proxy enabled: {pac_url}")
-            logger.info(f"System proxy configured with PAC: {pac_url}")
-            return True
-        else:
-            logger.error(f"PowerShell error: {result.stderr}")
-            return False
-    except subprocess.TimeoutExpired:
-        logger.error("PowerShell command timeout")
-        return False
-    except Exception as e:
-        logger.error(f"Failed to enable PAC proxy: {e}")
+    system_proxy = backends().system_proxy
+    if not system_proxy.enable_pac(pac_url):
         return False
+    if system_proxy.name == "none":
+        print(color("⚠") + f" System proxy not changed, point clients at {pac_url}")
+    else:
+        print(color("✓") + f" PAC proxy enabled: {pac_url}")
+    return True
 
 
 # ==================== LOCAL HTTP SERVER ====================
+def pac_server_arguments() -> List[str]:
+    """Interpreter arguments for the PAC HTTP server (proxy_pac_server.py)."""
+    args = [
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "proxy_pac_server.py"),
+        "--listen", config.gateway_bind,
+        "--port", str(config.pac_http_port),
+        "--pac", os.path.join(config.work_dir, "proxy.pac")
+    ]
+    if is_shared_address(config.gateway_bind):
+        args += ["--lan-pac", lan_pac_path()]
+        for net in config.gateway_allow:
+            args += ["--allow", net]
+    return args
+
+
 def start_local_http_server(pac_path: str) -> Optional[int]:
     """
     Start local HTTP server for PAC file in background.
@@ -388,28 +574,17 @@ def start_local_http_server(pac_path: str) -> Optional[int]:
             logger.error(f"PAC file not found: {pac_path}")
             return None
         
-        pythonw = sys.executable.replace("python.exe", "pythonw.exe")
-        
-        if not shutil.which(pythonw) and not os.path.exists(pythonw):
-            pythonw = sys.executable
+        process = backends().process
+        pythonw = process.background_python()
         
-        cmd = [
-            pythonw,
-            "-m", "http.server",
-            str(config.pac_http_port),
-            "--bind", "127.0.0.1",
-            "--directory", config.work_dir
-        ]
-        
-        DETACHED = 0x00000008
-        NO_WINDOW = 0x08000000
+        cmd = [pythonw] + pac_server_arguments()
         
         proc = subprocess.Popen(
             cmd,
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL,
             stdin=subprocess.DEVNULL,
-            creationflags=DETACHED | NO_WINDOW
+            **process.popen_kwargs(detached=True)
         )
         
         try:
@@ -420,7 +595,7 @@ def start_local_http_server(pac_path: str) -> Optional[int]:
         
         time.sleep(1)
         
-        print(color("✓") + f" Local HTTP server started on 127.0.0.1:{config.pac_http_port} (PID {proc.pid})")
+        print(color("✓") + f" Local HTTP server started on {config.gateway_bind}:{config.pac_http_port} (PID {proc.pid})")
         logger.info(f"HTTP server started with PID {proc.pid}")
         return proc.pid
         
@@ -429,23 +604,202 @@ def start_local_http_server(pac_path: str) -> Optional[int]:
         return None
 
 
+# ==================== BACKGROUND HELPERS ====================
+def wait_for_listening(port: int, proc: Optional[subprocess.Popen] = None, timeout: float = 15.0) -> bool:
+    """
+    Wait until a local port accepts connections.
+    
+    Args:
+        port: Local TCP port
+        proc: Process expected to open it (stop waiting if it exits)
+        timeout: Maximum wait in seconds
+        
+    Returns:
+        True if the port is listening
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc is not None and proc.poll() is not None:
+            return False
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def start_background_script(script_name: str, args: List[str], pid_file: str, port: int) -> Optional[int]:
+    """
+    Start helper script from work_dir as detached windowless process.
+    
+    Args:
+        script_name: Script file name (e.g. proxy_dns.py)
+        args: Command-line arguments for the script
+        pid_file: File to record {"pid", "port"} in for proxy_stop.py
+        port: Port the helper listens on
+        
+    Returns:
+        Process ID if successful, None otherwise
+    """
+    try:
+        script = os.path.join(config.work_dir, script_name)
+        if not os.path.exists(script):
+            logger.error(f"Helper script not found: {script}")
+            return None
+        
+        process = backends().process
+        pythonw = process.background_python()
+        
+        proc = subprocess.Popen(
+            [pythonw, script] + args,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            stdin=subprocess.DEVNULL,
+            **process.popen_kwargs(detached=True)
+        )
+        
+        try:
+            with open(pid_file, "w", encoding="utf-8") as f:
+                json.dump({"pid": proc.pid, "port": port}, f)
+        except Exception as e:
+            logger.warning(f"Failed to save {script_name} PID: {e}")
+        
+        logger.info(f"{script_name} started with PID {proc.pid}")
+        return proc.pid
+        
+    except Exception as e:
+        logger.error(f"Failed to start {script_name}: {e}")
+        return None
+
+
+# ==================== LOCAL DNS STUB ====================
+def dns_stub_arguments() -> List[str]:
+    """Command-line arguments for proxy_dns.py."""
+    return ["--port", str(config.dns_stub_port),
+            "--socks-host", local_proxy_host(),
+            "--socks-port", str(config.proxy_port),
+            "--upstream", config.dns_upstream]
+
+
+def start_dns_stub() -> Optional[int]:
+    """
+    Start local DNS stub (proxy_dns.py) forwarding through the tunnel in background.
+    
+    Returns:
+        Process ID if successful, None otherwise
+    """
+    pid = start_background_script("proxy_dns.py", dns_stub_arguments(),
+                                  config.dns_stub_pid_file, config.dns_stub_port)
+    if pid:
+        print(color("✓") + f" DNS stub started on 127.0.0.1:{config.dns_stub_port} "
+              f"-> {config.dns_upstream} via tunnel (PID {pid})")
+    return pid
+
+
+# ==================== HTTP PROXY FRONT-END ====================
+def http_proxy_arguments() -> List[str]:
+    """Command-line arguments for proxy_http.py."""
+    return ["--port", str(config.http_proxy_port),
+            "--socks-host", local_proxy_host(),
+            "--socks-port", str(config.proxy_port)]
+
+
+def start_http_proxy() -> Optional[int]:
+    """
+    Start HTTP/CONNECT proxy (proxy_http.py) for clients without SOCKS support.
+    
+    Returns:
+        Process ID if successful, None otherwise
+    """
+    pid = start_background_script("proxy_http.py", http_proxy_arguments(),
+                                  config.http_proxy_pid_file, config.http_proxy_port)
+    if pid:
+        print(color("✓") + f" HTTP proxy started on 127.0.0.1:{config.http_proxy_port} (PID {pid})")
+    return pid
+
+
+# ==================== LOCAL RELAY ====================
+def tunnel_port() -> int:
+    """Port ssh -D binds: internal port behind the relay, or the public proxy port."""
+    return config.relay_tunnel_port if config.relay_enabled else config.proxy_port
+
+
+def probe_arguments() -> List[str]:
+    """Throughput probe options shared by the relay and the in-process transport."""
+    if not config.probe_url:
+        return []
+    return ["--probe-url", config.probe_url, "--probe-interval", str(config.probe_interval),
+            "--probe-kb", str(config.probe_kb)]
+
+
+def relay_arguments() -> List[str]:
+    """Command-line arguments for proxy_relay.py."""
+    args = [
+        "--listen", config.gateway_bind,
+        "--port", str(config.proxy_port),
+        "--upstream", f"127.0.0.1:{config.relay_tunnel_port}",
+        "--conn-buffer-kb", str(config.relay_conn_buffer_kb),
+        "--memory-cap-mb", str(config.relay_memory_cap_mb),
+        "--link-down-mbps", str(config.relay_link_down_mbps),
+        "--link-up-mbps", str(config.relay_link_up_mbps),
+        "--rules", config.pac_rules_file,
+        "--max-client-conns", str(config.gateway_max_client_conns),
+        "--max-active", str(config.gateway_max_active),
+        "--queue-timeout", str(config.gateway_queue_timeout),
+        "--stats-file", config.relay_stats_file
+    ]
+    if config.access_log_file:
+        args += ["--access-log", config.access_log_file, "--access-log-records", str(config.access_log_records)]
+    args += probe_arguments()
+    if is_shared_address(config.gateway_bind):
+        # The machine itself stays allowed next to the LAN networks
+        for net in config.gateway_allow + ["127.0.0.0/8", "::1/128"]:
+            args += ["--allow", net]
+    return args
+
+
+def start_relay() -> Optional[int]:
+    """
+    Start SOCKS5 relay (proxy_relay.py) on proxy_port in front of the SSH tunnel.
+    
+    Returns:
+        Process ID if successful, None otherwise
+    """
+    pid = start_background_script("proxy_relay.py", relay_arguments(), config.relay_pid_file, config.proxy_port)
+    if pid:
+        print(color("✓") + f" Relay started on {config.gateway_bind}:{config.proxy_port} "
+              f"-> tunnel 127.0.0.1:{config.relay_tunnel_port} (PID {pid})")
+    return pid
+
+
+# ==================== TRAY MONITOR ====================
+def start_tray() -> Optional[int]:
+    """
+    Start tray monitor (proxy_tray.pyw) after the proxy is up.
+    
+    Returns:
+        Process ID if successful, None otherwise
+    """
+    pid = start_background_script("proxy_tray.pyw", [], "x_tray_monitor.pid", config.proxy_port)
+    if pid:
+        print(color("✓") + f" Tray monitor started (PID {pid})")
+    return pid
+
+
 # ==================== BUILD SSH COMMAND ====================
-def build_ssh_command(host_info: Dict[str, str], key_path: str) -> List[str]:
+def ssh_connection_options(host_info: Dict[str, str], key_path: str) -> List[str]:
     """
-    Build SSH tunnel command.
+    Build ssh options and destination shared by the tunnel and path probes.
     
     Args:
         host_info: Host information dictionary
         key_path: Path to SSH key
         
     Returns:
-        List of command arguments
+        List of arguments ending with the destination host
     """
     cmd = [
-        config.ssh_path,
-        '-D', f'127.0.0.1:{config.proxy_port}',
-        '-N',
-        '-T',
         '-o', 'ConnectTimeout=10',
         '-o', 'ServerAliveInterval=60',
         '-o', 'ServerAliveCountMax=3',
@@ -470,6 +824,15 @@ def build_ssh_command(host_info: Dict[str, str], key_path: str) -> List[str]:
     if host_info.get('IdentitiesOnly', '').lower() == 'yes':
         cmd.append('-oIdentitiesOnly=yes')
     
+    # ProxyCommand / ProxyJump (bastions are resolved against the same ssh config)
+    if any(k.lower() in ('proxyjump', 'proxycommand') for k in host_info):
+        from proxy_jump import jump_ssh_options
+        try:
+            cmd.extend(jump_ssh_options(host_info, parse_ssh_config(config.ssh_config_path),
+                                        key_path, config.jump_config_file, config.ssh_config_path))
+        except (ValueError, OSError) as e:
+            logger.error(f"Invalid jump path for {host_info.get('name')}: {e}")
+    
     if 'HostName' in host_info:
         cmd.append(host_info['HostName'])
     else:
@@ -478,6 +841,79 @@ def build_ssh_command(host_info: Dict[str, str], key_path: str) -> List[str]:
     return cmd
 
 
+def build_ssh_command(host_info: Dict[str, str], key_path: str, dynamic_port: Optional[int] = None) -> List[str]:
+    """
+    Build SSH tunnel command.
+    
+    Args:
+        host_info: Host information dictionary
+        key_path: Path to SSH key
+        dynamic_port: Local SOCKS port for -D (default: tunnel_port())
+        
+    Returns:
+        List of command arguments
+    """
+    return [
+        config.ssh_path,
+        '-D', f'127.0.0.1:{dynamic_port or tunnel_port()}',
+        '-N',
+        '-T',
+        '-o', 'ExitOnForwardFailure=yes'  # Exit (and get restarted) instead of running without -D
+    ] + ssh_connection_options(host_info, key_path)
+
+
+def build_probe_command(host_info: Dict[str, str], key_path: str, probe_bytes: int) -> List[str]:
+    """
+    Build ssh command that streams probe_bytes from the host (path measurement).
+    
+    Args:
+        host_info: Host information dictionary
+        key_path: Path to SSH key
+        probe_bytes: Bytes the remote side writes
+        
+    Returns:
+        List of command arguments
+    """
+    return ([config.ssh_path, '-T', '-o', 'BatchMode=yes']
+            + ssh_connection_options(host_info, key_path)
+            + [f'head -c {probe_bytes} /dev/zero'])
+
+
+# ==================== JUMP PATH SELECTION ====================
+def select_jump_path(host_info: Dict[str, str], hosts: List[Dict[str, str]], key_path: str) -> Dict[str, str]:
+    """
+    Measure the host's candidate bastion paths (config.jump_candidates) and pick the fastest.
+    
+    Args:
+        host_info: Selected host
+        hosts: All hosts from SSH config
+        key_path: Path to SSH key (must be loaded in ssh-agent for BatchMode probes)
+        
+    Returns:
+        Host dictionary with the chosen ProxyJump (unchanged without candidates)
+    """
+    candidates = config.jump_candidates.get(host_info.get('name', ''), [])
+    if not candidates:
+        return host_info
+    from proxy_jump import format_measurement, host_jump_chain, path_label, select_path
+    
+    print(f"\nMeasuring {len(candidates) + 1} path(s) to {host_info['name']}...")
+    probe_bytes = config.jump_probe_kb * 1024
+    chosen, measurements = select_path(
+        host_info, hosts, candidates,
+        lambda h: build_probe_command(h, key_path, probe_bytes),
+        store_path=config.jump_store_file,
+        ttl_hours=config.jump_cache_hours,
+        probe_bytes=probe_bytes,
+        on_result=lambda m, cached: print(" " + format_measurement(m, cached))
+    )
+    if all(m.handshake_ms is None for m in measurements):
+        print(color("⚠") + " No path could be measured, using SSH config as is")
+    else:
+        print(color("✓") + f" Path: {path_label(chosen, host_jump_chain(chosen, hosts))}")
+    return chosen
+
+
 # ==================== START SSH TUNNEL ====================
 def start_ssh_tunnel(host_info: Dict[str, str], key_path: str, passphrase: Optional[str] = None) -> Optional[subprocess.Popen]:
     """
@@ -495,7 +931,7 @@ def start_ssh_tunnel(host_info: Dict[str, str], key_path: str, passphrase: Optio
     
     print("\033[1;33m" + f"\nStarting SSH tunnel to {host_info.get('name', 'unknown')}...\n" + "\033[0m")
     
-    NO_WINDOW = 0x08000000
+    popen_kwargs = backends().process.popen_kwargs()
     
     try:
         if passphrase:
@@ -506,14 +942,15 @@ def start_ssh_tunnel(host_info: Dict[str, str], key_path: str, passphrase: Optio
                 stderr=subprocess.PIPE,
                 stdin=subprocess.PIPE,
                 text=True,
-                creationflags=NO_WINDOW
+                **popen_kwargs
             )
             
             try:
-                # Send passphrase to stdin
-                proc.communicate(input=passphrase + "\n", timeout=5)
-            except subprocess.TimeoutExpired:
-                logger.warning("Passphrase input timeout, continuing...")
+                # Send passphrase to stdin (communicate() would block until ssh exits)
+                proc.stdin.write(passphrase + "\n")
+                proc.stdin.close()
+            except OSError:
+                logger.warning("Passphrase input failed, continuing...")
         else:
             # Start without passphrase (will prompt if needed)
             proc = subprocess.Popen(
@@ -521,13 +958,11 @@ def start_ssh_tunnel(host_info: Dict[str, str], key_path: str, passphrase: Optio
                 stdout=subprocess.DEVNULL,
                 stderr=subprocess.PIPE,
                 stdin=subprocess.DEVNULL,
-                creationflags=NO_WINDOW
+                **popen_kwargs
             )
         
-        # Give SSH time to establish connection
-        time.sleep(4.5)
-        
-        if proc.poll() is None:
+        # ssh -D binds the port once authenticated; stop waiting as soon as it accepts
+        if wait_for_listening(tunnel_port(), proc):
             # 
             try:
                 #
@@ -541,14 +976,19 @@ def start_ssh_tunnel(host_info: Dict[str, str], key_path: str, passphrase: Optio
             logger.info(f"SSH tunnel established to {host_info.get('name')}")
             return proc
         else:
-            err = proc.stderr.read().strip().decode(errors="ignore") if proc.stderr else "Unknown error"
+            if proc.poll() is None:
+                proc.kill()  # Port never opened; don't leave a half-connected ssh behind
+            err = proc.stderr.read() if proc.stderr else b""
+            if isinstance(err, bytes):
+                err = err.decode(errors="ignore")
+            err = err.strip() or "Port did not open in time"
             logger.error(f"SSH tunnel failed: {err}")
             print(color("✗") + f" SSH tunnel failed: {err}")
             return None
     
     except FileNotFoundError:
-        logger.error("ssh.exe not found")
-        print(color("✗") + " ssh.exe not found! Install OpenSSH Client.")
+        logger.error(f"{config.ssh_path} not found")
+        print(color("✗") + f" {config.ssh_path} not found! Install OpenSSH Client.")
         return None
     except Exception as e:
         logger.error(f"Failed to start SSH tunnel: {e}")
@@ -556,84 +996,57 @@ def start_ssh_tunnel(host_info: Dict[str, str], key_path: str, passphrase: Optio
         return None
 
 
+def transport_arguments(host_info: Dict[str, str]) -> List[str]:
+    """Command-line arguments for proxy_ssh_transport.py."""
+    args = [
+        "--host", host_info.get('name', ''),
+        "--port", str(tunnel_port()),
+        "--transports", str(config.ssh_transports),
+        "--stats-file", config.ssh_transport_stats_file
+    ]
+    if config.access_log_file and not config.relay_enabled:
+        # Behind the relay, the relay logs
+        args += ["--access-log", config.access_log_file, "--access-log-records", str(config.access_log_records)]
+    args += probe_arguments()
+    if host_info.get('ProxyJump'):
+        args += ["--jump", host_info['ProxyJump']]  # Path chosen by select_jump_path
+    return args
+
+
+def start_transport_tunnel(host_info: Dict[str, str], timeout: float = 15.0) -> Optional[int]:
+    """
+    Start in-process SSH transport (proxy_ssh_transport.py) instead of ssh.exe -D.
+    The key passphrase is read by the helper from key_pass, not passed on the command line.
+    
+    Args:
+        host_info: Host information dictionary
+        timeout: Seconds to wait for the SOCKS port (opened once a transport is up)
+        
+    Returns:
+        Process ID if successful, None otherwise
+    """
+    port = tunnel_port()
+    print("\033[1;33m" + f"\nStarting SSH transport to {host_info.get('name', 'unknown')} "
+          f"({config.ssh_transports} connection(s))...\n" + "\033[0m")
+    pid = start_background_script("proxy_ssh_transport.py", transport_arguments(host_info),
+                                  config.ssh_tunnel_pid_file, port)
+    if not pid:
+        return None
+    
+    if wait_for_listening(port, timeout=timeout):
+        print(color("✓") + f" SSH transport started (PID {pid}, stats in {config.ssh_transport_stats_file})")
+        logger.info(f"SSH transport established to {host_info.get('name')}")
+        return pid
+    logger.error("SSH transport did not open its SOCKS port (see stats file or run proxy_ssh_transport.py -v)")
+    print(color("✗") + " SSH transport failed to connect")
+    return None
+
+
 # ==================== SELECT HOST MENU ====================
 def select_host_menu(hosts, auto_select_tag="_PRIME", timeout=10):
-    if not hosts:
-        print("No hosts found in SSH config!")
-        return None
+    """Interactive host selection (console menu on Windows, numbered prompt on a POSIX TTY)."""
+    return backends().menu.select(hosts, auto_select_tag, timeout)
 
-    # 
-    prime_index = next((i for i, h in enumerate(hosts) if auto_select_tag in h.get('name', '')), None)
-    selected = prime_index if prime_index is not None else 0  
-
-    start_time = time.time()
-
-    def clear_screen():
-        os.system('cls' if os.name == 'nt' else 'clear')
-
-    def print_menu():
-        print("Select SSH host (↑↓ Arrow keys, Enter to select, Q to quit):")
-        print("=" * 70)
-        for i, host in enumerate(hosts):
-            marker = "►" if i == selected else " "
-            hostname = host.get('HostName', 'N/A')
-            port = host.get('Port', '22')
-            user = host.get('User', 'root')
-            keyfile = host.get('IdentityFile', 'N/A')
-            status_icon = "✓" if os.path.exists(keyfile) else "✗"
-            print(f"{marker} {host['name']} -> {user}@{hostname}:{port} [{status_icon} {os.path.basename(keyfile)}]")
-        print("=" * 70)
-        # 
-        print()
-
-    def print_timer_line(remaining):
-        # 
-        sys.stdout.write(f"\033[s")
-        # 
-        sys.stdout.write(f"\033[{len(hosts)+4}H")  
-        sys.stdout.write("\r")
-        sys.stdout.write(f"↑↓: Navigate | Enter: Select | Q: Quit | Auto-select in {remaining}s\033[K")
-        sys.stdout.write(f"\033[u")  
-        sys.stdout.flush()
-
-    clear_screen()
-    print_menu()
-    print_timer_line(int(timeout))  
-    
-    while True:
-        if msvcrt.kbhit():
-            key = msvcrt.getch()
-            moved = False
-
-            if key == b'\xe0':  # arrow keys
-                arrow_key = msvcrt.getch()
-                if arrow_key == b'H':
-                    selected = max(0, selected - 1)
-                    moved = True
-                elif arrow_key == b'P':
-                    selected = min(len(hosts) - 1, selected + 1)
-                    moved = True
-            elif key == b'\r':
-                sys.stdout.write(f"\033[2B")  
-                return hosts[selected]
-            elif key.lower() in (b'q', b'\x1b'):
-                sys.stdout.write(f"\033[2B")  
-                return None
-
-            if moved:
-                clear_screen()
-                print_menu()
-                print_timer_line(int(timeout - (time.time() - start_time)))  
-                start_time = time.time()  # Сбрасываем таймер
-
-        remaining = max(0, int(timeout - (time.time() - start_time)))
-        print_timer_line(remaining)
-
-        if prime_index is not None and remaining == 0:
-            print(f"\nNo input detected. Auto-selecting: {hosts[prime_index]['name']}")
-            return hosts[prime_index]
-
-        time.sleep(0.0001)  
 
 # ==================== SSH-AGENT ====================
 def ensure_ssh_agent(key_path: str, passphrase: Optional[str] = None) -> bool:
@@ -652,15 +1065,18 @@ def ensure_ssh_agent(key_path: str, passphrase: Optional[str] = None) -> bool:
         return False
     
     try:
-        result = subprocess.run(["ssh-agent", "-s"], capture_output=True, text=True, timeout=5)
-        output = result.stdout
-        
-        sock_match = re.search(r'SSH_AUTH_SOCK=([^;]+);', output)
-        if not sock_match:
-            logger.warning("Could not detect SSH_AUTH_SOCK")
-            return False
-        
-        os.environ["SSH_AUTH_SOCK"] = sock_match.group(1)
+        # Reuse a running agent (desktop session, systemd user unit, earlier call)
+        agent_sock = os.environ.get("SSH_AUTH_SOCK")
+        if not agent_sock or not os.path.exists(agent_sock):
+            result = subprocess.run(["ssh-agent", "-s"], capture_output=True, text=True, timeout=5)
+            output = result.stdout
+            
+            sock_match = re.search(r'SSH_AUTH_SOCK=([^;]+);', output)
+            if not sock_match:
+                logger.warning("Could not detect SSH_AUTH_SOCK")
+                return False
+            
+            os.environ["SSH_AUTH_SOCK"] = sock_match.group(1)
         
         if passphrase:
             proc = subprocess.Popen(
@@ -715,18 +1131,19 @@ def handle_error(msg: str, cleanup: bool = True) -> None:
     logger.error(msg)
     
     if cleanup:
-        stop_script = os.path.join(config.work_dir, "stop_proxy.bat")
-        if os.path.exists(stop_script):
+        stop_cmd = backends().process.cleanup_command(config.work_dir)
+        stop_name = os.path.basename(stop_cmd[-1])
+        if os.path.exists(stop_cmd[-1]):
             try:
-                subprocess.run([stop_script], check=True, timeout=10)
-                print(color("✓") + " Proxy state restored via stop_proxy.bat")
+                subprocess.run(stop_cmd, check=True, timeout=10)
+                print(color("✓") + f" Proxy state restored via {stop_name}")
                 logger.info("Cleanup executed successfully")
             except Exception as e:
                 logger.warning(f"Failed to run cleanup script: {e}")
-                print(color("⚠") + f" Failed to run stop_proxy.bat: {e}")
+                print(color("⚠") + f" Failed to run {stop_name}: {e}")
         else:
-            logger.warning("stop_proxy.bat not found")
-            print(color("⚠") + " stop_proxy.bat not found!")
+            logger.warning(f"{stop_name} not found")
+            print(color("⚠") + f" {stop_name} not found!")
     
     sys.exit(1)
 
@@ -747,8 +1164,8 @@ def main() -> None:
         if not ensure_ssh_agent_dir():
             logger.warning("Failed to create SSH agent directory")
         
-        # Check if SSH is available
-        if not shutil.which(config.ssh_path):
+        # Check if SSH is available (the paramiko backend does not need ssh.exe)
+        if config.ssh_backend == "ssh" and not shutil.which(config.ssh_path):
             handle_error("OpenSSH not found! Please install OpenSSH Client.")
         
         logger.info("Application started")
@@ -785,17 +1202,32 @@ def main() -> None:
         passphrase = load_passphrase_from_file()
         has_passphrase = passphrase is not None
         
+        # Load SSH key into agent (with passphrase if available)
+        if not ensure_ssh_agent(key_path, passphrase):
+            logger.warning("Failed to load key into ssh-agent, continuing...")
+        
+        # Pick the fastest bastion path (only for hosts with jump candidates)
+        selected_host = select_jump_path(selected_host, hosts, key_path)
+        
         # Save proxy state
         if not save_proxy_state(selected_host, key_path, has_passphrase):
             handle_error("Failed to save proxy state")
         
-        # Load SSH key into agent (with passphrase if available)
-        if not ensure_ssh_agent(key_path, passphrase):
-            logger.warning("Failed to load key into ssh-agent, continuing...")
+        # Start SSH tunnel first: the system proxy only ever points at a live tunnel
+        if config.ssh_backend == "paramiko":
+            tunnel_proc = start_transport_tunnel(selected_host)
+        else:
+            tunnel_proc = start_ssh_tunnel(selected_host, key_path, passphrase)
+        if not tunnel_proc:
+            handle_error("Failed to start SSH tunnel")
+        
+        # Start relay in front of the tunnel (optional)
+        if config.relay_enabled and not start_relay():
+            handle_error("Failed to start relay")
         
         # Generate PAC file from template
         pac_path = os.path.join(config.work_dir, "proxy.pac")
-        if not generate_pac_file_from_template(pac_path, config.proxy_port):
+        if not generate_pac_files(pac_path):
             handle_error("Failed to generate PAC file")
         
         # Start local HTTP server
@@ -804,18 +1236,28 @@ def main() -> None:
             handle_error("Failed to start local HTTP server")
         
         # Configure system proxy
-        pac_http_url = f"http://127.0.0.1:{config.pac_http_port}/proxy.pac"
+        pac_http_url = f"http://{local_proxy_host()}:{config.pac_http_port}/proxy.pac"
         if not set_system_proxy_with_pac_http(pac_http_url):
             handle_error("Failed to configure system PAC proxy")
         
-        # Start SSH tunnel (pass passphrase if available)
-        tunnel_proc = start_ssh_tunnel(selected_host, key_path, passphrase)
-        if not tunnel_proc:
-            handle_error("Failed to start SSH tunnel")
+        # Start DNS stub (optional, needs the tunnel)
+        if config.dns_stub_enabled and not start_dns_stub():
+            print(color("⚠") + " DNS stub not started, clients will resolve names locally")
+        
+        # Start HTTP proxy front-end (optional, needs the tunnel)
+        if config.http_proxy_enabled and not start_http_proxy():
+            print(color("⚠") + " HTTP proxy not started, only SOCKS5 is available")
+        
+        # Attach the tray monitor last; the proxy does not depend on it
+        if config.tray_enabled and not start_tray():
+            print(color("⚠") + " Tray monitor not started")
         
         # Success message
         print(f"\n{'='*60}")
-        print(color("✓") + f" SOCKS5 proxy ACTIVE: 127.0.0.1:{config.proxy_port}")
+        print(color("✓") + f" SOCKS5 proxy ACTIVE: {local_proxy_host()}:{config.proxy_port}")
+        if is_shared_address(config.gateway_bind):
+            print(color("✓") + f" LAN gateway: http://{gateway_host()}:{config.pac_http_port}/proxy.pac "
+                  f"for {', '.join(config.gateway_allow)}")
         print(color("✓") + f" System proxy CONFIGURED (PAC via HTTP)")
         print(color("✓") + f" Tunnel to: {selected_host['name']}")
         print(f"{'='*60}\n")
@@ -11,11 +11,9 @@ import json
 import sys
 import shutil
 
-try:
-    import winreg
-except ImportError:
-    print("Required module winreg not available.")
-    sys.exit(1)
+from proxy_platform import get_backends
+
+backends = get_backends()
 
 RED = "\033[31m"
 GREEN = "\033[32m"
@@ -29,14 +27,8 @@ def color(sym):
     return sym
 
 def kill_process(pid):
-    """Kill process by PID."""
-    try:
-        # Using creationflags=0x08000000 (CREATE_NO_WINDOW) to hide the taskkill console
-        subprocess.run(['taskkill', '/PID', str(pid), '/F'], 
-                       capture_output=True, creationflags=0x08000000)
-        return True
-    except Exception:
-        return False
+    """Kill process by PID (taskkill on Windows, SIGTERM elsewhere)."""
+    return backends.process.kill(pid)
 
 def get_pid_from_file(filename):
     """Read PID from a file."""
@@ -53,39 +45,47 @@ def get_pid_from_file(filename):
     except Exception:
         return None
 
+def get_stop_timeout(filename, default=55.0):  # Daemon's default drain_timeout + STOP_GRACE
+    """Seconds the daemon may take to drain, as recorded in its PID file."""
+    try:
+        with open(filename, 'r') as f:
+            return float(json.load(f).get('stop_timeout', default))
+    except Exception:
+        return default
+
+def wait_for_exit(pid, timeout):
+    """Wait until the process is gone; False if it is still running after timeout."""
+    deadline = time.monotonic() + timeout
+    while backends.process.alive(pid):
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.2)
+    return True
+
 def kill_on_ports_fallback(ports):
     """Fallback: Kill processes on specific ports if PIDs are missing."""
     for port in ports:
-        result = subprocess.run(['netstat', '-ano', '-p', 'TCP'], capture_output=True, text=True, shell=True, errors='ignore')
-        for line in result.stdout.splitlines():
-            # Check for specific port and LISTENING state
-            if f':{port}' in line and 'LISTENING' in line:
-                try:
-                    parts = line.strip().split()
-                    pid = parts[-1]
-                    if pid.isdigit():
-                        print(color("⚠") + f" Fallback: Killing PID {pid} on port {port}")
-                        kill_process(int(pid))
-                except IndexError:
-                    continue
+        for pid in backends.process.pids_on_port(port):
+            print(color("⚠") + f" Fallback: Killing PID {pid} on port {port}")
+            kill_process(pid)
 
 def disable_system_proxy():
-    """Disable system proxy and PAC settings (Windows registry)."""
-    reg_path = r"Software\Microsoft\Windows\CurrentVersion\Internet Settings"
-    try:
-        with winreg.OpenKey(winreg.HKEY_CURRENT_USER, reg_path, 0, winreg.KEY_SET_VALUE) as key:
-            # Set ProxyEnable to 0 (Disabled)
-            winreg.SetValueEx(key, "ProxyEnable", 0, winreg.REG_DWORD, 0)
-            # Clear AutoConfigURL
-            winreg.SetValueEx(key, "AutoConfigURL", 0, winreg.REG_SZ, "")
+    """Disable system proxy and PAC settings (registry on Windows, gsettings on GNOME)."""
+    system_proxy = backends.system_proxy
+    if system_proxy.name == "none":
+        print(color("⚠") + " No system proxy backend, system proxy left unchanged")
+    elif system_proxy.disable():
         print(color("✓") + " System proxy disabled (PAC removed)")
-    except Exception as e:
-        print(color("✗") + f" Failed to disable system proxy: {e}")
+    else:
+        print(color("✗") + " Failed to disable system proxy")
 
 def cleanup_files():
     """Removes generated PID and state files."""
     # Added 'x_tray_monitor.pid' to the list
-    files = ["proxy.pac", "x_proxy_state.json", "x_http_pac.pid", "x_ssh_tunnel.pid", "x_tray_monitor.pid"]
+    files = ["proxy.pac", "x_proxy_state.json", "x_http_pac.pid", "x_ssh_tunnel.pid", "x_tray_monitor.pid",
+             "x_dns_stub.pid", "x_http_proxy.pid", "x_relay.pid", "x_workers.pid", "x_workers_stats.json",
+             "x_ssh_transport_stats.json", "x_ssh_jump.conf", "x_daemon.pid",
+             "proxy_lan.pac", "x_relay_stats.json"]
     for file in files:
         if os.path.exists(file):
             try:
@@ -93,9 +93,19 @@ def cleanup_files():
             except Exception: pass
     print(color("✓") + " Temporary files cleaned")
 
-def main():
-    print("Stopping SOCKS5 Proxy...")
+def stop_daemon(pid):
+    """SIGTERM the headless daemon and wait while it drains and stops its own children."""
+    timeout = get_stop_timeout("x_daemon.pid")
+    kill_process(pid)
+    print(f"Waiting up to {timeout:.0f}s for the daemon (PID {pid}) to drain...")
+    if wait_for_exit(pid, timeout):
+        print(color("✓") + f" Daemon stopped (PID {pid})")
+        return True
+    print(color("✗") + f" Daemon (PID {pid}) is still running; files left in place")
+    return False
 
+def stop_children():
+    """Stop the helpers started by the interactive launcher."""
     # 1. Kill SSH Tunnel by PID
     ssh_pid = get_pid_from_file("x_ssh_tunnel.pid")
     if ssh_pid:
@@ -114,6 +124,41 @@ def main():
         print(color("⚠") + " HTTP PID file not found, checking port 8080...")
         kill_on_ports_fallback([8080])
 
+    # 1a. Kill relay by PID (only started when enabled)
+    relay_pid = get_pid_from_file("x_relay.pid")
+    if relay_pid:
+        kill_process(relay_pid)
+        print(color("✓") + f" Relay stopped (PID {relay_pid})")
+
+    # 2a. Kill DNS stub by PID (only started when enabled)
+    dns_pid = get_pid_from_file("x_dns_stub.pid")
+    if dns_pid:
+        kill_process(dns_pid)
+        print(color("✓") + f" DNS stub stopped (PID {dns_pid})")
+
+    # 2b. Kill HTTP proxy front-end by PID (only started when enabled)
+    http_proxy_pid = get_pid_from_file("x_http_proxy.pid")
+    if http_proxy_pid:
+        kill_process(http_proxy_pid)
+        print(color("✓") + f" HTTP proxy stopped (PID {http_proxy_pid})")
+
+def main():
+    print("Stopping SOCKS5 Proxy...")
+
+    # 0. The headless daemon stops its own children; otherwise stop the launcher's
+    daemon_pid = get_pid_from_file("x_daemon.pid")
+    stopped = True
+    if daemon_pid:
+        stopped = stop_daemon(daemon_pid)
+    else:
+        stop_children()
+
+    # 2c. Kill relay worker pool by PID (started by hand; it stops its workers and tunnels)
+    workers_pid = get_pid_from_file("x_workers.pid")
+    if workers_pid:
+        kill_process(workers_pid)
+        print(color("✓") + f" Worker pool stopped (PID {workers_pid})")
+
     # 3. Disable Registry
     disable_system_proxy()
     
@@ -125,11 +170,15 @@ def main():
     else:
         print(color("⚠") + " Tray Monitor PID file not found. It may have already closed.")
 
-    # 5. Cleanup Files
-    cleanup_files()
+    # 5. Cleanup Files (the daemon removes its PID file itself once it has exited)
+    if stopped:
+        cleanup_files()
     
     print("\n" + "=" * 50)
-    print(color("✓") + " Proxy stopped and cleaned.")
+    if stopped:
+        print(color("✓") + " Proxy stopped and cleaned.")
+    else:
+        print(color("⚠") + " Daemon still draining; run again to finish cleanup.")
     print("=" * 50)
 
 if __name__ == "__main__":
@@ -0,0 +1,327 @@
+"""
+Multi-Core Relay Worker Pool (SO_REUSEPORT)
+Runs N proxy_relay.py workers bound to the same port so the kernel spreads accepted connections.
+Each worker owns its own subset of ssh tunnels; crashed workers and tunnels are restarted
+and per-worker stats are aggregated into one JSON file.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from proxy_relay import parse_upstream
+
+logger = logging.getLogger(__name__)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# ============ SETTINGS ============
+@dataclass
+class PoolSettings:
+    """Worker pool settings."""
+    workers: int = os.cpu_count() or 1
+    listen_host: str = '127.0.0.1'
+    listen_port: int = 1080
+    base_tunnel_port: int = 1081
+    tunnels_per_worker: int = 1
+    relay_args: List[str] = field(default_factory=list)
+    stats_interval: float = 5.0
+    stats_file: str = "x_workers_stats.json"
+    pid_file: str = "x_workers.pid"
+    restart_delay: float = 1.0
+    max_restart_delay: float = 30.0
+
+
+def reuse_port_supported() -> bool:
+    """SO_REUSEPORT load-balances accepts on Linux (BSD/macOS only allow rebinding)."""
+    return hasattr(socket, 'SO_REUSEPORT') and sys.platform.startswith('linux')
+
+
+# ==================== PROCESS SUPERVISION ====================
+class ManagedProcess:
+    """Child process restarted with exponential backoff whenever it exits."""
+
+    def __init__(self, name: str, argv: List[str], settings: PoolSettings,
+                 on_line: Optional[Callable[[str], None]] = None):
+        self.name = name
+        self.argv = argv
+        self.settings = settings
+        self.on_line = on_line
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.starts = 0
+        self.last_error = ''
+
+    async def _read_stdout(self, stream: asyncio.StreamReader) -> None:
+        async for line in stream:
+            try:
+                self.on_line(line.decode(errors='replace').strip())
+            except Exception as e:
+                logger.debug(f"{self.name}: bad stats line: {e}")
+
+    async def _read_stderr(self, stream: asyncio.StreamReader) -> None:
+        async for line in stream:
+            text = line.decode(errors='replace').strip()
+            if text:
+                self.last_error = text
+
+    async def run(self, stopping: asyncio.Event) -> None:
+        """Keep the process running until stopping is set."""
+        delay = self.settings.restart_delay
+        while not stopping.is_set():
+            started = time.monotonic()
+            try:
+                self.proc = await asyncio.create_subprocess_exec(
+                    *self.argv,
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE if self.on_line else asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE,
+                    cwd=HERE
+                )
+            except OSError as e:
+                self.last_error = str(e)
+                logger.error(f"{self.name}: failed to start: {e}")
+            else:
+                self.starts += 1
+                readers = [self._read_stderr(self.proc.stderr)]
+                if self.on_line:
+                    readers.append(self._read_stdout(self.proc.stdout))
+                await asyncio.gather(self.proc.wait(), *readers)
+                if stopping.is_set():
+                    break
+                logger.warning(f"{self.name} (PID {self.proc.pid}) exited with {self.proc.returncode}: "
+                               f"{self.last_error or 'no error output'}")
+
+            if time.monotonic() - started > self.settings.max_restart_delay:
+                delay = self.settings.restart_delay
+            try:
+                await asyncio.wait_for(stopping.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            delay = min(delay * 2, self.settings.max_restart_delay)
+
+    def terminate(self) -> None:
+        if self.proc is not None and self.proc.returncode is None:
+            try:
+                self.proc.terminate()
+            except ProcessLookupError:
+                pass
+
+
+# ==================== WORKER POOL ====================
+class WorkerPool:
+    """Supervisor for relay workers and the ssh tunnels they use."""
+
+    def __init__(self, settings: PoolSettings, tunnel_commands: Optional[List[List[str]]] = None,
+                 upstreams: Optional[List[Tuple[str, int]]] = None):
+        """
+        Args:
+            settings: Pool settings
+            tunnel_commands: One ssh command per tunnel (tunnel i listens on base_tunnel_port + i)
+            upstreams: Existing SOCKS5 upstreams to share instead of spawning tunnels
+        """
+        self.settings = settings
+        self.tunnels = [ManagedProcess(f"tunnel-{i}", cmd, settings) for i, cmd in enumerate(tunnel_commands or [])]
+        if tunnel_commands:
+            upstreams = [('127.0.0.1', settings.base_tunnel_port + i) for i in range(len(tunnel_commands))]
+        self.upstreams = upstreams or [('127.0.0.1', settings.base_tunnel_port)]
+        self.worker_stats: Dict[int, Dict] = {}
+        self.workers = [self._make_worker(k) for k in range(settings.workers)]
+
+    def worker_upstreams(self, index: int) -> List[Tuple[str, int]]:
+        """Tunnels owned by worker index (round-robin split; shared if fewer tunnels than workers)."""
+        owned = self.upstreams[index::self.settings.workers]
+        return owned or [self.upstreams[index % len(self.upstreams)]]
+
+    def _make_worker(self, index: int) -> ManagedProcess:
+        argv = [sys.executable, os.path.join(HERE, 'proxy_relay.py'),
+                '--listen', self.settings.listen_host,
+                '--port', str(self.settings.listen_port),
+                '--stats-interval', str(self.settings.stats_interval)]
+        if self.settings.workers > 1:
+            argv.append('--reuse-port')
+        for host, port in self.worker_upstreams(index):
+            argv += ['--upstream', f'{host}:{port}']
+        relay_args = list(self.settings.relay_args)
+        if '--access-log' in relay_args[:-1] and self.settings.workers > 1:
+            i = relay_args.index('--access-log') + 1
+            relay_args[i] = f"{relay_args[i]}.{index}"  # The ring has a single writer
+        argv += relay_args
+
+        def on_line(line: str) -> None:
+            self.worker_stats[index] = json.loads(line)
+
+        return ManagedProcess(f"worker-{index}", argv, self.settings, on_line)
+
+    def aggregate(self) -> Dict[str, object]:
+        """Sum worker counters and list per-worker and per-tunnel state."""
+        totals: Dict[str, int] = {}
+        for snapshot in self.worker_stats.values():
+            for key, value in snapshot.get('stats', {}).items():
+                totals[key] = totals.get(key, 0) + value
+        return {
+            'updated': int(time.time()),
+            'workers': len(self.workers),
+            'totals': totals,
+            'per_worker': [{
+                'index': k,
+                'pid': w.proc.pid if w.proc else None,
+                'restarts': max(0, w.starts - 1),
+                'last_error': w.last_error,
+                'stats': self.worker_stats.get(k, {}).get('stats', {}),
+                'upstreams': self.worker_stats.get(k, {}).get('upstreams', []),
+            } for k, w in enumerate(self.workers)],
+            'tunnels': [{
+                'port': port,
+                'pid': t.proc.pid if t.proc else None,
+                'restarts': max(0, t.starts - 1),
+                'last_error': t.last_error,
+            } for t, (_, port) in zip(self.tunnels, self.upstreams)],
+        }
+
+    def write_stats(self) -> None:
+        tmp_path = self.settings.stats_file + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.aggregate(), f, indent=2)
+            os.replace(tmp_path, self.settings.stats_file)
+        except OSError as e:
+            logger.warning(f"Failed to write worker stats: {e}")
+
+    async def _stats_loop(self, stopping: asyncio.Event) -> None:
+        while not stopping.is_set():
+            try:
+                await asyncio.wait_for(stopping.wait(), self.settings.stats_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.write_stats()
+
+    async def run(self, stopping: asyncio.Event) -> None:
+        """Run tunnels and workers until stopping is set, then terminate them."""
+        logger.info(f"Starting {len(self.workers)} worker(s) on {self.settings.listen_host}:"
+                    f"{self.settings.listen_port} with {len(self.tunnels)} tunnel(s)")
+        children = self.tunnels + self.workers
+        tasks = [asyncio.ensure_future(c.run(stopping)) for c in children]
+        tasks.append(asyncio.ensure_future(self._stats_loop(stopping)))
+        await stopping.wait()
+        for child in children:
+            child.terminate()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# ==================== TUNNEL COMMANDS ====================
+def build_tunnel_commands(host_name: str, count: int, base_port: int) -> List[List[str]]:
+    """
+    Build ssh -D commands for count tunnels to one host from ~/.ssh/config.
+
+    Args:
+        host_name: Host alias in ssh config
+        count: Number of tunnels
+        base_port: Local SOCKS port of the first tunnel
+
+    Returns:
+        List of ssh commands (empty on error)
+    """
+    from proxy_start_v25 import (config, parse_ssh_config, validate_key_file, build_ssh_command,
+                                 load_passphrase_from_file, ensure_ssh_agent)
+
+    hosts = parse_ssh_config(config.ssh_config_path)
+    host = next((h for h in hosts if h['name'] == host_name), None)
+    if host is None:
+        logger.error(f"Host {host_name} not found in {config.ssh_config_path}")
+        return []
+    key_path = validate_key_file(host.get('IdentityFile', ''))
+    if not key_path:
+        logger.error(f"No usable IdentityFile for {host_name}")
+        return []
+    # Tunnels are restarted unattended, so the key must come from ssh-agent
+    if not ensure_ssh_agent(key_path, load_passphrase_from_file()):
+        logger.warning("Failed to load key into ssh-agent, continuing...")
+    return [build_ssh_command(host, key_path, dynamic_port=base_port + i) for i in range(count)]
+
+
+# ==================== MAIN ====================
+def main() -> None:
+    """Worker pool entry point; unknown options are passed to every proxy_relay.py worker."""
+    parser = argparse.ArgumentParser(description="SO_REUSEPORT relay worker pool with ssh tunnel supervision")
+    parser.add_argument('--host', help="SSH config host to open tunnels to")
+    parser.add_argument('--upstream', action='append', type=parse_upstream,
+                        help="Use existing SOCKS5 upstream host:port instead of spawning tunnels (repeatable)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument('--tunnels-per-worker', type=int, default=1, help="ssh tunnels owned by each worker")
+    parser.add_argument('--listen', default='127.0.0.1', help="Listen address")
+    parser.add_argument('--port', type=int, default=1080, help="Shared listen port")
+    parser.add_argument('--base-tunnel-port', type=int, default=1081, help="Local port of the first tunnel")
+    parser.add_argument('--stats-interval', type=float, default=5.0, help="Stats aggregation interval")
+    parser.add_argument('--stats-file', default="x_workers_stats.json", help="Aggregated stats JSON")
+    parser.add_argument('--pid-file', default="x_workers.pid", help="PID file for proxy_stop.py")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args, relay_args = parser.parse_known_args()
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    workers = max(1, args.workers)
+    if workers > 1 and not reuse_port_supported():
+        logger.warning("SO_REUSEPORT load balancing is not available on this platform, using 1 worker")
+        workers = 1
+
+    settings = PoolSettings(
+        workers=workers,
+        listen_host=args.listen,
+        listen_port=args.port,
+        base_tunnel_port=args.base_tunnel_port,
+        tunnels_per_worker=max(1, args.tunnels_per_worker),
+        relay_args=relay_args,
+        stats_interval=args.stats_interval,
+        stats_file=args.stats_file,
+        pid_file=args.pid_file,
+    )
+
+    tunnel_commands = None
+    if not args.upstream:
+        if not args.host:
+            parser.error("either --host or --upstream is required")
+        tunnel_commands = build_tunnel_commands(args.host, workers * settings.tunnels_per_worker,
+                                                settings.base_tunnel_port)
+        if not tunnel_commands:
+            sys.exit(1)
+
+    pool = WorkerPool(settings, tunnel_commands=tunnel_commands, upstreams=args.upstream)
+
+    async def run() -> None:
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stopping.set)
+            except (NotImplementedError, AttributeError, ValueError):
+                pass
+        await pool.run(stopping)
+
+    try:
+        with open(settings.pid_file, 'w', encoding='utf-8') as f:
+            json.dump({"pid": os.getpid(), "port": settings.listen_port}, f)
+    except OSError as e:
+        logger.warning(f"Failed to save worker pool PID: {e}")
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if os.path.exists(settings.pid_file):
+            os.remove(settings.pid_file)
+    pool.write_stats()
+
+
+if __name__ == "__main__":
+    main()
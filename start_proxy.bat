@@ -7,25 +7,20 @@ if not exist "venv\" (
     python -m venv venv
 )
 
-:: Activating virtual environment...
-call venv\Scripts\activate.bat
+:: Use the venv interpreter directly (no activate.bat round trip)
+set PY=venv\Scripts\python.exe
 
 :: Installing required packages (Optimized check)
 if not exist "venv\Lib\site-packages\pystray" (
     echo Installing required packages...
-    python.exe -m pip install --upgrade pip
-    pip install pystray Pillow pysocks winshell pywin32 paramiko cryptography
+    %PY% -m pip install --upgrade pip
+    %PY% -m pip install pystray Pillow pysocks winshell pywin32 paramiko cryptography
 ) else (
     echo Packages already installed. Skipping pip...
 )
 
-:: Start monitoring tray (Background)
-echo Starting tray monitor...
-start "" pythonw proxy_tray.pyw
-timeout /t 2 /nobreak > nul
-
-:: Start SOCKS5 proxy main script
-python proxy_start_v25.py
+:: Start SOCKS5 proxy main script (attaches the tray monitor once the proxy is up)
+%PY% proxy_start_v25.py
 
 :: Keep window open briefly to see status
 timeout /t 5 /nobreak
@@ -0,0 +1,70 @@
+"""Minimal SOCKS5 server standing in for the SSH tunnel in tests."""
+
+import asyncio
+import time
+from typing import List, Optional, Tuple
+
+from proxy_socks import SOCKS_VERSION, encode_address, pipe, read_address
+
+
+class FakeSocks:
+    """
+    SOCKS5 CONNECT server that dials destinations directly.
+
+    Args:
+        redirect: Optional (host, port) every CONNECT is sent to instead of
+            the requested destination
+        rate: Optional cap in bytes/s for data sent back to the client
+        delay: Seconds added before each CONNECT reply (tunnel latency)
+    """
+
+    def __init__(self, redirect: Optional[Tuple[str, int]] = None, rate: float = 0.0, delay: float = 0.0):
+        self.redirect = redirect
+        self.rate = rate
+        self.delay = delay
+        self.requests: List[Tuple[str, int]] = []
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.port = 0
+
+    async def start(self, host: str = '127.0.0.1') -> 'FakeSocks':
+        self.server = await asyncio.start_server(self._handle, host, 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            _, nmethods = await reader.readexactly(2)
+            await reader.readexactly(nmethods)
+            writer.write(bytes([SOCKS_VERSION, 0]))
+            await reader.readexactly(3)
+            dest = await read_address(reader)
+            self.requests.append(dest)
+            await asyncio.sleep(self.delay)
+            try:
+                up_reader, up_writer = await asyncio.open_connection(*(self.redirect or dest))
+            except OSError:
+                writer.write(bytes([SOCKS_VERSION, 5, 0]) + encode_address('0.0.0.0', 0))
+                writer.close()
+                return
+            writer.write(bytes([SOCKS_VERSION, 0, 0]) + encode_address('127.0.0.1', 0))
+            await asyncio.gather(pipe(reader, up_writer), self._downstream(up_reader, writer))
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _downstream(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        if not self.rate:
+            await pipe(reader, writer)
+            return
+        start, sent = time.monotonic(), 0
+        while data := await reader.read(16384):
+            writer.write(data)
+            await writer.drain()
+            sent += len(data)
+            await asyncio.sleep(max(0.0, start + sent / self.rate - time.monotonic()))
+        writer.write_eof()
@@ -0,0 +1,46 @@
+import struct
+
+from proxy_access_log import HEADER_SIZE, HOST_MAX, RECORD, AccessLog, analyze, read_records
+
+
+def _write(log, n, host='example.com'):
+    for i in range(n):
+        log.write(1000.0 + i, 10.0, 2.0, 100, 200, host, 443, '127.0.0.1', upstream=0, upstream_port=1080)
+
+
+def test_ring_keeps_newest_records(tmp_path):
+    path = str(tmp_path / 'access.log')
+    log = AccessLog(path, capacity=8)
+    _write(log, 20)
+    log.close()
+    records = list(read_records(path))
+    assert [r.seq for r in records] == list(range(12, 20))
+    assert records[0].client == '127.0.0.1' and records[0].upstream == 0
+
+    log = AccessLog(path, capacity=8)  # Reopening continues after the last record
+    assert log.head == 20
+    log.close()
+
+
+def test_long_host_keeps_registrable_suffix(tmp_path):
+    path = str(tmp_path / 'access.log')
+    log = AccessLog(path, capacity=4)
+    host = 'a' * 200 + '.cdn.example.co.uk'
+    _write(log, 1, host)
+    log.close()
+    stored = next(read_records(path)).dest_host
+    assert len(stored) == HOST_MAX
+    assert host.endswith(stored) and stored.endswith('.example.co.uk')
+    report = analyze(read_records(path), {'example.co.uk': 'proxy example.co.uk'})
+    assert list(report['rule_groups']) == ['proxy example.co.uk']
+
+
+def test_slot_being_rewritten_is_skipped(tmp_path):
+    path = str(tmp_path / 'access.log')
+    log = AccessLog(path, capacity=8)
+    _write(log, 4)
+    # Writer stopped between clearing the sequence number and publishing it
+    struct.pack_into('<Q', log._map, HEADER_SIZE + 2 * RECORD.size, 0)
+    log._map.flush()
+    assert [r.seq for r in read_records(path)] == [0, 1, 3]
+    log.close()
@@ -0,0 +1,77 @@
+import asyncio
+import json
+import sys
+
+import pytest
+
+from proxy_daemon import Daemon, DaemonSettings, load_config_file
+from proxy_start_v25 import Config, config
+
+
+@pytest.fixture(autouse=True)
+def restore_config():
+    saved = dict(vars(config))
+    yield
+    vars(config).clear()
+    vars(config).update(saved)
+
+
+def _write(tmp_path, data):
+    path = tmp_path / 'daemon.json'
+    path.write_text(json.dumps(data), encoding='utf-8')
+    return str(path)
+
+
+def test_load_config_file_resets_and_merges(tmp_path):
+    config.dns_stub_enabled = True  # Left over from an earlier load
+    section = load_config_file(_write(tmp_path, {'proxy_port': 1180, 'no_such_key': 1,
+                                                 'daemon': {'host': 'exit-de'}}))
+    assert section == {'host': 'exit-de'}
+    assert config.proxy_port == 1180
+    assert config.dns_stub_enabled == Config().dns_stub_enabled
+    assert config.headless and config.relay_enabled and not config.tray_enabled
+    assert not hasattr(config, 'no_such_key')
+
+    load_config_file(None)
+    assert config.proxy_port == Config().proxy_port
+
+
+def test_load_config_file_rolls_back_invalid_config(tmp_path):
+    load_config_file(_write(tmp_path, {'proxy_port': 1180}))
+    with pytest.raises(ValueError, match='validation'):
+        load_config_file(_write(tmp_path, {'proxy_port': 80}))
+    assert config.proxy_port == 1180
+    with pytest.raises(ValueError, match='JSON object'):
+        load_config_file(_write(tmp_path, [1, 2]))
+    (tmp_path / 'broken.json').write_text('{', encoding='utf-8')
+    with pytest.raises(ValueError, match='Cannot read'):
+        load_config_file(str(tmp_path / 'broken.json'))
+    assert config.proxy_port == 1180
+
+
+def _sleeper(tag):
+    return [sys.executable, '-c', 'import time; time.sleep(60)', tag]
+
+
+def test_apply_restarts_only_changed_children():
+    async def scenario():
+        daemon = Daemon(DaemonSettings(drain_timeout=0))
+        try:
+            await daemon.apply({'tunnel': _sleeper('t'), 'relay': _sleeper('r1'), 'dns': _sleeper('d')})
+            await asyncio.sleep(0.5)
+            first = dict(daemon.children)
+            old_relay, old_dns = first['relay'].proc, first['dns'].proc
+
+            await daemon.apply({'tunnel': _sleeper('t'), 'relay': _sleeper('r2'), 'http': _sleeper('h')})
+            await asyncio.sleep(0.5)
+            return (first, dict(daemon.children), old_relay.returncode, old_dns.returncode,
+                    daemon.children['relay'].proc.returncode)
+        finally:
+            await daemon.stop_children(list(daemon.children), 5)
+
+    first, second, old_relay, old_dns, new_relay = asyncio.run(scenario())
+    assert sorted(second) == ['http', 'relay', 'tunnel']
+    assert second['tunnel'] is first['tunnel']  # Unchanged command keeps its process
+    assert second['relay'] is not first['relay'] and second['relay'].argv[-1] == 'r2'
+    assert old_relay is not None and old_dns is not None  # Changed and removed children stopped
+    assert new_relay is None
@@ -0,0 +1,159 @@
+import asyncio
+import socket
+import struct
+
+from fake_socks import FakeSocks
+from proxy_dns import (FLAG_QR, HEADER, RCODE_NXDOMAIN, RR_FIXED, TYPE_SOA, DnsCache, DnsSettings, DnsStub,
+                       _handle_tcp_client, _UdpProtocol, parse_message)
+
+TYPE_A = 1
+
+
+def _name(name: str) -> bytes:
+    return b''.join(bytes([len(label)]) + label.encode() for label in name.split('.')) + b'\0'
+
+
+def build_query(msg_id: int, name: str) -> bytes:
+    return HEADER.pack(msg_id, 0x0100, 1, 0, 0, 0) + _name(name) + struct.pack('!HH', TYPE_A, 1)
+
+
+def build_response(query: bytes) -> bytes:
+    """A record with TTL 300, or NXDOMAIN with an SOA (TTL 600, MINIMUM 30) for *.missing names."""
+    message = parse_message(query)
+    msg_id, question = message.msg_id, query[HEADER.size:message.question_end]
+    if message.question[0].endswith('missing'):
+        soa = _name('ns.missing') + _name('admin.missing') + struct.pack('!IIIII', 1, 7200, 900, 86400, 30)
+        authority = _name('missing') + RR_FIXED.pack(TYPE_SOA, 1, 600, len(soa)) + soa
+        return HEADER.pack(msg_id, FLAG_QR | RCODE_NXDOMAIN, 1, 0, 1, 0) + question + authority
+    answer = b'\xc0\x0c' + RR_FIXED.pack(TYPE_A, 1, 300, 4) + socket.inet_aton('192.0.2.1')
+    return HEADER.pack(msg_id, FLAG_QR, 1, 1, 0, 0) + question + answer
+
+
+class UpstreamResolver:
+    """DNS-over-TCP server counting the questions it is asked (answers after delay)."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.asked = []
+
+    async def start(self) -> 'UpstreamResolver':
+        self.server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def _handle(self, reader, writer):
+        async def answer(query):
+            await asyncio.sleep(self.delay)
+            response = build_response(query)
+            writer.write(struct.pack('!H', len(response)) + response)
+        try:
+            while True:
+                length = struct.unpack('!H', await reader.readexactly(2))[0]
+                query = await reader.readexactly(length)
+                self.asked.append(parse_message(query).question[0])
+                asyncio.ensure_future(answer(query))  # Pipelined: answers may come out of order
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+
+class _UdpClient(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.answers = asyncio.Queue()
+
+    def datagram_received(self, data, addr):
+        self.answers.put_nowait(data)
+
+
+class Stub:
+    """DnsStub with a manual clock served on UDP and TCP like serve_dns does."""
+
+    async def start(self, delay: float = 0.0) -> 'Stub':
+        self.now = [1000.0]
+        self.upstream = await UpstreamResolver(delay).start()
+        self.socks = await FakeSocks().start()
+        settings = DnsSettings(socks_port=self.socks.port, upstream_host='127.0.0.1',
+                               upstream_port=self.upstream.port)
+        self.stub = DnsStub(settings, cache=DnsCache(clock=lambda: self.now[0]))
+        loop = asyncio.get_running_loop()
+        self.udp, _ = await loop.create_datagram_endpoint(lambda: _UdpProtocol(self.stub),
+                                                          local_addr=('127.0.0.1', 0))
+        self.tcp = await asyncio.start_server(lambda r, w: _handle_tcp_client(self.stub, r, w), '127.0.0.1', 0)
+        self.client, self.client_protocol = await loop.create_datagram_endpoint(
+            _UdpClient, remote_addr=self.udp.get_extra_info('sockname'))
+        return self
+
+    async def query_udp(self, msg_id: int, name: str) -> bytes:
+        self.client.sendto(build_query(msg_id, name))
+        return await asyncio.wait_for(self.client_protocol.answers.get(), 5)
+
+    async def query_tcp(self, msg_id: int, name: str) -> bytes:
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.tcp.sockets[0].getsockname()[1])
+        query = build_query(msg_id, name)
+        writer.write(struct.pack('!H', len(query)) + query)
+        length = struct.unpack('!H', await reader.readexactly(2))[0]
+        response = await reader.readexactly(length)
+        writer.close()
+        return response
+
+    def close(self):
+        self.client.close()
+        self.udp.close()
+        self.tcp.close()
+        self.stub.close()
+        self.upstream.server.close()
+        self.socks.close()
+
+
+def test_cache_hit_over_udp_and_tcp():
+    async def scenario():
+        s = await Stub().start()
+        first = await s.query_udp(1, 'example.com')
+        s.now[0] += 100
+        second = await s.query_tcp(2, 'example.com')
+        stats = dict(s.stub.cache.stats)
+        s.close()
+        return first, second, s.upstream, stats, s.socks.requests
+
+    first, second, upstream, stats, socks_requests = asyncio.run(scenario())
+    assert parse_message(first).msg_id == 1 and parse_message(first).min_answer_ttl == 300
+    # Served from cache with the TTL aged by the 100 s spent there
+    assert parse_message(second).msg_id == 2 and parse_message(second).min_answer_ttl == 200
+    assert upstream.asked == ['example.com']
+    assert stats['hits'] == 1
+    assert socks_requests == [('127.0.0.1', upstream.port)]
+
+
+def test_concurrent_questions_coalesced():
+    async def scenario():
+        s = await Stub().start(delay=0.2)
+        answers = await asyncio.gather(*(s.query_udp(10 + i, 'slow.example') for i in range(3)),
+                                       *(s.query_tcp(20 + i, 'slow.example') for i in range(2)))
+        s.close()
+        return answers, s.upstream.asked
+
+    answers, asked = asyncio.run(scenario())
+    answers = [parse_message(a) for a in answers]
+    assert asked == ['slow.example']
+    assert sorted(a.msg_id for a in answers) == [10, 11, 12, 20, 21]
+    assert all(a.answer_count == 1 for a in answers)
+
+
+def test_negative_answers_cached_for_soa_minimum():
+    async def scenario():
+        s = await Stub().start()
+        results = [await s.query_udp(1, 'www.missing')]
+        s.now[0] += 29
+        results.append(await s.query_tcp(2, 'www.missing'))
+        asked_before_expiry = len(s.upstream.asked)
+        s.now[0] += 2  # Past min(SOA TTL 600, MINIMUM 30)
+        results.append(await s.query_udp(3, 'www.missing'))
+        stats = dict(s.stub.cache.stats)
+        s.close()
+        return results, asked_before_expiry, len(s.upstream.asked), stats
+
+    results, asked_before_expiry, asked, stats = asyncio.run(scenario())
+    assert all(parse_message(r).rcode == RCODE_NXDOMAIN for r in results)
+    assert asked_before_expiry == 1 and asked == 2
+    assert stats['negative_hits'] == 1
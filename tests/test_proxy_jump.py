@@ -0,0 +1,69 @@
+import pytest
+
+from proxy_jump import jump_ssh_options, parse_hop, resolve_jump_chain, split_jump_spec, write_jump_config
+
+
+def test_split_jump_spec():
+    assert split_jump_spec(None) == []
+    assert split_jump_spec(' None ') == []
+    assert split_jump_spec('bastion-a, user@b:2222 ,') == ['bastion-a', 'user@b:2222']
+
+
+def test_parse_hop():
+    assert parse_hop('ssh://admin@gw.example:2222') == {
+        'name': 'ssh://admin@gw.example:2222', 'User': 'admin', 'HostName': 'gw.example', 'Port': '2222'}
+    assert parse_hop('gw.example') == {'name': 'gw.example', 'HostName': 'gw.example'}
+    assert parse_hop('root@[2001:db8::1]:22') == {
+        'name': 'root@[2001:db8::1]:22', 'User': 'root', 'HostName': '2001:db8::1', 'Port': '22'}
+    assert parse_hop('[2001:db8::1]')['HostName'] == '2001:db8::1'
+
+
+def test_resolve_jump_chain_follows_nested_bastions():
+    hosts = [
+        {'name': 'inner', 'HostName': '10.0.0.2', 'proxyjump': 'outer'},
+        {'name': 'outer', 'HostName': 'outer.example'},
+    ]
+    chain = resolve_jump_chain('inner,ops@extra:2200', hosts)
+    assert [hop['name'] for hop in chain] == ['outer', 'inner', 'ops@extra:2200']
+    assert chain[2]['HostName'] == 'extra'
+
+
+def test_resolve_jump_chain_detects_loops():
+    hosts = [
+        {'name': 'a', 'HostName': 'a.example', 'ProxyJump': 'b'},
+        {'name': 'b', 'HostName': 'b.example', 'ProxyJump': 'a'},
+    ]
+    with pytest.raises(ValueError, match='loop'):
+        resolve_jump_chain('a', hosts)
+
+
+def test_write_jump_config_merges_blocks_and_includes_user_config(tmp_path):
+    path = str(tmp_path / 'jump.conf')
+    user_config = str(tmp_path / 'config')
+    first = write_jump_config([parse_hop('ops@a.example')], '/keys/id_a', path)
+    second = write_jump_config([{'name': 'b', 'HostName': 'b.example', 'IdentityFile': '/keys/id_b',
+                                 'IdentitiesOnly': 'yes'}], '/keys/id_a', path, include=user_config)
+    assert second == write_jump_config([{'name': 'b', 'HostName': 'b.example', 'IdentityFile': '/keys/id_b',
+                                         'IdentitiesOnly': 'yes'}], None, path, include=user_config)
+
+    text = open(path, encoding='utf-8').read()
+    assert f'Host {first[0]}\n    HostName a.example\n    User ops\n    IdentityFile "/keys/id_a"\n' in text
+    assert f'Host {second[0]}\n    HostName b.example\n    IdentityFile "/keys/id_b"\n    IdentitiesOnly yes\n' in text
+    # The user config comes once and after every hop block
+    assert text.count('Include') == 1
+    assert text.endswith(f'Match all\n    Include "{user_config}"\n')
+
+
+def test_jump_ssh_options_keep_user_config(tmp_path):
+    path = str(tmp_path / 'jump.conf')
+    user_config = tmp_path / 'config'
+    user_config.write_text('Host *\n    ServerAliveInterval 30\n', encoding='utf-8')
+    hosts = [{'name': 'bastion', 'HostName': 'bastion.example', 'User': 'ops'}]
+    exit_host = {'name': 'exit', 'HostName': 'exit.example', 'ProxyJump': 'bastion'}
+
+    options = jump_ssh_options(exit_host, hosts, None, path, str(user_config))
+    assert options[:2] == ['-F', path] and options[2] == '-J'
+    assert f'Include "{user_config}"' in open(path, encoding='utf-8').read()
+    assert jump_ssh_options({'name': 'direct', 'HostName': 'd.example'}, hosts, None, path) == []
+    assert jump_ssh_options({'name': 'p', 'ProxyCommand': 'nc -X 5 %h %p'}, hosts, None, path) == [
+        '-o', 'ProxyCommand=nc -X 5 %h %p']
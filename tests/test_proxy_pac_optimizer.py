@@ -0,0 +1,122 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from fake_socks import FakeSocks
+from proxy_pac_optimizer import (Measurement, OptimizerSettings, RateLimiter, build_rules, load_domains,
+                                 load_pac_rules, measure_domain, normalize_domain, save_pac_rules)
+
+
+async def _listener(host: str):
+    async def handle(reader, writer):
+        writer.close()
+    server = await asyncio.start_server(handle, host, 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+def _race(socks_delay: float, direct_up: bool = True) -> Measurement:
+    """
+    Destination on 127.0.0.2, tunnel (SOCKS stand-in with added latency) on 127.0.0.3.
+
+    With direct_up False the destination port is closed and only the tunnel, which
+    forwards to a live server on 127.0.0.4, gets through.
+    """
+    async def scenario():
+        server, port = await _listener('127.0.0.2')
+        alive, alive_port = await _listener('127.0.0.4')
+        if not direct_up:
+            server.close()
+            await server.wait_closed()
+        socks = await FakeSocks(redirect=None if direct_up else ('127.0.0.4', alive_port),
+                                delay=socks_delay).start('127.0.0.3')
+        settings = OptimizerSettings(socks_host='127.0.0.3', socks_port=socks.port, port=port, tls=False,
+                                     samples=3, timeout=2.0)
+        try:
+            return await measure_domain('127.0.0.2', settings, RateLimiter(0))
+        finally:
+            socks.close()
+            server.close()
+            alive.close()
+
+    return asyncio.run(scenario())
+
+
+def test_race_prefers_direct_when_tunnel_is_slower():
+    m = _race(socks_delay=0.05)
+    assert m.direct_ms is not None and m.tunnel_ms >= 50
+    assert m.verdict == 'direct'
+    assert m.expires_at > m.measured_at
+
+
+def test_race_prefers_tunnel_when_direct_fails():
+    m = _race(socks_delay=0.0, direct_up=False)
+    assert m.direct_ms is None and m.tunnel_ms is not None
+    assert m.verdict == 'proxy'
+
+
+def _m(domain, direct_ms, tunnel_ms):
+    return Measurement(domain, direct_ms, tunnel_ms, 0.0, 1.0)
+
+
+@pytest.mark.parametrize('direct_ms, tunnel_ms, expected', [
+    (10.0, 100.0, 'direct'),   # Clear win
+    (100.0, 10.0, 'proxy'),
+    (100.0, 115.0, None),      # Within the 20% margin
+    (10.0, 14.0, None),        # 40% faster but under the 5 ms minimum gain
+    (None, 50.0, 'proxy'),     # Only one path works: no margin needed
+    (50.0, None, 'direct'),
+    (None, None, None),
+])
+def test_build_rules_margin_and_min_gain(direct_ms, tunnel_ms, expected):
+    rules = build_rules([_m('example.com', direct_ms, tunnel_ms)], margin=0.2, min_gain_ms=5.0)
+    assert rules == {'direct': ['example.com'] if expected == 'direct' else [],
+                     'proxy': ['example.com'] if expected == 'proxy' else []}
+
+
+def test_build_rules_sorted():
+    rules = build_rules([_m('b.com', 1, 90), _m('a.com', 1, 90), _m('c.com', 90, 1)])
+    assert rules == {'direct': ['a.com', 'b.com'], 'proxy': ['c.com']}
+
+
+def test_save_pac_rules_keeps_other_sections(tmp_path):
+    path = tmp_path / 'pac_rules.json'
+    path.write_text(json.dumps({'direct': ['old.com'], 'proxy': ['old.net'],
+                                'bandwidth_mbps': {'video.example': 20}}), encoding='utf-8')
+    save_pac_rules(str(path), {'direct': ['new.com'], 'proxy': []})
+    data = json.loads(path.read_text(encoding='utf-8'))
+    assert data['bandwidth_mbps'] == {'video.example': 20}
+    assert data['direct'] == ['new.com'] and data['proxy'] == []
+    assert abs(data['generated_at'] - time.time()) < 60
+    assert load_pac_rules(str(path)) == {'direct': ['new.com'], 'proxy': []}
+
+
+def test_save_pac_rules_replaces_unreadable_file(tmp_path):
+    path = tmp_path / 'pac_rules.json'
+    path.write_text('{not json', encoding='utf-8')
+    save_pac_rules(str(path), {'direct': ['a.com'], 'proxy': ['b.com']})
+    assert load_pac_rules(str(path)) == {'direct': ['a.com'], 'proxy': ['b.com']}
+
+
+@pytest.mark.parametrize('line, expected', [
+    ('https://Example.COM:8443/path', 'example.com'),
+    ('user@mail.example.org', 'mail.example.org'),
+    ('# comment', None),
+    ('10.0.0.1', None),
+    ('a..b.com', None),
+    ('x' * 64 + '.com', None),
+])
+def test_normalize_domain(line, expected):
+    assert normalize_domain(line) == expected
+
+
+def test_load_domains_skips_invalid_names():
+    assert load_domains(['a..b.com', 'ok.com', 'OK.com', '-', 'y' * 70 + '.net']) == ['ok.com']
+
+
+@pytest.mark.parametrize('host', ['a..b.com', 'x' * 64 + '.com'])
+def test_unencodable_host_is_a_failed_measurement(host):
+    settings = OptimizerSettings(socks_port=9, tls=False, samples=1, timeout=1.0)
+    m = asyncio.run(measure_domain(host, settings, RateLimiter(0)))
+    assert m.direct_ms is None and m.tunnel_ms is None and m.verdict is None
@@ -0,0 +1,108 @@
+import http.client
+import json
+import socket
+import threading
+
+import pytest
+
+from proxy_pac_rules import compile_pac
+from proxy_pac_server import PacServer, PacServerSettings
+
+PAC = '''function FindProxyForURL(url, host) {
+    host = host.toLowerCase();
+    if (isPlainHostName(host) || host === "localhost") {
+        return "DIRECT";
+    }
+    if (shExpMatch(host, "*.ru")) { return "DIRECT"; }
+    var learnedProxy = {"site0.net.": 1};
+    var learnedDirect = {"site1.net": 1};
+    for (var d = host; d; d = d.indexOf(".") < 0 ? "" : d.substring(d.indexOf(".") + 1)) {
+        if (learnedProxy.hasOwnProperty(d)) {
+            return "SOCKS5 127.0.0.1:1080";
+        }
+        if (learnedDirect.hasOwnProperty(d)) {
+            return "DIRECT";
+        }
+    }
+    return "SOCKS5 127.0.0.1:1080";
+}
+'''
+
+PROXY, DIRECT = "SOCKS5 127.0.0.1:1080", "DIRECT"
+
+
+@pytest.mark.parametrize('host, expected', [
+    ('localhost', DIRECT),
+    ('LocalHost', DIRECT),
+    ('localhost.', PROXY),       # Not a plain host name in the browser either
+    ('mail.ru', DIRECT),
+    ('mail.ru.', PROXY),
+    ('a.site1.net', DIRECT),
+    ('a.site1.net.', PROXY),
+    ('a.site0.net.', PROXY),
+])
+def test_hosts_compared_verbatim(host, expected):
+    rules = compile_pac(PAC)
+    assert rules.resolve(host) == rules.resolve_linear(host) == expected
+
+
+def test_case_kept_without_to_lower_case():
+    rules = compile_pac(PAC.replace('host = host.toLowerCase();', ''))
+    assert rules.resolve('A.SITE1.NET') == rules.resolve_linear('A.SITE1.NET') == PROXY
+    assert rules.resolve('a.site1.net') == DIRECT
+
+
+@pytest.fixture
+def pac_server(tmp_path):
+    pac_file = tmp_path / 'proxy.pac'
+    pac_file.write_text(PAC, encoding='utf-8')
+    server = PacServer(PacServerSettings(port=0, pac_file=str(pac_file)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def _post_json(port, payload):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    conn.request('POST', '/resolve', body=json.dumps(payload), headers={'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    body = response.read()
+    conn.close()
+    return response.status, body
+
+
+@pytest.mark.parametrize('payload', [{'hosts': [1]}, {'hosts': 'mail.ru'}, {'hosts': None}, ['mail.ru'], {}])
+def test_resolve_rejects_malformed_hosts(pac_server, payload):
+    assert _post_json(pac_server, payload)[0] == 400
+    # The handler thread survives and keeps answering
+    status, body = _post_json(pac_server, {'hosts': ['mail.ru', 'https://a.site0.net./x']})
+    assert status == 200
+    assert json.loads(body) == {'results': [DIRECT, PROXY]}
+
+
+def _raw_post(port, content_length, source='127.0.0.1'):
+    """POST head only (no body) on a keep-alive connection; returns the status line."""
+    with socket.create_connection(('127.0.0.1', port), timeout=5, source_address=(source, 0)) as sock:
+        sock.sendall(f"POST /resolve HTTP/1.1\r\nHost: x\r\nContent-Type: text/plain\r\n"
+                     f"Content-Length: {content_length}\r\n\r\n".encode())
+        return sock.makefile('rb').readline()
+
+
+def test_resolve_rejects_negative_content_length(pac_server):
+    assert _raw_post(pac_server, -1).split()[1] == b'400'
+
+
+def test_resolve_checks_client_before_reading_body(tmp_path):
+    pac_file = tmp_path / 'proxy.pac'
+    pac_file.write_text(PAC, encoding='utf-8')
+    server = PacServer(PacServerSettings(port=0, pac_file=str(pac_file)))
+    allowed = server.pac_for
+    server.pac_for = lambda ip: None if ip == '127.0.0.5' else allowed(ip)  # A client outside --allow
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        # Answered without waiting for the announced body
+        assert _raw_post(server.server_address[1], 1000000, source='127.0.0.5').split()[1] == b'403'
+    finally:
+        server.shutdown()
+        server.server_close()
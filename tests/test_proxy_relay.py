@@ -0,0 +1,258 @@
+import asyncio
+
+import pytest
+
+from fake_socks import FakeSocks
+from proxy_relay import Admission, FairScheduler, MemoryBudget, Relay, RelaySettings, ThroughputProber, TokenBucket
+from proxy_socks import SocksError, socks5_handshake
+
+
+async def _echo_server():
+    async def handle(reader, writer):
+        try:
+            while data := await reader.read(65536):
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+    return await asyncio.start_server(handle, '127.0.0.1', 0)
+
+
+class Gateway:
+    """Relay with one fake tunnel upstream and an echo destination."""
+
+    async def start(self, **settings) -> 'Gateway':
+        self.echo = await _echo_server()
+        self.echo_port = self.echo.sockets[0].getsockname()[1]
+        self.socks = await FakeSocks().start()
+        self.relay = Relay(RelaySettings(upstreams=[('127.0.0.1', self.socks.port)], **settings))
+        self.server = await asyncio.start_server(self.relay.handle_client, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.open = []
+        return self
+
+    async def connect(self, client_ip: str):
+        """CONNECT to the echo server from client_ip; the stream stays open until close()."""
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port, local_addr=(client_ip, 0))
+        self.open.append(writer)
+        await socks5_handshake(reader, writer, '127.0.0.1', self.echo_port)
+        writer.write(b'ping')
+        assert await reader.readexactly(4) == b'ping'
+        return writer
+
+    async def close(self):
+        for writer in self.open:
+            writer.close()
+        await asyncio.sleep(0.05)
+        for server in (self.server, self.echo):
+            server.close()
+        self.socks.close()
+        self.relay.close()
+
+
+def test_token_bucket_refills_at_rate():
+    now = [0.0]
+    bucket = TokenBucket(rate=1000, burst=500, clock=lambda: now[0])
+    assert bucket.take(500) == 0
+    assert bucket.take(200) == pytest.approx(0.2)
+    now[0] = 0.2
+    assert bucket.take(200) == 0
+    now[0] = 10.0  # Refill stops at the burst
+    assert bucket.take(2000) == 0  # A full bucket may be overdrawn once
+    assert bucket.tokens == -1500
+    assert bucket.take(100) == pytest.approx(1.6)
+
+
+def test_fair_scheduler_shares_link_between_groups():
+    async def scenario():
+        scheduler = FairScheduler(rate=256 * 1024, quantum=16 * 1024)
+        scheduler.bucket.tokens = 0
+        order = []
+
+        async def send(group):
+            await scheduler.acquire(group, 16 * 1024)
+            order.append(group)
+
+        # One client with six bulk flows queued ahead of a client with two
+        await asyncio.gather(*[send('bulk') for _ in range(6)], *[send('light') for _ in range(2)])
+        return order
+
+    order = asyncio.run(scenario())
+    assert order[:4] == ['bulk', 'light', 'bulk', 'light']
+    assert order[4:] == ['bulk'] * 4
+
+
+def test_memory_budget_blocks_until_release():
+    async def scenario():
+        budget = MemoryBudget(100)
+        await budget.acquire(60)
+        big = asyncio.ensure_future(budget.acquire(60))
+        cancelled = asyncio.ensure_future(budget.acquire(10))
+        small = asyncio.ensure_future(budget.acquire(10))  # Queued behind big although it would fit
+        await asyncio.sleep(0.01)
+        blocked = (big.done(), small.done(), budget.used)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+
+        budget.release(60)
+        await asyncio.sleep(0.01)
+        granted = (big.done(), small.done(), budget.used)
+        budget.release(60)
+        budget.release(10)
+        await budget.acquire(500)  # Clamped to the cap once the budget is free
+        return blocked, granted, budget.used, budget.peak
+
+    blocked, granted, used, peak = asyncio.run(scenario())
+    assert blocked == (False, False, 60)
+    assert granted == (True, True, 70)
+    assert used == 100 and peak == 100
+
+
+def test_allowlist_denies_other_clients():
+    async def scenario():
+        gw = await Gateway().start(allow=['127.0.0.2/32'])
+        await gw.connect('127.0.0.2')
+        with pytest.raises((asyncio.IncompleteReadError, ConnectionError)):
+            await gw.connect('127.0.0.3')
+        stats = dict(gw.relay.stats)
+        clients = set(gw.relay.admission.clients)
+        await gw.close()
+        return stats, clients
+
+    stats, clients = asyncio.run(scenario())
+    assert stats['denied'] == 1 and stats['total'] == 1
+    assert clients == {'127.0.0.2'}  # Denied addresses leave no per-client entry
+
+
+def test_per_client_cap():
+    async def scenario():
+        gw = await Gateway().start(max_client_conns=2)
+        await gw.connect('127.0.0.2')
+        await gw.connect('127.0.0.2')
+        with pytest.raises(SocksError) as refused:
+            await gw.connect('127.0.0.2')
+        await gw.connect('127.0.0.3')  # Other clients are not affected
+        clients = {ip: (c.active, c.rejected) for ip, c in gw.relay.admission.clients.items()}
+        await gw.close()
+        return refused.value.reply, clients
+
+    reply, clients = asyncio.run(scenario())
+    assert reply == 2
+    assert clients == {'127.0.0.2': (2, 1), '127.0.0.3': (1, 0)}
+
+
+def test_queue_timeout_and_handover():
+    async def scenario():
+        gw = await Gateway().start(max_active=1, queue_timeout=0.3)
+        first = await gw.connect('127.0.0.2')
+        with pytest.raises(SocksError) as timed_out:
+            await gw.connect('127.0.0.3')
+        timeouts = gw.relay.admission.clients['127.0.0.3'].timeouts
+
+        gw.relay.admission.queue_timeout = 5.0
+        waiting = asyncio.ensure_future(gw.connect('127.0.0.4'))
+        await asyncio.sleep(0.2)
+        queued = len(gw.relay.admission.waiters)
+        first.close()  # Freed slot goes to the queued client
+        await asyncio.wait_for(waiting, 2)
+        await gw.close()
+        return timed_out.value.reply, timeouts, queued
+
+    reply, timeouts, queued = asyncio.run(scenario())
+    assert reply == 1 and timeouts == 1
+    assert queued == 1
+
+
+def test_idle_clients_are_evicted():
+    async def scenario():
+        admission = Admission(max_clients=8)
+        await admission.acquire('10.0.0.1')  # Stays active
+        for i in range(2, 100):
+            ip = f'10.0.0.{i}'
+            await admission.acquire(ip)
+            admission.release(ip)
+        return admission
+
+    admission = asyncio.run(scenario())
+    assert len(admission.clients) <= 8
+    assert admission.clients['10.0.0.1'].active == 1
+    assert '10.0.0.99' in admission.clients
+
+
+# ==================== THROUGHPUT PROBING ====================
+async def _sink():
+    """HTTP server answering any request with 1 MiB of zeros."""
+    async def handle(reader, writer):
+        try:
+            await reader.readuntil(b'\r\n\r\n')
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 1048576\r\nConnection: close\r\n\r\n")
+            for _ in range(64):
+                writer.write(bytes(16384))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+    return await asyncio.start_server(handle, '127.0.0.1', 0)
+
+
+def test_prober_weights_dispatch_toward_faster_tunnel():
+    async def scenario():
+        sink = await _sink()
+        fast = await FakeSocks().start()
+        slow = await FakeSocks(rate=2_000_000).start()
+        relay = Relay(RelaySettings(upstreams=[('127.0.0.1', slow.port), ('127.0.0.1', fast.port)],
+                                    probe_url=f"http://127.0.0.1:{sink.sockets[0].getsockname()[1]}/",
+                                    probe_interval=0.01, probe_bytes=512 * 1024))
+        prober = ThroughputProber(relay)
+        prober.WINDOW = 0.05
+        task = asyncio.ensure_future(prober.run())
+        while not all(u.probes >= 2 for u in relay.upstreams):
+            await asyncio.sleep(0.05)
+        task.cancel()
+        for server in (sink, fast, slow):
+            server.close()
+        return relay, fast.requests, slow.requests
+
+    relay, fast_requests, slow_requests = asyncio.run(scenario())
+    slow, fast = relay.upstreams
+    assert fast_requests and slow_requests  # Each tunnel was probed through its own port
+    assert 10 < slow.probe_mbps < 24  # 2 MB/s cap is 16 Mbps
+    assert fast.probe_mbps > 3 * slow.probe_mbps
+
+    # Throughput per active connection: the slow tunnel gets its first connection
+    # once the fast one carries about fast/slow of them
+    while relay.choose_upstream() is fast:
+        fast.active += 1
+    assert abs(fast.active - fast.probe_mbps / slow.probe_mbps) <= 1
+
+
+def test_prober_ewma():
+    relay = Relay(RelaySettings(probe_url="http://127.0.0.1:9/"))
+    prober, upstream = ThroughputProber(relay), relay.upstreams[0]
+    prober.record(upstream, 100.0)
+    assert upstream.probe_mbps == 100.0  # First sample seeds the average
+    prober.record(upstream, 50.0)
+    assert upstream.probe_mbps == pytest.approx(0.3 * 50 + 0.7 * 100)
+    assert upstream.probes == 2
+
+
+def test_prober_skips_while_link_busy():
+    async def scenario():
+        relay = Relay(RelaySettings(probe_url="http://127.0.0.1:9/", link_down_mbps=10.0))
+        prober = ThroughputProber(relay)
+        prober.WINDOW = 0.2
+        idle = await prober.saturated()
+
+        async def traffic():
+            while True:
+                relay.stats['bytes_down'] += 125000 // 10  # 10 Mbps
+                await asyncio.sleep(0.01)
+        task = asyncio.ensure_future(traffic())
+        busy = await prober.saturated()
+        task.cancel()
+        return idle, busy
+
+    assert asyncio.run(scenario()) == (False, True)
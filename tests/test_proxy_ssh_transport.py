@@ -0,0 +1,162 @@
+import asyncio
+import socket
+import socketserver
+import threading
+
+import pytest
+
+paramiko = pytest.importorskip('paramiko', minversion='3.2')
+
+from proxy_socks import SocksError  # noqa: E402
+from proxy_ssh_transport import SshTransportPool, SshTransportSettings  # noqa: E402
+
+
+class _Echo(socketserver.BaseRequestHandler):
+    def handle(self):
+        while data := self.request.recv(65536):
+            self.request.sendall(data)
+
+
+class _Server(paramiko.ServerInterface):
+    """Accepts one public key and direct-tcpip to the echo port only."""
+
+    def __init__(self, key, echo_port):
+        self.key, self.echo_port = key, echo_port
+
+    def get_allowed_auths(self, username):
+        return 'publickey'
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL if key == self.key else paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_FAILED_UNKNOWN_CHANNEL_TYPE
+
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        if destination[1] != self.echo_port:
+            return paramiko.OPEN_FAILED_CONNECT_FAILED
+        return paramiko.OPEN_SUCCEEDED
+
+
+class StandInSshd:
+    """Minimal paramiko SSH server forwarding direct-tcpip channels to a local echo server."""
+
+    def __init__(self, client_key):
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.echo = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _Echo)
+        self.echo.daemon_threads = True
+        self.echo_port = self.echo.server_address[1]
+        threading.Thread(target=self.echo.serve_forever, daemon=True).start()
+        self.listener = socket.create_server(('127.0.0.1', 0))
+        self.port = self.listener.getsockname()[1]
+        self.client_key = client_key
+        self.transports = []
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(sock)
+            transport.add_server_key(self.host_key)
+            self.transports.append(transport)
+            transport.start_server(server=_Server(self.client_key, self.echo_port))
+            threading.Thread(target=self._channels, args=(transport,), daemon=True).start()
+
+    def _channels(self, transport):
+        while transport.is_active():
+            channel = transport.accept(1)
+            if channel is not None:
+                threading.Thread(target=self._forward, args=(channel,), daemon=True).start()
+
+    def _forward(self, channel):
+        with socket.create_connection(('127.0.0.1', self.echo_port)) as sock:
+            def upload():
+                while data := channel.recv(65536):
+                    sock.sendall(data)
+                sock.shutdown(socket.SHUT_WR)
+            threading.Thread(target=upload, daemon=True).start()
+            while data := sock.recv(65536):
+                channel.sendall(data)
+        channel.close()
+
+    def close(self):
+        self.listener.close()
+        for transport in self.transports:
+            transport.close()
+        self.echo.shutdown()
+        self.echo.server_close()
+
+
+@pytest.fixture(scope='module')
+def client_key():
+    return paramiko.RSAKey.generate(2048)
+
+
+@pytest.fixture
+def sshd(client_key):
+    server = StandInSshd(client_key)
+    yield server
+    server.close()
+
+
+def _settings(tmp_path, key, port, transports=2):
+    key_path = tmp_path / 'id_rsa'
+    key.write_private_key_file(str(key_path))
+    return SshTransportSettings(hostname='127.0.0.1', port=port, username='test', key_path=str(key_path),
+                                transports=transports, connect_timeout=5.0)
+
+
+def test_channels_relay_and_count_bytes(tmp_path, client_key, sshd):
+    async def scenario():
+        pool = SshTransportPool(_settings(tmp_path, client_key, sshd.port))
+        try:
+            assert await pool.connect_all() == []
+            streams = [await pool.open_connection('127.0.0.1', sshd.echo_port) for _ in range(2)]
+            for reader, writer in streams:
+                writer.write(b'x' * 100000)
+                await writer.drain()
+                assert await reader.readexactly(100000) == b'x' * 100000
+                writer.close()
+            for _ in range(50):
+                if not pool.open:
+                    break
+                await asyncio.sleep(0.05)
+            return pool.snapshot()
+        finally:
+            pool.close()
+
+    snapshot = asyncio.run(scenario())
+    # Channels are spread over both transports
+    assert sorted(t['opened'] for t in snapshot['transports']) == [1, 1]
+    assert all(r['bytes_up'] == r['bytes_down'] == 100000 for r in snapshot['recent_channels'])
+
+
+def test_refused_channel_maps_to_socks_reply(tmp_path, client_key, sshd):
+    async def scenario():
+        pool = SshTransportPool(_settings(tmp_path, client_key, sshd.port, transports=1))
+        try:
+            with pytest.raises(SocksError) as refused:
+                await pool.open_connection('127.0.0.1', 1)
+            return refused.value.reply, pool.snapshot()
+        finally:
+            pool.close()
+
+    reply, snapshot = asyncio.run(scenario())
+    assert reply == 5
+    assert snapshot['failure_reasons'] == {'channel: connect failed': 1}
+    assert snapshot['transports'][0]['active']  # The transport itself stays up
+
+
+def test_rejected_key_reported_as_auth_failure(tmp_path, sshd):
+    async def scenario():
+        pool = SshTransportPool(_settings(tmp_path, paramiko.RSAKey.generate(2048), sshd.port, transports=1))
+        try:
+            return await pool.connect_all()
+        finally:
+            pool.close()
+
+    errors = asyncio.run(scenario())
+    assert len(errors) == 1 and errors[0].startswith('auth: ')